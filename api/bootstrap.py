@@ -0,0 +1,344 @@
+"""
+Progilift Bootstrap API - Chargement initial et deltas du tableau de bord
+=========================================================================
+Endpoints (Authorization: Bearer <JWT de l'utilisateur connecté>, sinon 401):
+  (sans paramètre)  → toutes les tables du dashboard, colonnes utiles seulement
+  ?since=CURSOR     → seulement les lignes dont updated_at >= CURSOR
+  &tables=a,b       → restreint aux tables listées
+
+Réponse: {"status", "tables": {table: {"mode", "key", "order", "rows", "count"}}, "since"},
+écrite au fil des pages (Transfer-Encoding: chunked, gzip si le client
+l'accepte): aucune table n'est gardée en mémoire. Les lignes sortent dans
+l'ordre de la clé; "order" est le tri du dashboard, appliqué par le client
+après chaque chargement ou fusion de delta. Une erreur en cours de flux coupe
+la connexion sans chunk terminal (JSON incomplet, jamais tronqué en silence).
+
+Une table sans colonne updated_at est renvoyée en entier au premier
+chargement et sautée par les deltas (mode "skipped": le client garde sa copie,
+rafraîchie par Realtime). Les lignes supprimées par la réconciliation
+(deleted_at) ne sont jamais servies; en delta, leurs clés sont listées dans
+"deleted" pour que le client les retire.
+
+users et tasks sont lus avec le JWT de l'utilisateur (RLS), les autres
+tables avec la clé serveur, une fois le JWT validé par PostgREST.
+
+Le curseur "since" renvoyé est le plus grand updated_at lu moins
+CURSOR_OVERLAP: updated_at est posé par l'écrivain avant le commit, une ligne
+validée après la lecture peut porter une date antérieure. Les lignes de la
+marge sont renvoyées au delta suivant, le client les fusionne par clé.
+"""
+
+import os
+import base64
+import itertools
+import json
+import re
+import ssl
+import urllib.error
+import urllib.request
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, quote, urlparse
+
+SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
+SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
+SUPABASE_ANON_KEY = os.environ.get('SUPABASE_ANON_KEY', '')
+
+PAGE_SIZE = 1000
+
+# Marge du curseur, au-delà de la durée d'une écriture de sync (maxDuration 300 s) et des écarts d'horloge
+CURSOR_OVERLAP = timedelta(seconds=int(os.environ.get('BOOTSTRAP_OVERLAP_SECONDS', '600')))
+
+# Table → (colonnes affichées par index.html ou '*', tri du dashboard, clé de pagination)
+BOOTSTRAP_TABLES = {
+    'tasks': (
+        'id,title,description,type,status,priority,due_date,scheduled_date,location,'
+        'assigned_to,is_event,created_at,updated_at',
+        'created_at.desc', 'id'),
+    'parts': ('*', 'name', 'id'),
+    'orders': ('*', 'created_at.desc', 'id'),
+    'requests': ('*', 'created_at.desc', 'id'),
+    'equipements': (
+        'id,id_wsoucont,nom,immeuble,ascenseur,nom_convivial,adresse,ville,code_postal,'
+        'secteur,client,marque,modele,typeplanning,localisation,statut,en_panne,score_ml,'
+        'annee_installation,prochain_entretien,prochain_controle,updated_at',
+        'nom', 'id_wsoucont'),
+    'pannes': (
+        'id,id_panne,id_wsoucont,date_signalement,date_appel,heure_appel,motif,cause,'
+        'type_panne,etat,personnes_bloquees,updated_at',
+        'date_signalement.desc', 'id_panne'),
+    'entretiens': ('*', 'date_planifiee.desc', 'id'),
+    'users': ('id,first_name,last_name,role,is_active', None, 'id'),
+    'categories': ('*', 'name', 'id'),
+}
+
+# Tables personnelles: lues avec le JWT de l'utilisateur, les policies RLS s'appliquent
+USER_TABLES = {'users', 'tasks'}
+
+# Tables réconciliées avec Progilift (suppressions douces: deleted_at)
+SOFT_DELETE = {'equipements', 'pannes'}
+
+# Tables vues sans updated_at par cette instance: sautées par les deltas
+NO_UPDATED_AT = set()
+
+try:
+    ssl_context = ssl.create_default_context()
+except:
+    ssl_context = ssl._create_unverified_context()
+
+class BadQuery(Exception):
+    """PostgREST a refusé la requête (colonne inconnue, etc.)"""
+
+class Unauthorized(Exception):
+    """JWT absent, invalide, expiré ou non authentifié"""
+
+def supabase_get(query, token=None):
+    """GET PostgREST: clé serveur, ou JWT de l'utilisateur si token"""
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{query}"
+    headers = {
+        'apikey': (SUPABASE_ANON_KEY or SUPABASE_KEY) if token else SUPABASE_KEY,
+        'Authorization': f'Bearer {token or SUPABASE_KEY}'
+    }
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=20, context=ssl_context) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        if e.code == 400:
+            raise BadQuery(e.read().decode('utf-8', 'replace')[:200])
+        if e.code in (401, 403) and token:
+            raise Unauthorized("invalid or expired token")
+        raise
+
+def bearer_token(header):
+    m = re.match(r'^Bearer\s+([A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+)$', (header or '').strip())
+    return m.group(1) if m else None
+
+def jwt_role(token):
+    """Claim role du JWT (signature vérifiée par PostgREST, pas ici)"""
+    payload = token.split('.')[1]
+    try:
+        return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))).get('role')
+    except ValueError:
+        return None
+
+def check_user(token):
+    """JWT d'un utilisateur connecté, accepté par PostgREST; sinon Unauthorized"""
+    if not token or jwt_role(token) != 'authenticated':
+        raise Unauthorized("authenticated user token required")
+    supabase_get("users?select=id&limit=1", token)
+
+def fetch_pages(table, select, key, since=None, live_only=False, token=None):
+    """Pages keyset sur la clé (live_only: sans les lignes supprimées)"""
+    after = None
+    while True:
+        query = f"{table}?select={select}&order={key}.asc&limit={PAGE_SIZE}"
+        if live_only:
+            query += "&deleted_at=is.null"
+        if since:
+            query += f"&updated_at=gte.{quote(since, safe='')}"
+        if after is not None:
+            query += f"&{key}=gt.{quote(str(after), safe='')}"
+        page = supabase_get(query, token)
+        yield page
+        if len(page) < PAGE_SIZE:
+            return
+        after = page[-1][key]
+
+def open_table(table, since=None, token=None):
+    """(mode, pages): première page lue ici, pour choisir le mode avant d'écrire quoi que ce soit"""
+    select, order, key = BOOTSTRAP_TABLES[table]
+    token = token if table in USER_TABLES else None
+    soft = table in SOFT_DELETE
+    if since and table in NO_UPDATED_AT:
+        return 'skipped', iter(())
+    try:
+        if soft and since:
+            # Delta: les lignes supprimées depuis le curseur sont relues pour être signalées
+            pages = fetch_pages(table, select + ',deleted_at' if select != '*' else select, key, since, token=token)
+        else:
+            pages = fetch_pages(table, select, key, since, live_only=soft, token=token)
+        first = next(pages)
+    except BadQuery:
+        # Colonne absente du schéma: on relit tout et on projette côté Python
+        pages = None
+        if since:
+            try:
+                pages = fetch_pages(table, '*', key, since, token=token)
+                first = next(pages)
+            except BadQuery:
+                NO_UPDATED_AT.add(table)
+                return 'skipped', iter(())
+        if pages is None:
+            pages = fetch_pages(table, '*', key, token=token)
+            first = next(pages)
+        if select != '*':
+            wanted = select.split(',') + ['deleted_at']
+            pages = ([{c: r[c] for c in wanted if c in r} for r in page] for page in pages)
+            first = [{c: r[c] for c in wanted if c in r} for r in first]
+
+    def all_pages():
+        yield first
+        yield from pages
+    return ('delta' if since else 'full'), all_pages()
+
+def split_deleted(page, soft, since):
+    """(lignes servies, lignes supprimées depuis since)"""
+    if not soft:
+        return page, []
+    rows, deleted = [], []
+    for r in page:
+        if r.get('deleted_at'):
+            if since:
+                deleted.append(r)
+        else:
+            r.pop('deleted_at', None)
+            rows.append(r)
+    return rows, deleted
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def parse_stamp(value):
+    """updated_at ou curseur ISO 8601 → datetime UTC (sans fuseau: UTC)"""
+    dt = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+def valid_cursor(value):
+    if not re.match(r'^[0-9T:.+\- Z]+$', value):
+        return False
+    try:
+        parse_stamp(value)
+    except ValueError:
+        return False
+    return True
+
+class Cursor:
+    """Plus grand updated_at lu (lignes et suppressions) moins CURSOR_OVERLAP, jamais avant le curseur précédent"""
+
+    def __init__(self, previous):
+        self.previous = previous
+        self.stamp = None
+
+    def see(self, rows):
+        for r in rows:
+            stamp = r.get('updated_at')
+            if stamp and (self.stamp is None or stamp > self.stamp):
+                self.stamp = stamp
+
+    def value(self):
+        if self.stamp is None and self.previous:
+            return self.previous
+        cursor = parse_stamp(self.stamp) if self.stamp else datetime.now(timezone.utc)
+        cursor -= CURSOR_OVERLAP
+        if self.previous:
+            cursor = max(cursor, parse_stamp(self.previous))
+        return cursor.isoformat()
+
+def iter_bootstrap(since=None, names=None, token=None):
+    """Corps JSON de la réponse, morceau par morceau (une page PostgREST à la fois)"""
+    cursor = Cursor(since)
+    yield b'{"status":"ok","tables":{'
+    for i, table in enumerate(names or BOOTSTRAP_TABLES):
+        _, order, key = BOOTSTRAP_TABLES[table]
+        mode, pages = open_table(table, since, token)
+        head = {"mode": mode, "key": key, "order": order}
+        yield (',' if i else '') + dumps(table) + ':' + dumps(head)[:-1] + ',"rows":['
+        count = 0
+        deleted = []
+        for page in pages:
+            rows, gone = split_deleted(page, table in SOFT_DELETE, since)
+            cursor.see(page)
+            deleted += [r[key] for r in gone]
+            if rows:
+                yield (',' if count else '') + ','.join(dumps(r) for r in rows)
+            count += len(rows)
+        tail = f'],"count":{count}'
+        if deleted:
+            tail += ',"deleted":' + dumps(deleted)
+        yield tail + '}'
+    yield '},"since":' + dumps(cursor.value()) + '}'
+
+def get_bootstrap(since=None, names=None, token=None):
+    """Réponse complète décodée (tests, appels internes)"""
+    return json.loads(''.join(c.decode('utf-8') if isinstance(c, bytes) else c
+                              for c in iter_bootstrap(since, names, token)))
+
+def iter_encoded(chunks, use_gzip):
+    """Morceaux en UTF-8, regroupés par ~64 Ko, compressés en gzip si demandé"""
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None  # wbits=31 → en-tête gzip
+    buf = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+        buf.append(data)
+        size += len(data)
+        if size >= 64 * 1024:
+            data = b''.join(buf)
+            buf, size = [], 0
+            yield comp.compress(data) if comp else data
+    data = b''.join(buf)
+    yield (comp.compress(data) + comp.flush()) if comp else data
+
+class handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, result):
+        body = dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        try:
+            params = parse_qs(urlparse(self.path).query)
+            since = params.get('since', [''])[0] or None
+            names = [t for t in params.get('tables', [''])[0].split(',') if t] or None
+            unknown = [t for t in names or [] if t not in BOOTSTRAP_TABLES]
+            if unknown:
+                return self.send_json(400, {"status": "error", "message": f"unknown tables: {', '.join(unknown)}"})
+            if since and not valid_cursor(since):
+                return self.send_json(400, {"status": "error", "message": "invalid since cursor"})
+            token = bearer_token(self.headers.get('Authorization'))
+            check_user(token)
+            chunks = iter_encoded(iter_bootstrap(since, names, token),
+                                  'gzip' in (self.headers.get('Accept-Encoding') or ''))
+            first = next(chunks)  # erreurs de la première page: encore une réponse JSON normale
+        except Unauthorized as e:
+            return self.send_json(401, {"status": "error", "message": str(e)})
+        except Exception as e:
+            return self.send_json(500, {"status": "error", "message": str(e)})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        try:
+            for chunk in itertools.chain([first], chunks):
+                if chunk:
+                    self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+        except Exception:
+            # En-têtes déjà partis: connexion coupée sans chunk terminal, le client voit un transfert incomplet
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
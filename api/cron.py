@@ -1,191 +1,188 @@
 """
 Endpoint Cron pour Vercel - Sync rapide toutes les heures
-Synchronise: Arrêts + Pannes récentes
+Synchronise: Arrêts (et leur historique arret_intervals) + Pannes récentes, puis recalcule les KPI (kpi_secteurs, kpi_mois)
+et les scores de risque (equipements.score_ml) des équipements touchés, toute la flotte une fois par jour.
+Une seule ligne sync_events résume les tables et plages d'ids écrites.
 """
 
 import os
+import sys
+import importlib.util
 import json
-import re
-import ssl
-import urllib.request
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from http.server import BaseHTTPRequestHandler
 
-SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
-SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
-PROGILIFT_CODE = os.environ.get('PROGILIFT_CODE', 'AUVNB1')
+# Fenêtre pannes: depuis le dernier cron réussi, moins une marge de recouvrement
+CRON_OVERLAP_MINUTES = int(os.environ.get('CRON_OVERLAP_MINUTES', '15'))
+CRON_FALLBACK_DAYS = 30
 
-try:
-    ssl_context = ssl.create_default_context()
-except:
-    ssl_context = ssl._create_unverified_context()
+# Heure du cron qui rescore toute la flotte (récence, visites vieillissent chaque jour); -1 = jamais
+SCORE_FULL_HOUR = int(os.environ.get('SCORE_FULL_HOUR', '3'))
 
-def safe_str(value, max_len=None):
-    if value is None:
-        return None
-    try:
-        s = str(value).strip()
-        return s[:max_len] if max_len and s else s if s else None
-    except:
-        return None
+# Verrou 'sync' de api/sync.py (table sync_runs), TTL à la mesure du maxDuration du cron
+LEASE_TTL = 150
+LEASE_WAIT = 20
+
+def load_core():
+    """Charge api/sync.py (api/ n'est pas un package, cf. includeFiles dans vercel.json)"""
+    if 'progilift_sync' in sys.modules:
+        return sys.modules['progilift_sync']
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sync.py')
+    spec = importlib.util.spec_from_file_location('progilift_sync', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
 
-def safe_int(value):
-    if value is None:
+core = load_core()
+
+def parse_sync_date(value):
+    """Convertit un sync_date Supabase (ISO, avec ou sans fuseau) en datetime naïf"""
+    if not value:
         return None
-    if isinstance(value, int):
-        return value
     try:
-        return int(str(value).strip())
-    except:
+        dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
         return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
 
-def http_request(url, method='GET', data=None, headers=None, timeout=30):
-    try:
-        req = urllib.request.Request(url, data=data, headers=headers or {}, method=method)
-        with urllib.request.urlopen(req, timeout=timeout, context=ssl_context) as resp:
-            return resp.status, resp.read().decode('utf-8')
-    except urllib.error.HTTPError as e:
-        return e.code, ''
-    except Exception as e:
-        return 0, str(e)
-
-def supabase_upsert(table, data):
-    if not SUPABASE_URL or not data:
-        return False
-    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}"
-    headers = {
-        'apikey': SUPABASE_KEY,
-        'Authorization': f'Bearer {SUPABASE_KEY}',
-        'Content-Type': 'application/json',
-        'Prefer': 'resolution=merge-duplicates'
-    }
-    status, _ = http_request(url, 'POST', json.dumps(data).encode(), headers, 30)
-    return status in [200, 201, 204]
-
-def supabase_insert(table, data):
-    if not SUPABASE_URL or not data:
-        return False
-    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}"
-    headers = {
-        'apikey': SUPABASE_KEY,
-        'Authorization': f'Bearer {SUPABASE_KEY}',
-        'Content-Type': 'application/json',
-        'Prefer': 'return=minimal'
-    }
-    status, _ = http_request(url, 'POST', json.dumps(data).encode(), headers, 30)
-    return status in [200, 201, 204]
-
-def supabase_delete(table):
-    if not SUPABASE_URL:
-        return False
-    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}?id=gte.0"
-    headers = {
-        'apikey': SUPABASE_KEY,
-        'Authorization': f'Bearer {SUPABASE_KEY}',
-        'Prefer': 'return=minimal'
-    }
-    status, _ = http_request(url, 'DELETE', None, headers, 30)
-    return status in [200, 204]
-
-def progilift_call(method, params, wsid=None, timeout=30):
-    ws_url = "https://ws.progilift.fr/WS_PROGILIFT_20230419_WEB/awws/WS_Progilift_20230419.awws"
-    
-    params_xml = ""
-    if params:
-        for k, v in params.items():
-            if v is not None:
-                v_esc = str(v).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-                params_xml += f"<ws:{k}>{v_esc}</ws:{k}>"
-    
-    wsid_xml = f'<ws:WSID xsi:type="xsd:hexBinary" soap:mustUnderstand="1">{wsid}</ws:WSID>' if wsid else ""
-    
-    soap = f'''<?xml version="1.0" encoding="UTF-8"?><soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ws="urn:WS_Progilift" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><soap:Header>{wsid_xml}</soap:Header><soap:Body><ws:{method}>{params_xml}</ws:{method}></soap:Body></soap:Envelope>'''
-    
-    headers = {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': f'"urn:WS_Progilift/{method}"'}
-    status, body = http_request(ws_url, 'POST', soap.encode('utf-8'), headers, timeout)
-    
-    return body if status == 200 and body and "Fault" not in body else None
+def get_pannes_since(now=None):
+    """Date dhDerniereMajFichier pour le cron: dernier cron réussi - marge, sinon 30 jours"""
+    now = now or datetime.now()
+    fallback = now - timedelta(days=CRON_FALLBACK_DAYS)
+    rows = core.supabase_get('sync_logs', 'sync_date', 'status=eq.cron&order=sync_date.desc', 1)
+    last = parse_sync_date(rows[0].get('sync_date')) if rows else None
+    if last is None or last < fallback or last > now:
+        return fallback.strftime("%Y-%m-%dT00:00:00"), "fallback"
+    since = last - timedelta(minutes=CRON_OVERLAP_MINUTES)
+    return since.strftime("%Y-%m-%dT%H:%M:%S"), "last_sync"
 
-def parse_items(xml, tag):
-    items = []
-    if not xml:
-        return items
-    for m in re.finditer(f'<{tag}>(.*?)</{tag}>', xml, re.DOTALL):
-        item = {}
-        for f in re.finditer(r'<([A-Za-z0-9_]+)>([^<]*)</\1>', m.group(1)):
-            val = f.group(2).strip()
-            item[f.group(1)] = int(val) if val and val.lstrip('-').isdigit() else (val if val else None)
-        if item:
-            items.append(item)
-    return items
+def id_range(ids):
+    """Plage d'ids pour sync_events: min, max, count"""
+    ids = [i for i in ids if i is not None]
+    return {'min': min(ids) if ids else None, 'max': max(ids) if ids else None, 'count': len(ids)}
 
 def run_cron_sync():
     """Sync rapide pour le cron horaire"""
     start = datetime.now()
-    stats = {"arrets": 0, "pannes": 0, "errors": []}
+    core.sync_batch_clear()
+    stats = {"arrets": 0, "pannes": 0, "pannes_since": None, "pannes_window": None, "errors": []}
+    ranges = {}
+    months = set()
+    touched = set()
     
-    # Auth
-    resp = progilift_call("IdentificationTechnicien", {"sSteCodeWeb": PROGILIFT_CODE}, None, 30)
-    if not resp:
+    # Auth (appels SOAP par api/sync.py: limiteur, disjoncteur, timeouts adaptatifs, cache/replay)
+    wsid = core.get_auth()
+    if not wsid:
         return {"status": "error", "message": "Auth failed"}
     
-    m = re.search(r'WSID[^>]*>([A-F0-9]+)<', resp, re.IGNORECASE)
-    if not m:
-        return {"status": "error", "message": "No WSID"}
-    wsid = m.group(1)
-    
     # 1. Arrêts
     try:
-        resp = progilift_call("get_AppareilsArret", {}, wsid, 30)
-        arrets = parse_items(resp, "tabListeArrets")
-        supabase_delete('appareils_arret')
+        resp = core.progilift_call("get_AppareilsArret", {}, wsid, 30)
+        arrets = core.parse_items(resp, "tabListeArrets")
+        core.supabase_delete('appareils_arret')
         for a in arrets:
-            supabase_insert('appareils_arret', {
-                'id_wsoucont': safe_int(a.get('nIDSOUCONT')),
-                'id_panne': safe_int(a.get('nClepanne')),
-                'date_appel': safe_str(a.get('sDateAppel'), 20),
-                'heure_appel': safe_str(a.get('sHeureAppel'), 20),
-                'motif': safe_str(a.get('sMotifAppel'), 500),
-                'demandeur': safe_str(a.get('sDemandeur'), 100),
+            core.supabase_insert('appareils_arret', {
+                'id_wsoucont': core.safe_int(a.get('nIDSOUCONT')),
+                'id_panne': core.safe_int(a.get('nClepanne')),
+                'date_appel': core.safe_str(a.get('sDateAppel'), 20),
+                'heure_appel': core.safe_str(a.get('sHeureAppel'), 20),
+                'motif': core.safe_str(a.get('sMotifAppel'), 500),
+                'demandeur': core.safe_str(a.get('sDemandeur'), 100),
+                'appel_at': core.progilift_timestamp(a.get('sDateAppel'), a.get('sHeureAppel')),
                 'updated_at': datetime.now().isoformat()
             })
         stats["arrets"] = len(arrets)
+        ranges['appareils_arret'] = id_range(core.safe_int(a.get('nIDSOUCONT')) for a in arrets)
+        # Un appel en échec ou tronqué ne doit pas fermer tous les intervalles ouverts
+        if core.soap_complete(resp):
+            stats["intervals"] = core.update_arret_intervals(arrets)
     except Exception as e:
         stats["errors"].append(f"Arrets: {e}")
     
-    # 2. Pannes récentes (30 derniers jours)
+    # 2. Pannes modifiées depuis le dernier cron réussi (30 jours à défaut)
     try:
-        # Date il y a 30 jours
-        from datetime import timedelta
-        date_30j = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%dT00:00:00")
+        since, window = get_pannes_since(start)
+        stats["pannes_since"] = since
+        stats["pannes_window"] = window
         
-        resp = progilift_call("get_Synchro_Wpanne", {"dhDerniereMajFichier": date_30j}, wsid, 60)
-        items = parse_items(resp, "tabListeWpanne")
+        resp = core.progilift_call("get_Synchro_Wpanne", {"dhDerniereMajFichier": since}, wsid, 60)
+        if not resp:
+            raise RuntimeError("get_Synchro_Wpanne failed")
+        items = core.parse_items(resp, "tabListeWpanne")
         pannes_list = []
+        sizes = [0, 0]
         for p in items:
-            pid = safe_int(p.get('P0CLEUNIK'))
+            pid = core.safe_int(p.get('P0CLEUNIK'))
             if pid:
                 pannes_list.append({
                     'id_panne': pid,
-                    'id_wsoucont': safe_int(p.get('IDWSOUCONT')),
-                    'date_panne': safe_str(p.get('DATE'), 20),
-                    'depanneur': safe_str(p.get('DEPANNEUR'), 100),
-                    'libelle': safe_str(p.get('PANNES'), 200),
-                    'heure_inter': safe_str(p.get('INTER'), 20),
-                    'heure_fin': safe_str(p.get('HRFININTER'), 20),
-                    'data': json.dumps(p),
+                    'id_wsoucont': core.safe_int(p.get('IDWSOUCONT')),
+                    'date_panne': core.safe_str(p.get('DATE'), 20),
+                    'depanneur': core.safe_str(p.get('DEPANNEUR'), 100),
+                    'libelle': core.safe_str(p.get('PANNES'), 200),
+                    'heure_inter': core.safe_str(p.get('INTER'), 20),
+                    'heure_fin': core.safe_str(p.get('HRFININTER'), 20),
+                    'date_panne_at': core.progilift_timestamp(p.get('DATE')),
+                    'data': p,  # dict (ou résiduel en RAW_PAYLOAD_MODE=compact), pas json.dumps()
+                    'deleted_at': None,
                     'updated_at': datetime.now().isoformat()
                 })
+                core.apply_raw_mode(pannes_list[-1], 'data', core.RAW_PAYLOAD_MODE, sizes)
+        failed = 0
         for i in range(0, len(pannes_list), 50):
-            supabase_upsert('pannes', pannes_list[i:i+50])
+            if not core.supabase_upsert('pannes', pannes_list[i:i+50]):
+                failed += 1
         stats["pannes"] = len(pannes_list)
+        stats["payload"] = core.payload_stats(core.RAW_PAYLOAD_MODE, sizes, len(pannes_list))
+        months = core.kpi_months(items, 'DATEAPP')
+        ranges['pannes'] = id_range(p['id_panne'] for p in pannes_list)
+        touched = {p['id_wsoucont'] for p in pannes_list if p['id_wsoucont']}
+        stats["rollups_updated"] = core.update_equipement_rollups(touched)
+        # Un lot perdu ne doit pas faire avancer la fenêtre du prochain cron
+        if failed:
+            stats["errors"].append(f"Pannes: {failed} batch(es) failed")
     except Exception as e:
         stats["errors"].append(f"Pannes: {e}")
     
+    # 3. KPI (un échec ici ne bloque pas la fenêtre du prochain cron)
+    try:
+        # Seuls les mois des pannes de la fenêtre sont relus, les autres repris de kpi_mois
+        kpi = core.update_kpis(months)
+        stats["kpi"] = {k: kpi[k] for k in ("status", "months", "pannes", "kpi_secteurs", "kpi_mois", "duration")}
+        ranges['kpi_secteurs'] = {'min': None, 'max': None, 'count': stats["kpi"]["kpi_secteurs"]}
+        ranges['kpi_mois'] = {'min': None, 'max': None, 'count': stats["kpi"]["kpi_mois"]}
+    except Exception as e:
+        stats["kpi"] = {"status": "error", "message": str(e)}
+    
+    # 4. Scores de risque: équipements dont les cumuls ont bougé, toute la flotte à SCORE_FULL_HOUR
+    try:
+        scores = core.update_scores(None if start.hour == SCORE_FULL_HOUR else touched)
+        stats["scores"] = {k: scores[k] for k in ("status", "scope", "equipements", "updated", "timings")}
+    except Exception as e:
+        stats["scores"] = {"status": "error", "message": str(e)}
+    
+    # Intervalles, cumuls et scores passent par api/sync.py: plages reprises de son lot
+    for table, r in core.sync_batch_summary()["ranges"].items():
+        if table in ('arret_intervals', 'equipements'):
+            ranges[table] = r
+    
+    # Un seul événement pour tout le cron: les clients rafraîchissent une fois
+    if ranges:
+        core.supabase_insert('sync_events', {
+            'tables': sorted(ranges),
+            'ranges': ranges,
+            'source': {'mode': 'cron'},
+            'created_at': datetime.now().isoformat()
+        })
+    
     duration = (datetime.now() - start).total_seconds()
     
     # Log
-    supabase_insert('sync_logs', {
+    core.supabase_insert('sync_logs', {
         'sync_date': datetime.now().isoformat(),
         'status': 'cron' if not stats["errors"] else 'cron_partial',
         'equipements_count': 0,
@@ -210,9 +207,23 @@ class handler(BaseHTTPRequestHandler):
         self._respond()
     
     def _respond(self):
+        owner = core.lease_owner()
+        progress = {"mode": "cron", "started_at": datetime.now().isoformat()}
         try:
-            result = run_cron_sync()
+            deadline = time.monotonic() + LEASE_WAIT
+            acquired = core.lease_acquire(owner, progress, ttl=LEASE_TTL)
+            while not acquired and time.monotonic() < deadline:
+                time.sleep(core.LEASE_POLL)
+                acquired = core.lease_acquire(owner, progress, ttl=LEASE_TTL)
+            if not acquired:
+                result = {"status": "busy", "message": "Another sync is running", "holder": core.lease_holder()}
+            else:
+                try:
+                    result = run_cron_sync()
+                finally:
+                    core.lease_release(owner)
         except Exception as e:
+            # core.LeaseUnavailable compris: sync_runs absente → erreur, pas "busy"
             result = {"status": "error", "message": str(e)}
         
         body = json.dumps(result).encode('utf-8')
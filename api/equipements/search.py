@@ -0,0 +1,280 @@
+"""
+Progilift Search API - Recherche d'équipements côté serveur
+===========================================================
+Endpoints (Authorization: Bearer <JWT de l'utilisateur connecté>, sinon 401):
+  ?q=texte                      → recherche dans adresse, nom_convivial, localisation
+  &secteur=3,71                 → filtres exacts (plusieurs valeurs séparées par des virgules)
+  &ville= &code_postal= &ascenseur= &typeplanning=
+  &page=1&page_size=50          → pagination (page_size max 500); entier invalide → 400
+
+L'index vit dans la mémoire de l'instance chaude: construit une fois depuis
+un snapshot paginé de equipements (sans les lignes supprimées, deleted_at),
+puis rafraîchi par updated_at: une ligne supprimée depuis sort de l'index.
+"""
+
+import os
+import sys
+import importlib.util
+import json
+import re
+import ssl
+import threading
+import time
+import unicodedata
+import urllib.request
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, quote, urlparse
+
+SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
+SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
+
+PAGE_SIZE = 1000
+REFRESH_SECONDS = 60         # delta par updated_at au plus toutes les minutes
+REBUILD_SECONDS = 3600       # reconstruction complète (prend en compte les suppressions)
+MAX_PAGE_SIZE = 500
+
+FACETS = ('secteur', 'ville', 'code_postal', 'ascenseur', 'typeplanning')
+TEXT_FIELDS = ('adresse', 'nom_convivial', 'localisation')
+COLUMNS = ('id_wsoucont',) + FACETS + TEXT_FIELDS + ('updated_at', 'deleted_at')
+
+def load_bootstrap():
+    """Charge api/bootstrap.py pour check_user (cf. includeFiles dans vercel.json)"""
+    if 'progilift_bootstrap' in sys.modules:
+        return sys.modules['progilift_bootstrap']
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bootstrap.py')
+    spec = importlib.util.spec_from_file_location('progilift_bootstrap', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+auth = load_bootstrap()
+
+try:
+    ssl_context = ssl.create_default_context()
+except:
+    ssl_context = ssl._create_unverified_context()
+
+def normalize(text):
+    """Minuscules sans accents ni ponctuation"""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', ' ', text.lower()).strip()
+
+def facet_value(value):
+    return normalize(value) if value is not None else ''
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+def fetch_rows(since=None):
+    """Snapshot paginé (keyset sur id_wsoucont) des colonnes indexées; les supprimées seulement en delta"""
+    after = None
+    headers = {
+        'apikey': SUPABASE_KEY,
+        'Authorization': f'Bearer {SUPABASE_KEY}'
+    }
+    while True:
+        url = (f"{SUPABASE_URL.rstrip('/')}/rest/v1/equipements?select={','.join(COLUMNS)}"
+               f"&order=id_wsoucont.asc&limit={PAGE_SIZE}")
+        if since:
+            url += f"&updated_at=gte.{quote(since, safe='')}"
+        else:
+            url += "&deleted_at=is.null"
+        if after is not None:
+            url += f"&id_wsoucont=gt.{after}"
+        req = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(req, timeout=20, context=ssl_context) as resp:
+            page = json.loads(resp.read().decode('utf-8'))
+        yield from page
+        if len(page) < PAGE_SIZE:
+            return
+        after = page[-1]['id_wsoucont']
+
+class EquipmentIndex:
+    """Index inversé: facettes exactes + tokens/trigrammes sur les champs texte"""
+
+    def __init__(self):
+        self.rows = {}
+        self.facets = {f: {} for f in FACETS}
+        self.tokens = {}
+        self.grams = {}
+        self.texts = {}
+        self.cursor = None
+
+    def _keys(self, row):
+        text = ' '.join(normalize(row.get(f) or '') for f in TEXT_FIELDS)
+        toks = set(text.split())
+        grams = set()
+        for t in toks:
+            grams |= trigrams(t)
+        return text, toks, grams
+
+    def remove(self, id_):
+        row = self.rows.pop(id_, None)
+        if row is None:
+            return
+        for f in FACETS:
+            bucket = self.facets[f].get(facet_value(row.get(f)))
+            if bucket is not None:
+                bucket.discard(id_)
+        _, toks, grams = self._keys(row)
+        for t in toks:
+            self.tokens.get(t, set()).discard(id_)
+        for g in grams:
+            self.grams.get(g, set()).discard(id_)
+        self.texts.pop(id_, None)
+
+    def apply(self, row):
+        """Ligne d'un delta: indexée, ou retirée si supprimée"""
+        if row.get('deleted_at'):
+            self.remove(row.get('id_wsoucont'))
+            stamp = row.get('updated_at')
+            if stamp and (self.cursor is None or stamp > self.cursor):
+                self.cursor = stamp
+        else:
+            self.add(row)
+
+    def add(self, row):
+        id_ = row.get('id_wsoucont')
+        if id_ is None:
+            return
+        self.remove(id_)
+        row.pop('deleted_at', None)  # toujours nul ici, pas renvoyé
+        self.rows[id_] = row
+        for f in FACETS:
+            self.facets[f].setdefault(facet_value(row.get(f)), set()).add(id_)
+        text, toks, grams = self._keys(row)
+        self.texts[id_] = text
+        for t in toks:
+            self.tokens.setdefault(t, set()).add(id_)
+        for g in grams:
+            self.grams.setdefault(g, set()).add(id_)
+        stamp = row.get('updated_at')
+        if stamp and (self.cursor is None or stamp > self.cursor):
+            self.cursor = stamp
+
+    def _text_match(self, q):
+        """ids dont le texte contient chaque mot de q (préfixe pour les mots < 3 lettres)"""
+        result = None
+        for word in normalize(q).split():
+            if len(word) >= 3:
+                cands = None
+                for g in trigrams(word):
+                    ids = self.grams.get(g, set())
+                    cands = set(ids) if cands is None else cands & ids
+                    if not cands:
+                        break
+                cands = {i for i in cands or () if word in self.texts[i]}
+            else:
+                cands = set()
+                for tok, ids in self.tokens.items():
+                    if tok.startswith(word):
+                        cands |= ids
+            result = cands if result is None else result & cands
+            if not result:
+                return set()
+        return result
+
+    def search(self, q=None, filters=None, page=1, page_size=50):
+        ids = None
+        for f, values in (filters or {}).items():
+            matched = set()
+            for v in values:
+                matched |= self.facets[f].get(facet_value(v), set())
+            ids = matched if ids is None else ids & matched
+        if q:
+            text_ids = self._text_match(q)
+            ids = text_ids if ids is None else ids & text_ids
+        if ids is None:
+            ids = self.rows.keys()
+        ordered = sorted(ids)
+        start = (page - 1) * page_size
+        return len(ordered), [self.rows[i] for i in ordered[start:start + page_size]]
+
+# État de l'instance chaude
+INDEX = None
+INDEX_BUILT = 0.0
+INDEX_REFRESHED = 0.0
+INDEX_LOCK = threading.Lock()
+
+def get_index():
+    """Index courant: construit, rafraîchi par delta ou reconstruit selon son âge"""
+    global INDEX, INDEX_BUILT, INDEX_REFRESHED
+    with INDEX_LOCK:
+        now = time.monotonic()
+        if INDEX is None or now - INDEX_BUILT > REBUILD_SECONDS:
+            index = EquipmentIndex()
+            for row in fetch_rows():
+                index.add(row)
+            INDEX, INDEX_BUILT, INDEX_REFRESHED = index, now, now
+        elif now - INDEX_REFRESHED > REFRESH_SECONDS:
+            for row in fetch_rows(INDEX.cursor):
+                INDEX.apply(row)
+            INDEX_REFRESHED = now
+        return INDEX
+
+def int_param(params, name, default):
+    value = params.get(name, [str(default)])[0]
+    if not re.match(r'^\d{1,6}$', value):
+        raise ValueError(f"{name} must be a positive integer")
+    return int(value)
+
+def search_equipements(params):
+    q = params.get('q', [''])[0].strip()
+    filters = {}
+    for f in FACETS:
+        raw = params.get(f, [''])[0]
+        if raw:
+            filters[f] = [v for v in raw.split(',') if v]
+    page = max(int_param(params, 'page', 1), 1)
+    page_size = min(max(int_param(params, 'page_size', 50), 1), MAX_PAGE_SIZE)
+
+    start = time.perf_counter()
+    index = get_index()
+    ready = time.perf_counter()
+    total, rows = index.search(q, filters, page, page_size)
+    return {
+        "status": "ok",
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "results": rows,
+        "index_size": len(index.rows),
+        "index_ms": round((ready - start) * 1000, 2),
+        "took_ms": round((time.perf_counter() - ready) * 1000, 2)
+    }
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status = 200
+        try:
+            params = parse_qs(urlparse(self.path).query)
+            auth.check_user(auth.bearer_token(self.headers.get('Authorization')))
+            result = search_equipements(params)
+        except ValueError as e:
+            status = 400
+            result = {"status": "error", "message": str(e)}
+        except auth.Unauthorized as e:
+            status = 401
+            result = {"status": "error", "message": str(e)}
+        except Exception as e:
+            status = 500
+            result = {"status": "error", "message": str(e)}
+
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,230 @@
+"""
+Progilift Export API - Export en flux des tables equipements / pannes
+=====================================================================
+Endpoints (Authorization: Bearer <JWT de l'utilisateur connecté>, sinon 401):
+  ?table=equipements|pannes     → table à exporter (obligatoire)
+  &format=ndjson|csv            → NDJSON (défaut) ou CSV
+  &gzip=1                       → compression gzip (défaut pour le CSV)
+  &columns=a,b,c                → colonnes exportées (défaut: toutes)
+  &updated_since=ISO            → seulement les lignes modifiées depuis
+  &<colonne>=<op>.<valeur>      → filtre PostgREST (eq, neq, gt, gte, lt, lte, like, ilike, in, is)
+
+Les lignes supprimées par la réconciliation (deleted_at) sont exclues, sauf
+si la requête filtre elle-même deleted_at (ex. &deleted_at=not.is.null).
+Le JWT est validé comme pour /api/bootstrap (check_user) avant tout envoi.
+
+Lecture par pages keyset (clé primaire > dernière clé vue), réponse en
+Transfer-Encoding: chunked: la mémoire reste constante quelle que soit la taille.
+Une erreur en cours de flux coupe la connexion sans chunk terminal: le client
+voit un transfert incomplet, jamais un export tronqué qui paraît complet.
+"""
+
+import os
+import sys
+import csv
+import io
+import json
+import importlib.util
+import re
+import ssl
+import urllib.request
+import zlib
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, quote, urlparse
+
+SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
+SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
+
+# Table exportable → clé primaire utilisée pour la pagination keyset
+TABLES = {
+    'equipements': 'id_wsoucont',
+    'pannes': 'id_panne'
+}
+PAGE_SIZE = 1000
+FILTER_OPS = {'eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'like', 'ilike', 'in', 'is'}
+RESERVED_PARAMS = {'table', 'format', 'gzip', 'columns', 'updated_since'}
+# Paramètres réservés par PostgREST: jamais acceptés comme colonne de filtre
+POSTGREST_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns', 'and', 'or', 'not'}
+IDENT = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+def load_bootstrap():
+    """Charge api/bootstrap.py pour check_user (cf. includeFiles dans vercel.json)"""
+    if 'progilift_bootstrap' in sys.modules:
+        return sys.modules['progilift_bootstrap']
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bootstrap.py')
+    spec = importlib.util.spec_from_file_location('progilift_bootstrap', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+auth = load_bootstrap()
+
+try:
+    ssl_context = ssl.create_default_context()
+except:
+    ssl_context = ssl._create_unverified_context()
+
+def fetch_page(table, select, filters, key, after):
+    """Une page de lignes triées par clé, strictement après la clé `after`"""
+    query = [f"select={select}", f"order={key}.asc", f"limit={PAGE_SIZE}"]
+    query += [f"{col}={quote(expr, safe='.,()*:')}" for col, expr in filters]
+    if after is not None:
+        query.append(f"{key}=gt.{quote(str(after), safe='')}")
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}?{'&'.join(query)}"
+    headers = {
+        'apikey': SUPABASE_KEY,
+        'Authorization': f'Bearer {SUPABASE_KEY}'
+    }
+    req = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(req, timeout=30, context=ssl_context) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+def iter_rows(table, columns, filters):
+    """Parcourt toute la table page par page (keyset), sans rien accumuler"""
+    key = TABLES[table]
+    select = '*' if not columns else ','.join(columns if key in columns else [key] + columns)
+    after = None
+    while True:
+        page = fetch_page(table, select, filters, key, after)
+        if not page:
+            return
+        for row in page:
+            yield row if not columns else {c: row.get(c) for c in columns}
+        if len(page) < PAGE_SIZE:
+            return
+        after = page[-1][key]
+
+def parse_request(query):
+    """Valide les paramètres: (table, format, gzip, colonnes, filtres)"""
+    params = parse_qs(query)
+    table = params.get('table', [''])[0]
+    if table not in TABLES:
+        raise ValueError(f"table must be one of {', '.join(TABLES)}")
+    fmt = params.get('format', ['ndjson'])[0]
+    if fmt not in ('ndjson', 'csv'):
+        raise ValueError("format must be ndjson or csv")
+    use_gzip = params.get('gzip', ['1' if fmt == 'csv' else '0'])[0] == '1'
+
+    columns = [c for c in params.get('columns', [''])[0].split(',') if c]
+    for c in columns:
+        if not IDENT.match(c):
+            raise ValueError(f"invalid column: {c}")
+
+    filters = []
+    updated_since = params.get('updated_since', [''])[0]
+    if updated_since:
+        filters.append(('updated_at', f"gte.{updated_since}"))
+    for col, values in params.items():
+        if col in RESERVED_PARAMS:
+            continue
+        if not IDENT.match(col) or col in POSTGREST_PARAMS:
+            raise ValueError(f"invalid filter column: {col}")
+        for expr in values:
+            op = expr.split('.', 1)[0]
+            if op == 'not':
+                op = expr.split('.', 2)[1] if expr.count('.') >= 2 else ''
+            if op not in FILTER_OPS:
+                raise ValueError(f"invalid filter operator for {col}: {op}")
+            filters.append((col, expr))
+    if not any(col == 'deleted_at' for col, _ in filters):
+        filters.append(('deleted_at', 'is.null'))
+    return table, fmt, use_gzip, columns, filters
+
+def csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return '' if value is None else value
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield (json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8')
+
+def iter_csv(rows, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    header = None
+    for row in rows:
+        if header is None:
+            header = columns or list(row.keys())
+            writer.writerow(header)
+        writer.writerow([csv_value(row.get(c)) for c in header])
+        if buf.tell() >= 64 * 1024:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+def iter_gzip(chunks):
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 → en-tête gzip
+    for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
+
+class handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_error_json(self, status, message):
+        body = json.dumps({"status": "error", "message": message}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        try:
+            table, fmt, use_gzip, columns, filters = parse_request(urlparse(self.path).query)
+            auth.check_user(auth.bearer_token(self.headers.get('Authorization')))
+        except ValueError as e:
+            return self.send_error_json(400, str(e))
+        except auth.Unauthorized as e:
+            return self.send_error_json(401, str(e))
+        except Exception as e:
+            return self.send_error_json(500, str(e))
+
+        rows = iter_rows(table, columns, filters)
+        chunks = iter_ndjson(rows) if fmt == 'ndjson' else iter_csv(rows, columns)
+        if use_gzip:
+            chunks = iter_gzip(chunks)
+
+        ext = 'ndjson' if fmt == 'ndjson' else 'csv'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv; charset=utf-8')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Disposition', f'attachment; filename="{table}.{ext}{".gz" if use_gzip else ""}"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+        except Exception as e:
+            # En-têtes déjà partis: ligne d'erreur lisible (hors gzip), puis connexion coupée
+            # sans chunk terminal pour que le client voie un transfert incomplet
+            self.close_connection = True
+            if not use_gzip:
+                err = json.dumps({"status": "error", "message": str(e)}).encode('utf-8') + b"\n"
+                try:
+                    self.wfile.write(f"{len(err):X}\r\n".encode() + err + b"\r\n")
+                except OSError:
+                    pass
+            return
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
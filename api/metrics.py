@@ -0,0 +1,221 @@
+"""
+Progilift Metrics API - Métriques au format d'exposition Prometheus
+===================================================================
+Endpoint:
+  GET /api/metrics  → text/plain; version=0.0.4
+
+Agrège les lignes sync_metrics écrites par api/sync.py (une par
+invocation: items SOAP, lignes lues/écrites, latences SOAP/PostgREST,
+octets, reprises) dans des compteurs gardés en mémoire par l'instance
+chaude, relus de façon incrémentale (id > dernier id vu). Une instance
+froide ne relit que METRICS_LOOKBACK_DAYS jours (30 par défaut): les
+compteurs Prometheus repartent de là, comme après un redémarrage. L'âge de
+la dernière sync réussie vient de sync_metrics par step et de sync_logs
+pour le cron.
+"""
+
+import os
+import json
+import ssl
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler
+
+SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
+SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
+
+PAGE_SIZE = 1000
+LOOKBACK_DAYS = float(os.environ.get('METRICS_LOOKBACK_DAYS', '30'))
+SUCCESS = {'success', 'done'}
+
+try:
+    ssl_context = ssl.create_default_context()
+except:
+    ssl_context = ssl._create_unverified_context()
+
+def supabase_get(query):
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{query}"
+    headers = {
+        'apikey': SUPABASE_KEY,
+        'Authorization': f'Bearer {SUPABASE_KEY}'
+    }
+    req = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(req, timeout=10, context=ssl_context) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+def epoch(value):
+    """Horodatage ISO (PostgREST) → secondes epoch"""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+class Totals:
+    """Cumul des lignes sync_metrics déjà lues par cette instance"""
+
+    def __init__(self):
+        self.cursor = None
+        self.counts = {}         # (kind, label) → total
+        self.latency = {}        # target → {'bounds', 'buckets', 'sum', 'count'}
+        self.runs = {}           # (step, status) → nombre d'invocations
+        self.last_success = {}   # step → epoch
+
+    def add(self, row):
+        metrics = row.get('metrics') or {}
+        for kind in ('soap_items', 'rows_fetched', 'rows_written', 'bytes_in', 'bytes_out', 'retries', 'dead_letters'):
+            for label, value in (metrics.get(kind) or {}).items():
+                key = (kind, label)
+                if kind == 'rows_fetched' and label.lower().startswith('tabliste'):
+                    key = ('soap_items', label)  # lignes écrites avant la séparation des deux compteurs
+                self.counts[key] = self.counts.get(key, 0) + value
+        bounds = metrics.get('buckets') or []
+        for target, hist in (metrics.get('latency') or {}).items():
+            total = self.latency.get(target)
+            if total is None or total['bounds'] != bounds:
+                # Première observation (ou bornes changées): on repart de ces bornes
+                total = self.latency[target] = {
+                    'bounds': bounds, 'buckets': [0] * (len(bounds) + 1), 'sum': 0.0, 'count': 0}
+            for i, n in enumerate(hist.get('buckets', [])[:len(total['buckets'])]):
+                total['buckets'][i] += n
+            total['sum'] += hist.get('sum', 0)
+            total['count'] += hist.get('count', 0)
+        step = row.get('step') or 'unknown'
+        status = row.get('status') or 'unknown'
+        self.runs[(step, status)] = self.runs.get((step, status), 0) + 1
+        if status in SUCCESS and row.get('created_at'):
+            stamp = epoch(row['created_at'])
+            if stamp > self.last_success.get(step, 0):
+                self.last_success[step] = stamp
+
+    def refresh(self):
+        """Lit les nouvelles lignes sync_metrics (keyset sur id; LOOKBACK_DAYS au premier appel)"""
+        added = 0
+        since = None
+        if self.cursor is None:
+            since = (datetime.now(timezone.utc) - timedelta(days=LOOKBACK_DAYS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        while True:
+            query = f"sync_metrics?select=id,step,status,metrics,created_at&order=id.asc&limit={PAGE_SIZE}"
+            if self.cursor is not None:
+                query += f"&id=gt.{self.cursor}"
+            elif since:
+                query += f"&created_at=gte.{since}"
+            page = supabase_get(query)
+            for row in page:
+                self.add(row)
+            added += len(page)
+            if page:
+                self.cursor = page[-1]['id']
+            if len(page) < PAGE_SIZE:
+                return added
+
+# État de l'instance chaude
+TOTALS = Totals()
+TOTALS_LOCK = threading.Lock()
+SCRAPES = {'count': 0, 'errors': 0}
+
+def last_cron_success():
+    """Dernier cron complet (sync_logs.status = cron)"""
+    rows = supabase_get("sync_logs?select=sync_date&status=eq.cron&order=sync_date.desc&limit=1")
+    return epoch(rows[0]['sync_date']) if rows and rows[0].get('sync_date') else None
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**kv):
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in kv.items()) + '}'
+
+def fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(totals, cron_success, now, scrape_seconds):
+    """Texte d'exposition Prometheus"""
+    out = []
+
+    def family(name, kind, help_text, samples):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for suffix, lbl, value in samples:
+            out.append(f"{name}{suffix}{lbl} {fmt(value)}")
+
+    def counter(kind, name, label, help_text):
+        samples = sorted((('', labels(**{label: k[1]}), v) for k, v in totals.counts.items() if k[0] == kind))
+        family(name, 'counter', help_text, samples)
+
+    counter('soap_items', 'progilift_sync_soap_items_total', 'tag',
+            "Items SOAP lus, par balise tabListe*")
+    counter('rows_fetched', 'progilift_sync_rows_fetched_total', 'table',
+            "Lignes lues dans Supabase")
+    counter('rows_written', 'progilift_sync_rows_written_total', 'table',
+            "Lignes écrites avec succès dans Supabase")
+    family('progilift_sync_bytes_total', 'counter', "Octets transférés par cible et sens", sorted(
+        ('', labels(target=k[1], direction=k[0][6:]), v)
+        for k, v in totals.counts.items() if k[0] in ('bytes_in', 'bytes_out')))
+    counter('retries', 'progilift_sync_retries_total', 'target',
+            "Requêtes rejouées (spool des écritures en échec)")
+    counter('dead_letters', 'progilift_sync_dead_letters_total', 'table',
+            "Écritures abandonnées (4xx définitif, trop de tentatives ou trop anciennes)")
+
+    samples = []
+    for target in sorted(totals.latency):
+        hist = totals.latency[target]
+        cumulative = 0
+        for bound, n in zip(list(hist['bounds']) + ['+Inf'], hist['buckets']):
+            cumulative += n
+            samples.append(('_bucket', labels(target=target, le=bound), cumulative))
+        samples.append(('_sum', labels(target=target), round(hist['sum'], 6)))
+        samples.append(('_count', labels(target=target), hist['count']))
+    family('progilift_request_duration_seconds', 'histogram', "Latence des appels SOAP et PostgREST", samples)
+
+    family('progilift_sync_runs_total', 'counter', "Invocations de la sync par step et statut", sorted(
+        ('', labels(step=step, status=status), n) for (step, status), n in totals.runs.items()))
+
+    last = dict(totals.last_success)
+    if cron_success:
+        last['cron'] = max(last.get('cron', 0), cron_success)
+    family('progilift_sync_last_success_timestamp_seconds', 'gauge', "Dernière sync réussie par step (epoch)",
+           sorted(('', labels(step=step), round(t, 3)) for step, t in last.items()))
+    family('progilift_sync_last_success_age_seconds', 'gauge', "Âge de la dernière sync réussie par step",
+           sorted(('', labels(step=step), round(now - t, 3)) for step, t in last.items()))
+
+    family('progilift_metrics_scrapes_total', 'counter', "Scrapes servis par cette instance",
+           [('', '', SCRAPES['count'])])
+    family('progilift_metrics_scrape_errors_total', 'counter', "Scrapes en erreur sur cette instance",
+           [('', '', SCRAPES['errors'])])
+    family('progilift_metrics_scrape_duration_seconds', 'gauge', "Durée de la lecture Supabase du scrape",
+           [('', '', round(scrape_seconds, 6))])
+    return '\n'.join(out) + '\n'
+
+def get_metrics():
+    started = time.monotonic()
+    with TOTALS_LOCK:
+        SCRAPES['count'] += 1
+        try:
+            TOTALS.refresh()
+            cron_success = last_cron_success()
+        except Exception:
+            SCRAPES['errors'] += 1
+            raise
+        return render(TOTALS, cron_success, time.time(), time.monotonic() - started)
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status = 200
+        try:
+            body = get_metrics()
+        except Exception as e:
+            status = 500
+            body = f"# error: {escape(e)}\n"
+
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
@@ -8,24 +8,183 @@ Endpoints:
   ?step=2b&sector=X → Wsoucont2: passages, DAT, TXT (0-21)
   ?step=3&period=X  → Pannes (0-6)
   ?step=4           → Mise à jour nb_visites_an
+  ?step=5           → Agrégats KPI (kpi_secteurs, kpi_mois)
+  ?step=6           → Score de risque de panne (equipements.score_ml)
+  ?mode=rollups     → Recalcul complet des cumuls pannes sur equipements
   ?mode=cron        → Sync rapide (arrêts + pannes récentes)
+  ?mode=fanout      → coordinateur: lance en parallèle les shards de &steps=2,2b,3
+                      (auto-invocations ?step=..., &concurrency=N au plus), vague par vague
+  ?mode=status&run=ID → avancement et échecs d'un fan-out (lignes fanout:ID:* de sync_runs)
+  &raw=compact      → data_wsoucont/data_wsoucont2/data_wpanne ne gardent que
+                      les champs non repris dans une colonne (cf. rebuild_raw)
+  &lowmem=1         → (step 3) réponse Wpanne sur disque + mmap, items lus un à un,
+                      upserts par lots: mémoire bornée quel que soit l'historique
+  &memtrace=1       → (step 3) pic tracemalloc dans le résultat (coûteux en CPU)
+  &profile=1        → exécute le step sous cProfile + tracemalloc et ajoute le
+                      rapport au résultat (en-tête X-Profile-Secret = SYNC_PROFILE_SECRET)
+  &engine=async     → E/S HTTP du step sur une boucle asyncio (asyncio.open_connection,
+                      TLS, keep-alive): écritures Supabase en vol, SYNC_ASYNC_CONCURRENCY
+                      requêtes simultanées au plus
+  &replay=1         → rejoue le step depuis les réponses SOAP en cache
+                      (SOAP_CACHE_DIR), sans aucun appel à Progilift
+  &reconcile=soft|hard → (steps 2 et 3) supprime les lignes absentes de la réponse
+                      Progilift (secteur / pannes appelées depuis la période):
+                      soft = deleted_at, hard = DELETE; refusé au-delà de
+                      RECONCILE_MAX_RATIO sans &force=1
+
+Chaque step prend le verrou 'sync' dans la table sync_runs
+(name, owner, expires_at, progress, updated_at). Si le verrou est pris:
+  &wait=N           → attend jusqu'à N secondes (max 30) avant d'abandonner
+sinon la réponse est immédiate avec status "busy" et la progression du détenteur.
+Si sync_runs est absente ou en erreur, la réponse est "error", jamais "busy"
+(schéma: supabase/migrations/).
+Les shards d'un fan-out reçoivent &fanout=ID (résultat noté dans sync_runs)
+et &shard=, HMAC de l'ID et de l'owner du coordinateur par SYNC_FANOUT_SECRET:
+le verrou est rejoint sans être libéré, l'owner n'apparaît jamais dans une URL
+ni dans une réponse.
+
+Les appels Progilift ont un timeout appris des latences récentes (p95 par
+méthode et secteur ou période, ligne 'progilift' de sync_runs), un disjoncteur
+qui coupe après plusieurs échecs consécutifs puis ne laisse passer qu'un appel
+d'essai, et une requête de couverture pour les lectures légères.
+Ils passent tous par un limiteur (seau à jetons + concurrence max), partagé
+entre threads et, avec PROGILIFT_SHARED_LIMIT=1 ou dans un shard de fan-out,
+entre instances via sync_runs (un seul débit pour tous les shards).
+
+Le step 1 tient aussi l'historique des arrêts dans arret_intervals
+(id_wsoucont, id_panne, motif, started_at, ended_at): un intervalle est
+ouvert quand l'appareil apparaît dans get_AppareilsArret et fermé quand il
+en sort; seules les lignes qui changent sont écrites.
+
+Les lots en échec passager (réseau, 5xx, 429) sont mis en attente (NDJSON
+gzip dans SYNC_SPOOL_DIR) et rejoués au début de l'invocation suivante; un
+autre 4xx, SYNC_SPOOL_MAX_ATTEMPTS échecs ou SYNC_SPOOL_MAX_AGE dépassé les
+envoie en lettre morte (deadletter-*.ndjson.gz, jamais rejoués). Un fichier
+de spool illisible est rejoué jusqu'au point de rupture puis gardé en lettre morte.
+
+Chaque step terminé écrit une seule ligne dans sync_events (tables touchées
+et plages d'ids): les clients s'y abonnent au lieu d'écouter chaque ligne.
+Chaque invocation écrit aussi ses compteurs (items SOAP, lignes lues et
+écrites, latences, octets, reprises) dans sync_metrics, agrégés par /api/metrics.
 """
 
 import os
+import asyncio
+import cProfile
+import glob
+import gzip
+import hashlib
+import hmac
 import json
+import math
+import mmap
+import pstats
 import re
+import resource
+import shutil
+import socket
 import ssl
+import sys
+import tempfile
+import threading
+import time
 import traceback
+import tracemalloc
 import urllib.request
-from datetime import datetime
+import uuid
+from array import array
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed, wait as futures_wait
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from http.server import BaseHTTPRequestHandler
-from urllib.parse import parse_qs, urlparse
+from zoneinfo import ZoneInfo
+from urllib.parse import parse_qs, quote, urlparse, urlsplit
 
 # Configuration
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
 PROGILIFT_CODE = os.environ.get('PROGILIFT_CODE', 'AUVNB1')
-WS_URL = "https://ws.progilift.fr/WS_PROGILIFT_20230419_WEB/awws/WS_Progilift_20230419.awws"
+PROGILIFT_TZ = os.environ.get('PROGILIFT_TZ', 'Europe/Paris')
+WS_URL = os.environ.get('PROGILIFT_WS_URL', "https://ws.progilift.fr/WS_PROGILIFT_20230419_WEB/awws/WS_Progilift_20230419.awws")
+
+# Verrou distribué (table sync_runs)
+LEASE_NAME = 'sync'
+LEASE_TTL = 330          # maxDuration de la fonction + marge
+LEASE_MAX_WAIT = 30
+LEASE_POLL = 2
+
+# Réconciliation des suppressions (steps 2 et 3)
+RECONCILE_MODES = ('soft', 'hard')
+RECONCILE_CHUNK = 200              # ids par filtre in.(...)
+RECONCILE_MAX_RATIO = 0.2          # part max de lignes supprimées sans &force=1
+RECONCILE_BITMAP_SPAN = 1 << 26    # écart d'ids max pour la bitmap (8 Mo), sinon set
+NOT_DELETED = 'deleted_at=is.null'  # lecteurs de equipements / pannes: sans les lignes supprimées (soft)
+
+# Stockage du payload brut: 'full' (dict source complet) ou 'compact' (résiduel)
+RAW_PAYLOAD_MODE = os.environ.get('RAW_PAYLOAD_MODE', 'full')
+
+# Résilience Progilift: les timeouts passés par les steps deviennent des plafonds
+HEALTH_ROW = 'progilift'          # ligne de sync_runs qui porte l'état entre invocations
+LATENCY_WINDOW = 50               # durées gardées par clé (méthode, plus secteur ou période)
+LATENCY_MIN_SAMPLES = 5
+TIMEOUT_FACTOR = 3                # timeout = p95 x 3, borné par [TIMEOUT_FLOOR, plafond]
+TIMEOUT_FLOOR = 10
+CIRCUIT_FAILURES = 3              # échecs consécutifs avant ouverture
+CIRCUIT_OPEN_SECONDS = 300       # puis demi-ouvert: un seul appel d'essai, toutes instances confondues
+# Lectures seules: IdentificationTechnicien ouvre une session (WSID) à chaque appel
+HEDGE_METHODS = {'get_AppareilsArret', 'get_Synchro_Wtypepla'}
+HEDGE_DEFAULT_DELAY = 2.0
+
+# Limiteur de débit Progilift: jetons/s, rafale, requêtes simultanées par instance
+PROGILIFT_RATE = float(os.environ.get('PROGILIFT_RATE', '2'))
+PROGILIFT_BURST = int(os.environ.get('PROGILIFT_BURST', '4'))
+PROGILIFT_CONCURRENCY = int(os.environ.get('PROGILIFT_CONCURRENCY', '4'))
+PROGILIFT_SHARED_LIMIT = os.environ.get('PROGILIFT_SHARED_LIMIT', '') == '1'
+RATE_ROW = 'progilift-rate'       # ligne de sync_runs du seau partagé entre instances
+
+# Cache des réponses SOAP brutes (gzip, désactivé si vide) et mode rejeu (?replay=1)
+SOAP_CACHE_DIR = os.environ.get('SOAP_CACHE_DIR', '')
+SOAP_CACHE_SKIP = {'IdentificationTechnicien'}
+SOAP_REPLAY = False
+
+# Profilage à la demande (?profile=1): désactivé tant que le secret est vide
+PROFILE_SECRET = os.environ.get('SYNC_PROFILE_SECRET', '')
+PROFILE_TOP = 25
+PROFILE_PHASES = ('progilift_call', 'progilift_call_file', 'parse_items', 'iter_items_file',
+                  'panne_row', 'apply_raw_mode', 'supabase_upsert', 'supabase_insert',
+                  'supabase_update', 'supabase_get', 'supabase_stream')
+
+# Simulation (CLI --dry-run): aucune écriture Supabase, les lectures sont conservées
+DRY_RUN = False
+
+# Moteur asyncio (?engine=async, CLI --engine async): requêtes HTTP en vol au plus
+ASYNC_CONCURRENCY = int(os.environ.get('SYNC_ASYNC_CONCURRENCY', '16'))
+ASYNC_ENGINE = None
+
+# Fan-out (?mode=fanout): URL des auto-invocations (défaut: /api/sync de l'hôte appelé).
+# Désactivé tant que le secret est vide: il signe le jeton &shard= de chaque shard
+FANOUT_URL = os.environ.get('SYNC_FANOUT_URL', '')
+FANOUT_SECRET = os.environ.get('SYNC_FANOUT_SECRET', '')
+FANOUT_STEPS = ('2', '2b', '3')
+FANOUT_CONCURRENCY = int(os.environ.get('SYNC_FANOUT_CONCURRENCY', '8'))
+FANOUT_MAX_CONCURRENCY = 32
+FANOUT_DISPATCH_BUDGET = 150      # plus de nouveau shard au-delà (s): la suite via "next"
+FANOUT_DEADLINE = 280             # attente max des shards lancés (maxDuration 300)
+FANOUT_SHARD_TIMEOUT = 310
+FANOUT_SHARD = False              # invocation courante = shard: limiteur partagé forcé
+
+# Pannes en mémoire bornée (?lowmem=1): taille des lots d'upsert
+PANNES_LOWMEM = os.environ.get('PANNES_LOWMEM', '') == '1'
+PANNES_BATCH = 500
+EQUIPEMENTS_BATCH = 500   # step 2: lignes par upsert (2b reste un PATCH par équipement: valeurs propres à chaque ligne)
+
+# File d'attente des écritures Supabase en échec
+SPOOL_DIR = os.environ.get('SYNC_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'progilift-spool'))
+SPOOL_SKIP = {'appareils_arret', 'type_planning', 'sync_runs', 'arret_intervals',  # recalculés à chaque run / verrou
+              'sync_events', 'sync_metrics'}                                      # journaux propres à l'invocation
+SPOOL_MAX_ATTEMPTS = int(os.environ.get('SYNC_SPOOL_MAX_ATTEMPTS', '5'))
+SPOOL_MAX_AGE = int(os.environ.get('SYNC_SPOOL_MAX_AGE', str(2 * 86400)))   # s, au-delà: lettre morte
 
 # Liste des 22 secteurs
 SECTORS = ["1", "2", "3", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15", "17", "18", "19", "20", "71", "72", "73", "74"]
@@ -47,6 +206,12 @@ try:
 except:
     ssl_context = ssl._create_unverified_context()
 
+# Fuseau des dates Progilift (naïves dans les réponses SOAP)
+try:
+    progilift_tz = ZoneInfo(PROGILIFT_TZ)
+except Exception:
+    progilift_tz = None
+
 # ============================================================
 # UTILITAIRES
 # ============================================================
@@ -72,30 +237,640 @@ def safe_int(value):
     except:
         return None
 
+FILTER_SAFE = re.compile(r'^[A-Za-z0-9_.:-]{1,128}$')
+
+def filter_value(value):
+    """Valeur insérée telle quelle dans un filtre PostgREST (y compris or=(...)): ValueError sinon"""
+    value = str(value)
+    if not FILTER_SAFE.match(value):
+        raise ValueError(f"unsafe filter value: {value[:40]!r}")
+    return value
+
+@lru_cache(maxsize=65536)
+def parse_progilift_datetime(date, heure=None):
+    """Date Progilift → datetime naïf (heure locale Progilift), mis en cache
+
+    date:  AAAAMMJJ (str ou int), AAAA-MM-JJ[THH:MM:SS], JJ/MM/AAAA[ HH:MM[:SS]] ou
+           AAAAMMJJHHMMSS[mmm] (DATE_HEURE_MODIF)
+    heure: HHMM, HHMMSS[CC], HH:MM[:SS] ou HMM
+    """
+    if not date:
+        return None
+    d = str(date).strip()
+    if '/' in d:
+        day, _, time_part = d.partition(' ')
+        parts = day.split('/')
+        if len(parts) != 3:
+            return None
+        d = parts[2].zfill(4) + parts[1].zfill(2) + parts[0].zfill(2)
+        if heure is None and time_part.strip():
+            heure = time_part
+    else:
+        d = d.replace('-', '').replace('T', '').replace(':', '').replace(' ', '')
+        if len(d) > 8 and heure is None:
+            heure = d[8:14]
+    d = d[:8]
+    if len(d) != 8 or not d.isdigit() or d == '00000000':
+        return None
+    t = str(heure or '').replace(':', '').strip()
+    if len(t) in (3, 5):
+        t = t.zfill(len(t) + 1)
+    t = t[:6].ljust(6, '0')
+    if not t.isdigit():
+        t = '000000'
+    try:
+        return datetime(int(d[:4]), int(d[4:6]), int(d[6:8]), int(t[:2]), int(t[2:4]), int(t[4:6]))
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=65536)
+def progilift_timestamp(date, heure=None):
+    """Horodatage ISO 8601 (avec le fuseau Progilift) pour les colonnes *_at"""
+    dt = parse_progilift_datetime(date, heure)
+    if dt is None:
+        return None
+    return (dt.replace(tzinfo=progilift_tz) if progilift_tz else dt).isoformat()
+
+@lru_cache(maxsize=65536)
+def progilift_date(value):
+    """Date ISO (AAAA-MM-JJ) pour les colonnes *_date"""
+    dt = parse_progilift_datetime(value)
+    return dt.date().isoformat() if dt else None
+
 def http_request(url, method='GET', data=None, headers=None, timeout=30):
     """Requête HTTP générique"""
+    if DRY_RUN and method != 'GET' and '/rest/v1/' in url:
+        return (204 if method in ('PATCH', 'DELETE') else 201), ''
     headers = headers or {}
     if data and isinstance(data, (dict, list)):
-        data = json.dumps(data).encode('utf-8')
+        data = json.dumps(data, default=json_default).encode('utf-8')
         headers.setdefault('Content-Type', 'application/json')
     elif data and isinstance(data, str):
         data = data.encode('utf-8')
+    if ASYNC_ENGINE is not None:
+        status, raw = ASYNC_ENGINE.request(url, method, data, headers, timeout)
+        return status, raw.decode('utf-8', 'replace')
     
+    target = 'soap' if url == WS_URL else 'postgrest'
+    metric_count('bytes_out', target, len(data) if data else 0)
     req = urllib.request.Request(url, data=data, method=method, headers=headers)
+    started = time.monotonic()
     try:
         with urllib.request.urlopen(req, timeout=timeout, context=ssl_context) as resp:
-            return resp.status, resp.read().decode('utf-8')
+            raw = resp.read()
+            metric_count('bytes_in', target, len(raw))
+            return resp.status, raw.decode('utf-8')
     except urllib.error.HTTPError as e:
         return e.code, e.read().decode('utf-8') if e.fp else str(e)
     except Exception as e:
         return 0, str(e)
+    finally:
+        metric_latency(target, time.monotonic() - started)
+
+def http_request_to_file(url, method, data, headers, out, timeout=30):
+    """Requête HTTP dont le corps de réponse est recopié par blocs dans `out`"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    target = 'soap' if url == WS_URL else 'postgrest'
+    metric_count('bytes_out', target, len(data) if data else 0)
+    req = urllib.request.Request(url, data=data, method=method, headers=headers or {})
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout, context=ssl_context) as resp:
+            shutil.copyfileobj(resp, out, 1 << 16)
+            metric_count('bytes_in', target, out.tell())
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception:
+        return 0
+    finally:
+        metric_latency(target, time.monotonic() - started)
+
+# ============================================================
+# MOTEUR ASYNCIO (HTTP stdlib sur asyncio.open_connection)
+# ============================================================
+
+class AsyncEngine:
+    """Boucle asyncio dans un thread dédié, partagée par les steps (code synchrone inchangé)
+
+    Les lectures et les appels SOAP restent bloquants pour le thread du step
+    mais passent par la boucle; les écritures Supabase (upsert / insert /
+    update) partent sans attendre, au plus `concurrency` requêtes en vol et
+    `4 x concurrency` écritures en attente. Une lecture d'une table attend les
+    écritures en vol sur cette table.
+    """
+
+    def __init__(self, concurrency=ASYNC_CONCURRENCY):
+        self.concurrency = max(concurrency, 1)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='sync-async', daemon=True)
+        self.thread.start()
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.window = threading.BoundedSemaphore(self.concurrency * 4)
+        self.idle = {}          # (hôte, port, tls) → connexions keep-alive libres
+        self.pending = {}       # table → écritures en vol
+        self.lock = threading.Lock()
+        self.local = threading.local()   # compteurs de l'unité en cours dans chaque thread (cf. scope)
+        self.in_flight = 0
+        self.stats = {"requests": 0, "connections": 0, "reused": 0, "writes": 0,
+                      "write_failures": 0, "peak_in_flight": 0}
+
+    # --- transport -------------------------------------------------------
+
+    async def _read_response(self, reader, method):
+        """(status, headers, corps, keep_alive) d'une réponse HTTP/1.x"""
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError("connexion fermée par le serveur")
+        version, status = line.split(b' ', 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        status = int(status)
+        keep_alive = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            return status, headers, b'', keep_alive
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            parts = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass  # trailers
+                    break
+                parts.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            return status, headers, b''.join(parts), keep_alive
+        if 'content-length' in headers:
+            return status, headers, await reader.readexactly(int(headers['content-length'])), keep_alive
+        return status, headers, await reader.read(), False
+
+    async def _exchange(self, url, method, data, headers):
+        parts = urlsplit(url)
+        tls = parts.scheme == 'https'
+        host = parts.hostname
+        port = parts.port or (443 if tls else 80)
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        lines = [f"{method} {path} HTTP/1.1",
+                 f"Host: {host}" + (f":{parts.port}" if parts.port else ''),
+                 f"Content-Length: {len(data) if data else 0}",
+                 "Connection: keep-alive"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items() if k.lower() not in ('host', 'content-length', 'connection')]
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (data or b'')
+        key = (host, port, tls)
+        while True:
+            idle = self.idle.get(key)
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
+                self.stats["reused"] += 1
+            else:
+                reader, writer = await asyncio.open_connection(
+                    host, port, ssl=ssl_context if tls else None, server_hostname=host if tls else None)
+                self.stats["connections"] += 1
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, _, body, keep_alive = await self._read_response(reader, method)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue  # connexion gardée fermée entre-temps côté serveur: on en ouvre une autre
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.idle.setdefault(key, []).append((reader, writer))
+            else:
+                writer.close()
+            return status, body
+
+    async def fetch(self, url, method='GET', data=None, headers=None, timeout=30):
+        """Requête HTTP: (status, corps en octets), (0, message) si erreur réseau"""
+        target = 'soap' if url == WS_URL else 'postgrest'
+        metric_count('bytes_out', target, len(data) if data else 0)
+        async with self.slots:
+            self.in_flight += 1
+            self.stats["requests"] += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+            started = time.monotonic()
+            try:
+                status, body = await asyncio.wait_for(self._exchange(url, method, data, headers), timeout)
+                metric_count('bytes_in', target, len(body))
+                return status, body
+            except Exception as e:
+                return 0, str(e).encode('utf-8')
+            finally:
+                self.in_flight -= 1
+                metric_latency(target, time.monotonic() - started)
+
+    def request(self, url, method='GET', data=None, headers=None, timeout=30):
+        """Appel bloquant depuis un thread de step"""
+        return asyncio.run_coroutine_threadsafe(self.fetch(url, method, data, headers, timeout), self.loop).result()
+
+    # --- écritures en vol --------------------------------------------------
+
+    async def _write(self, entry, url, method, data, headers, ok_status, record, previous, scope):
+        status, _ = await self.fetch(url, method, data, headers, 15)
+        if status in ok_status:
+            record_batch(entry['table'], record)
+            return True
+        self.stats["write_failures"] += 1
+        if scope is not None:
+            scope["write_failures"] += 1
+        spool_write(entry, status, previous)
+        return False
+
+    @contextmanager
+    def scope(self):
+        """Compteurs des écritures lancées par le thread appelant pendant le bloc (une unité)"""
+        stats = {"writes": 0, "write_failures": 0}
+        self.local.stats = stats
+        try:
+            yield stats
+        finally:
+            self.local.stats = None
+
+    def write(self, entry, url, method, data, headers, ok_status, record, previous=None):
+        """Écriture Supabase sans attente du résultat: succès → record_batch, échec → spool"""
+        body = json.dumps(data, default=json_default).encode('utf-8')
+        self.window.acquire()  # contre-pression: le step attend si trop d'écritures sont en vol
+        table = entry['table']
+        scope = getattr(self.local, 'stats', None)
+        if scope is not None:
+            scope["writes"] += 1
+        with self.lock:
+            self.stats["writes"] += 1
+            future = asyncio.run_coroutine_threadsafe(
+                self._write(entry, url, method, body, headers, ok_status, record, previous, scope), self.loop)
+            self.pending.setdefault(table, set()).add(future)
+
+        def done(f):
+            with self.lock:
+                self.pending[table].discard(f)
+            self.window.release()
+        future.add_done_callback(done)
+        return True
+
+    def wait_writes(self, table=None):
+        """Attend les écritures en vol (d'une table ou de toutes)"""
+        with self.lock:
+            futures = [f for t, fs in self.pending.items() if table is None or t == table for f in fs]
+        if futures:
+            futures_wait(futures)
+
+    def close(self):
+        self.wait_writes()
+
+        async def shutdown():
+            for conns in self.idle.values():
+                for _, writer in conns:
+                    writer.close()
+            self.idle.clear()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+@contextmanager
+def async_engine(concurrency=None):
+    """Active le moteur asyncio pour les E/S HTTP du bloc (attend les écritures en sortie)"""
+    global ASYNC_ENGINE
+    engine = AsyncEngine(concurrency or ASYNC_CONCURRENCY)
+    ASYNC_ENGINE = engine
+    try:
+        yield engine
+    finally:
+        try:
+            engine.close()
+        finally:
+            ASYNC_ENGINE = None
+
+def writes_partial(result, failures):
+    """Step réussi mais écritures refusées (spoolées ou en lettre morte): partial, pas success"""
+    if failures and isinstance(result, dict) and result.get("status") == "success":
+        result["status"] = "partial"
+        result["message"] = f"{failures} write(s) failed (spooled or dead-lettered)"
+    return result
+
+def run_async_engine(fn, concurrency=None):
+    """Exécute un step avec le moteur asyncio (statistiques du moteur dans result["engine"])"""
+    with async_engine(concurrency) as engine:
+        result = fn()
+    if isinstance(result, dict):
+        result["engine"] = dict(engine.stats, mode="async", concurrency=engine.concurrency)
+    return writes_partial(result, engine.stats["write_failures"])
+
+# ============================================================
+# CACHE SOAP
+# ============================================================
+
+def soap_cache_key(method, params):
+    """Préfixe des fichiers de cache: méthode + empreinte des paramètres"""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return f"{method}-{digest}"
+
+def soap_cache_put(method, params, body):
+    """Enregistre une réponse brute (texte ou fichier binaire): <méthode>-<empreinte>-<AAAAMMJJ>.xml.gz"""
+    try:
+        os.makedirs(SOAP_CACHE_DIR, exist_ok=True)
+        path = os.path.join(SOAP_CACHE_DIR, f"{soap_cache_key(method, params)}-{datetime.now():%Y%m%d}.xml.gz")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, 'wb') as f:
+            if isinstance(body, str):
+                f.write(body.encode('utf-8'))
+            else:
+                shutil.copyfileobj(body, f, 1 << 16)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def soap_cache_file(method, params):
+    """Chemin de la réponse en cache la plus récente pour cet appel, sinon None"""
+    if not SOAP_CACHE_DIR:
+        return None
+    paths = sorted(glob.glob(os.path.join(SOAP_CACHE_DIR, f"{soap_cache_key(method, params)}-*.xml.gz")))
+    return paths[-1] if paths else None
+
+def soap_cache_get(method, params):
+    """Réponse en cache la plus récente pour cet appel, sinon None"""
+    path = soap_cache_file(method, params)
+    if not path:
+        return None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return f.read()
+
+def replay_miss(method, params):
+    # Une réponse vide viderait les tables instantanées (appareils_arret...)
+    return RuntimeError(f"replay: no cached response for {method} {json.dumps(params)}")
+
+# ============================================================
+# RÉSILIENCE PROGILIFT
+# ============================================================
+
+class CircuitOpen(RuntimeError):
+    """Progilift a échoué trop de fois d'affilée: appels refusés sans attendre"""
+
+# État partagé entre invocations via sync_runs (name = HEALTH_ROW)
+PROGILIFT_HEALTH = {'latency': {}, 'failures': 0, 'open_until': 0, 'trial_until': 0}
+HEALTH_LOCK = threading.Lock()
+# Apports de l'invocation depuis load_health: fusionnés dans la ligne par save_health
+HEALTH_NEW = {'latency': {}, 'failures': 0, 'reset': False, 'open_until': 0}
+
+def health_new_clear():
+    HEALTH_NEW.update(latency={}, failures=0, reset=False, open_until=0)
+
+def load_health():
+    """Recharge l'état (latences, disjoncteur) écrit par les invocations précédentes"""
+    rows = supabase_get('sync_runs', 'progress', f"name=eq.{HEALTH_ROW}", 1)
+    state = rows[0].get('progress') if rows else None
+    with HEALTH_LOCK:
+        if state:
+            PROGILIFT_HEALTH.update(state)
+        health_new_clear()
+
+def merge_health(state, new):
+    """État relu + apports locaux: latences ajoutées, échecs cumulés sauf succès local (remise à zéro)"""
+    latency = dict(state.get('latency') or {})
+    for method, samples in new['latency'].items():
+        latency[method] = (list(latency.get(method) or []) + samples)[-LATENCY_WINDOW:]
+    if new['reset']:
+        failures, open_until = new['failures'], new['open_until']
+    else:
+        failures = (state.get('failures') or 0) + new['failures']
+        open_until = max(state.get('open_until') or 0, new['open_until'])
+    # Essai du demi-ouvert terminé (succès ou réouverture): la réservation tombe
+    trial_until = 0 if new['reset'] or new['open_until'] else state.get('trial_until') or 0
+    return dict(state, latency=latency, failures=failures, open_until=open_until, trial_until=trial_until)
+
+def save_health(attempts=5):
+    """Fusionne les apports de l'invocation dans la ligne HEALTH_ROW (compare-and-swap)
+
+    Les shards d'un fan-out écrivent en même temps: chacun relit et fusionne,
+    aucun n'écrase les latences ou les échecs des autres.
+    """
+    with HEALTH_LOCK:
+        if not HEALTH_NEW['latency'] and not HEALTH_NEW['failures'] and not HEALTH_NEW['reset']:
+            return True
+        new = json.loads(json.dumps(HEALTH_NEW))
+        health_new_clear()
+    for _ in range(attempts):
+        rows = supabase_get('sync_runs', 'owner,progress', f"name=eq.{HEALTH_ROW}", 1)
+        state = merge_health((rows[0].get('progress') if rows else None) or {}, new)
+        if sync_runs_swap(HEALTH_ROW, rows[0]['owner'] if rows else None, state):
+            return True
+    return False
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+def latency_key(method, params):
+    """Clé des latences: un secteur ou une période n'a pas la taille de réponse des autres
+
+    None: pas d'historique comparable (Wpanne depuis une date libre), timeout plafond.
+    """
+    if 'sListeSecteursTechnicien' in params:
+        return f"{method}:{params['sListeSecteursTechnicien']}"
+    if method == 'get_Synchro_Wpanne':
+        since = params.get('dhDerniereMajFichier')
+        return f"{method}:{since}" if since in PERIODS else None
+    return method
+
+def adaptive_timeout(key, ceiling):
+    """p95 récent x TIMEOUT_FACTOR, jamais au-delà du timeout prévu par le step"""
+    samples = PROGILIFT_HEALTH['latency'].get(key) or [] if key else []
+    if len(samples) < LATENCY_MIN_SAMPLES:
+        return ceiling
+    return min(ceiling, max(TIMEOUT_FLOOR, percentile(samples, 0.95) * TIMEOUT_FACTOR))
+
+def hedge_delay(key):
+    """Délai avant la requête de couverture: p90 de la clé"""
+    samples = PROGILIFT_HEALTH['latency'].get(key) or [] if key else []
+    if len(samples) < LATENCY_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(0.2, percentile(samples, 0.9))
+
+def claim_trial(until):
+    """Réserve l'appel d'essai du demi-ouvert dans la ligne HEALTH_ROW (une seule instance le tente)"""
+    if not SUPABASE_URL or DRY_RUN:
+        return True
+    for _ in range(3):
+        rows = supabase_get('sync_runs', 'owner,progress', f"name=eq.{HEALTH_ROW}", 1)
+        state = (rows[0].get('progress') if rows else None) or {}
+        if (state.get('trial_until') or 0) > time.time() or (state.get('open_until') or 0) > time.time():
+            return False
+        if sync_runs_swap(HEALTH_ROW, rows[0]['owner'] if rows else None, dict(state, trial_until=until)):
+            return True
+    return False
+
+def circuit_check(method, timeout):
+    """Refuse l'appel tant que le disjoncteur est ouvert; demi-ouvert: un seul essai à la fois
+
+    True si cet appel est l'essai (à envoyer seul, sans couverture).
+    """
+    now = time.time()
+    with HEALTH_LOCK:
+        open_until = PROGILIFT_HEALTH.get('open_until') or 0
+        if open_until > now:
+            raise CircuitOpen(f"Progilift circuit open for {round(open_until - now)}s "
+                              f"({PROGILIFT_HEALTH['failures']} consecutive failures), {method} skipped")
+        if PROGILIFT_HEALTH['failures'] < CIRCUIT_FAILURES:
+            return False
+        if (PROGILIFT_HEALTH.get('trial_until') or 0) > now:
+            raise CircuitOpen(f"Progilift circuit half-open, trial call in flight, {method} skipped")
+        PROGILIFT_HEALTH['trial_until'] = now + timeout
+    if not claim_trial(now + timeout):
+        raise CircuitOpen(f"Progilift circuit half-open, trial call in flight elsewhere, {method} skipped")
+    return True
+
+def record_call(key, seconds, ok, trial=False):
+    """Alimente les latences (succès) ou le compteur d'échecs du disjoncteur"""
+    with HEALTH_LOCK:
+        if trial:
+            PROGILIFT_HEALTH['trial_until'] = 0
+        if ok:
+            for latency in (PROGILIFT_HEALTH['latency'], HEALTH_NEW['latency']) if key else ():
+                samples = latency.setdefault(key, [])
+                samples.append(round(seconds, 3))
+                del samples[:-LATENCY_WINDOW]
+            PROGILIFT_HEALTH['failures'] = 0
+            PROGILIFT_HEALTH['open_until'] = 0
+            HEALTH_NEW.update(failures=0, reset=True, open_until=0)
+        else:
+            PROGILIFT_HEALTH['failures'] += 1
+            HEALTH_NEW['failures'] += 1
+            if PROGILIFT_HEALTH['failures'] >= CIRCUIT_FAILURES:
+                PROGILIFT_HEALTH['open_until'] = HEALTH_NEW['open_until'] = time.time() + CIRCUIT_OPEN_SECONDS
+
+def hedged(fn, delay):
+    """fn() puis, s'il n'a pas répondu après delay, une seconde fn() en parallèle: la première réponse 200 gagne"""
+    pool = ThreadPoolExecutor(max_workers=2)
+    try:
+        first = pool.submit(fn)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        metric_count('retries', 'soap')
+        second = pool.submit(fn)
+        result = None
+        for future in as_completed([first, second]):
+            result = future.result()
+            if result[0] == 200:
+                break
+        return result
+    finally:
+        pool.shutdown(wait=False)  # la requête perdante finit seule (timeout urllib)
+
+class TokenBucket:
+    """Seau à jetons local, partagé par les threads de l'instance (réservation: ordre d'arrivée)"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Réserve un jeton et attend qu'il soit disponible; renvoie l'attente"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+def sync_runs_swap(name, version, progress):
+    """Remplace progress de la ligne name si elle est toujours à la version lue (owner)
+
+    version None: ligne absente, créée si personne ne l'a fait entre-temps.
+    """
+    row = {
+        'owner': uuid.uuid4().hex,
+        'expires_at': '1970-01-01T00:00:00Z',
+        'progress': progress,
+        'updated_at': _utc_iso(datetime.now(timezone.utc))
+    }
+    headers = supabase_headers()
+    if version is not None:
+        headers['Prefer'] = 'return=representation'
+        url = (f"{SUPABASE_URL.rstrip('/')}/rest/v1/sync_runs?name=eq.{filter_value(name)}"
+               f"&owner=eq.{filter_value(version)}")
+        status, body = http_request(url, 'PATCH', row, headers, 10)
+        return status == 200 and bool(json.loads(body or '[]'))
+    headers['Prefer'] = 'resolution=ignore-duplicates,return=representation'
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/sync_runs"
+    status, body = http_request(url, 'POST', dict(row, name=name), headers, 10)
+    return status in [200, 201] and bool(json.loads(body or '[]'))
+
+def shared_take(attempts=8):
+    """Jeton pris dans la ligne RATE_ROW de sync_runs (compare-and-swap sur owner)"""
+    for _ in range(attempts):
+        rows = supabase_get('sync_runs', 'owner,progress', f"name=eq.{RATE_ROW}", 1)
+        now = time.time()
+        state = (rows[0].get('progress') if rows else None) or {}
+        tokens = min(PROGILIFT_BURST, state.get('tokens', PROGILIFT_BURST) + (now - state.get('at', now)) * PROGILIFT_RATE) - 1
+        if sync_runs_swap(RATE_ROW, rows[0]['owner'] if rows else None, {'tokens': round(tokens, 4), 'at': now}):
+            wait = -tokens / PROGILIFT_RATE if tokens < 0 else 0
+            if wait:
+                time.sleep(wait)
+            return wait
+    # Contention ou Supabase indisponible: le seau local garde au moins la limite par instance
+    return PROGILIFT_BUCKET.take()
+
+PROGILIFT_BUCKET = TokenBucket(PROGILIFT_RATE, PROGILIFT_BURST)
+PROGILIFT_SLOTS = threading.BoundedSemaphore(PROGILIFT_CONCURRENCY)
+
+@contextmanager
+def progilift_slot():
+    """Place dans le limiteur: concurrence puis jeton; l'attente va dans l'histogramme soap_queue"""
+    started = time.monotonic()
+    with PROGILIFT_SLOTS:
+        if (PROGILIFT_SHARED_LIMIT or FANOUT_SHARD) and SUPABASE_URL and not DRY_RUN:
+            shared_take()
+        else:
+            PROGILIFT_BUCKET.take()
+        metric_latency('soap_queue', time.monotonic() - started)
+        yield
+
+def soap_once(send):
+    """Un envoi SOAP dans le limiteur: (status, body, latence hors file d'attente)"""
+    with progilift_slot():
+        started = time.monotonic()
+        status, body = send()
+        return status, body, time.monotonic() - started
+
+def soap_post(method, soap, headers, timeout, out=None, key=None):
+    """POST SOAP sous disjoncteur, timeout adaptatif (latences de key), couverture pour HEDGE_METHODS"""
+    timeout = adaptive_timeout(key, timeout)
+    trial = circuit_check(method, timeout)
+    if out is not None:
+        status, body, elapsed = soap_once(lambda: (http_request_to_file(WS_URL, 'POST', soap, headers, out, timeout), None))
+    elif method in HEDGE_METHODS and not trial:
+        status, body, elapsed = hedged(lambda: soap_once(lambda: http_request(WS_URL, 'POST', soap, headers, timeout)),
+                                       hedge_delay(key))
+    else:
+        status, body, elapsed = soap_once(lambda: http_request(WS_URL, 'POST', soap, headers, timeout))
+    record_call(key, elapsed, status == 200, trial)
+    return status, body
 
 # ============================================================
 # PROGILIFT API
 # ============================================================
 
-def progilift_call(method, params, wsid=None, timeout=60):
-    """Appel SOAP à Progilift"""
+def soap_envelope(method, params, wsid=None):
+    """Enveloppe SOAP et en-têtes HTTP d'un appel Progilift"""
     wsid_xml = f'<ws:WSID xsi:type="xsd:hexBinary" soap:mustUnderstand="1">{wsid}</ws:WSID>' if wsid else ""
     
     params_xml = ""
@@ -117,12 +892,49 @@ def progilift_call(method, params, wsid=None, timeout=60):
         'Content-Type': 'text/xml; charset=utf-8',
         'SOAPAction': f'"urn:WS_Progilift/{method}"'
     }
-    
-    status, body = http_request(WS_URL, 'POST', soap, headers, timeout)
-    return body if status == 200 else ""
+    return soap, headers
+
+def progilift_call(method, params, wsid=None, timeout=60):
+    """Appel SOAP à Progilift"""
+    if SOAP_REPLAY and method not in SOAP_CACHE_SKIP:
+        cached = soap_cache_get(method, params)
+        if cached is None:
+            raise replay_miss(method, params)
+        return cached
+
+    soap, headers = soap_envelope(method, params, wsid)
+    status, body = soap_post(method, soap, headers, timeout, key=latency_key(method, params))
+    if status != 200:
+        return ""
+    if SOAP_CACHE_DIR and method not in SOAP_CACHE_SKIP:
+        soap_cache_put(method, params, body)
+    return body
+
+def progilift_call_file(method, params, wsid=None, timeout=60):
+    """Appel SOAP dont la réponse est écrite dans un fichier temporaire (None si échec)"""
+    out = tempfile.TemporaryFile()
+    if SOAP_REPLAY:
+        path = soap_cache_file(method, params)
+        if not path:
+            out.close()
+            raise replay_miss(method, params)
+        with gzip.open(path, 'rb') as src:
+            shutil.copyfileobj(src, out, 1 << 16)
+    else:
+        soap, headers = soap_envelope(method, params, wsid)
+        if soap_post(method, soap, headers, timeout, out, latency_key(method, params))[0] != 200:
+            out.close()
+            return None
+        if SOAP_CACHE_DIR:
+            out.seek(0)
+            soap_cache_put(method, params, out)
+    out.seek(0)
+    return out
 
 def get_auth():
     """Authentification Progilift"""
+    if SOAP_REPLAY:
+        return 'REPLAY'
     resp = progilift_call("IdentificationTechnicien", {"sSteCodeWeb": PROGILIFT_CODE}, None, 15)
     if resp:
         m = re.search(r'WSID[^>]*>([A-F0-9]+)<', resp, re.IGNORECASE)
@@ -130,22 +942,505 @@ def get_auth():
             return m.group(1)
     return None
 
+class _Missing:
+    """Champ absent de l'item (≠ balise vide → None): singleton"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+MISSING = _Missing()
+SHARED_VALUE_LEN = 12
+
+class ItemSchema:
+    """Noms de champs d'une réponse (internés, partagés par tous ses items) + valeurs courtes dédupliquées"""
+    __slots__ = ('names', 'index', 'values')
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.values = {}
+
+    def slot(self, name):
+        idx = self.index.get(name)
+        if idx is None:
+            idx = self.index[sys.intern(name)] = len(self.names)
+            self.names.append(sys.intern(name))
+        return idx
+
+    def value(self, text):
+        # '0', '1', dates AAAAMMJJ, codes... une seule copie par réponse
+        if len(text) > SHARED_VALUE_LEN:
+            return text
+        return self.values.setdefault(text, text)
+
+class Item:
+    """Item SOAP compact: tuple de valeurs indexé par le schéma, lu comme un dict (get/items)"""
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    def get(self, key, default=None):
+        idx = self.schema.index.get(key)
+        if idx is None or idx >= len(self.values) or self.values[idx] is MISSING:
+            return default
+        return self.values[idx]
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def items(self):
+        return ((n, v) for n, v in zip(self.schema.names, self.values) if v is not MISSING)
+
+    def __len__(self):
+        return sum(1 for v in self.values if v is not MISSING)
+
+    def __repr__(self):
+        return f"Item({self.to_dict()!r})"
+
+    def to_dict(self):
+        return dict(self.items())
+
+def json_default(obj):
+    """Les Item ne deviennent des dict qu'à la sérialisation JSON"""
+    if isinstance(obj, Item):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def parse_fields(body, schema):
+    """Champs <NOM>valeur</NOM> d'un item, None si aucun"""
+    values = []
+    for f in re.finditer(r'<([A-Za-z0-9_]+)>([^<]*)</\1>', body):
+        idx = schema.slot(f.group(1))
+        if idx >= len(values):
+            values.extend([MISSING] * (idx + 1 - len(values)))
+        value = f.group(2).strip()
+        values[idx] = schema.value(value) if value else None
+    return Item(schema, tuple(values)) if values else None
+
 def parse_items(xml, tag):
     """Parse les items XML"""
     items = []
+    schema = ItemSchema()
     pattern = f'<{tag}>(.*?)</{tag}>'
     for m in re.finditer(pattern, xml, re.DOTALL | re.IGNORECASE):
-        item = {}
-        for f in re.finditer(r'<([A-Za-z0-9_]+)>([^<]*)</\1>', m.group(1)):
-            item[f.group(1)] = f.group(2).strip() if f.group(2).strip() else None
+        item = parse_fields(m.group(1), schema)
         if item:
             items.append(item)
+    metric_count('soap_items', tag, len(items))
     return items
 
+def iter_items_file(f, tag):
+    """Items XML lus un à un depuis un fichier mmappé: seul l'item courant est en mémoire"""
+    if os.fstat(f.fileno()).st_size == 0:
+        return
+    schema = ItemSchema()
+    pattern = re.compile(rb'<' + tag.encode() + rb'>(.*?)</' + tag.encode() + rb'>', re.DOTALL | re.IGNORECASE)
+    # Fermé aussi quand le consommateur abandonne le générateur (close() → GeneratorExit)
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for m in pattern.finditer(mm):
+            item = parse_fields(m.group(1).decode('utf-8', 'replace'), schema)
+            if item:
+                metric_count('soap_items', tag)
+                yield item
+
+# ============================================================
+# PAYLOAD BRUT (data_wsoucont / data_wsoucont2 / data_wpanne)
+# ============================================================
+
+# Champ source → colonne dont str(valeur) redonne le champ tel quel
+WSOUCONT_RAW_COLUMNS = {
+    'IDWSOUCONT': 'id_wsoucont',
+    'IDWCONTRAT': 'id_wcontrat',
+    'SECTEUR': 'secteur',
+    'ASCENSEUR': 'ascenseur',
+    'INDICE': 'indice',
+    'DES2': 'adresse',
+    'DES3': 'ville',
+    'DES4': 'des4',
+    'DES6': 'des6',
+    'DES7': 'des7',
+    'GENRE': 'genre',
+    'TYPE': 'type_appareil',
+    **{f'DIV{i}': f'div{i}' for i in range(1, 16)},
+    'REFCLI': 'refcli',
+    'REFCLI2': 'refcli2',
+    'REFCLI3': 'refcli3',
+    'NUMAPPCLI': 'numappcli',
+    'NOM_CONVIVIAL': 'nom_convivial',
+    'LOCALISATION': 'localisation',
+    'TELCABINE': 'telcabine',
+    'IDTYPE_DEPANNAGE': 'idtype_depannage',
+    'SECURITE': 'securite',
+    'SECURITE2': 'securite2',
+    'TYPEPLANNING': 'typeplanning',
+    'WORDRE': 'wordre',
+    'ORDRE2': 'ordre2',
+    'CODE_ACQUITTEMENT': 'code_acquittement',
+    'DATE_HEURE_MODIF': 'date_heure_modif',
+    **{m.upper(): m for m in ('jan', 'fev', 'mar', 'avr', 'mai', 'jui',
+                              'jul', 'aou', 'sep', 'oct', 'nov', 'dec')},
+}
+
+WSOUCONT2_RAW_COLUMNS = {
+    **{f'LIB{i}': f'lib{i}' for i in range(1, 11)},
+    **{f'DATEPASS{i}': f'datepass{i}' for i in range(1, 11)},
+    **{f'DAT{i}': f'dat{i}' for i in range(1, 16)},
+    **{f'TXT{i}': f'txt{i}' for i in range(1, 6)},
+}
+
+WPANNE_RAW_COLUMNS = {
+    'IDWPANNE': 'id_panne',
+    'IDWSOUCONT': 'id_wsoucont',
+    'ASCENSEUR': 'ascenseur',
+    'ADRES': 'adresse',
+    'NUM': 'code_postal',
+    'DATEAPP': 'date_appel',
+    'HEUREAPP': 'heure_appel',
+    'DATEARR': 'date_arrivee',
+    'HEUREARR': 'heure_arrivee',
+    'DATEDEP': 'date_depart',
+    'HEUREDEP': 'heure_depart',
+    'MOTIF': 'motif',
+    'CAUSE': 'cause',
+    'TRAVAUX': 'travaux',
+    'DEPANNEUR': 'depanneur',
+    'DUREE': 'duree',
+    'TYPEPANNE': 'type_panne',
+    'ETAT': 'etat',
+    'DEMANDEUR': 'demandeur',
+    'PERSBLOQ': 'personnes_bloquees',
+}
+
+# Lignes pannes du cron (api/cron.py), payload brut dans data
+CRON_PANNE_RAW_COLUMNS = {
+    'P0CLEUNIK': 'id_panne',
+    'IDWSOUCONT': 'id_wsoucont',
+    'DATE': 'date_panne',
+    'DEPANNEUR': 'depanneur',
+    'PANNES': 'libelle',
+    'INTER': 'heure_inter',
+    'HRFININTER': 'heure_fin',
+}
+
+RAW_COLUMNS = {
+    'data_wsoucont': WSOUCONT_RAW_COLUMNS,
+    'data_wsoucont2': WSOUCONT2_RAW_COLUMNS,
+    'data_wpanne': WPANNE_RAW_COLUMNS,
+    'data': CRON_PANNE_RAW_COLUMNS,
+}
+
+# Résiduel compact: champs repris par une colonne mais absents de l'item (≠ balise vide)
+RAW_ABSENT = '_absent'
+
+def raw_residual(item, row, raw_columns):
+    """Champs de item que les colonnes de row ne permettent pas de retrouver, plus RAW_ABSENT"""
+    residual = {}
+    for key, value in item.items():
+        col = raw_columns.get(key)
+        if col is not None and col in row:
+            mapped = row[col]
+            if (None if mapped is None else str(mapped)) == value:
+                continue
+        residual[key] = value
+    residual[RAW_ABSENT] = [key for key, col in raw_columns.items() if col in row and key not in item]
+    return residual
+
+def rebuild_raw(row, raw_key):
+    """Reconstruit le dict source complet depuis une ligne (mode full ou compact)"""
+    raw = row.get(raw_key) or {}
+    if isinstance(raw, str):
+        raw = json.loads(raw)  # anciennes lignes encodées deux fois
+    if RAW_ABSENT not in raw:
+        return dict(raw)  # mode full: l'item tel quel
+    absent = set(raw[RAW_ABSENT])
+    full = {}
+    for key, col in RAW_COLUMNS[raw_key].items():
+        if col in row and key not in absent:
+            full[key] = None if row[col] is None else str(row[col])
+    full.update((k, v) for k, v in raw.items() if k != RAW_ABSENT)
+    return full
+
+def apply_raw_mode(data, raw_key, raw_mode, sizes):
+    """Réduit data[raw_key] au résiduel en mode compact et cumule les octets JSON (avant, envoyés)"""
+    full_size = len(json.dumps(data, default=json_default))
+    if raw_mode == 'compact':
+        data[raw_key] = raw_residual(data[raw_key], data, RAW_COLUMNS[raw_key])
+        sizes[1] += len(json.dumps(data, default=json_default))
+    else:
+        sizes[1] += full_size
+    sizes[0] += full_size
+
+def payload_stats(raw_mode, sizes, rows):
+    """Octets de requête par ligne, avant et après le mode compact"""
+    return {
+        "raw_mode": raw_mode,
+        "bytes_per_row_full": round(sizes[0] / rows) if rows else 0,
+        "bytes_per_row_sent": round(sizes[1] / rows) if rows else 0
+    }
+
+# ============================================================
+# MÉTRIQUES (sync_metrics → /api/metrics)
+# ============================================================
+
+# Bornes des histogrammes de latence (secondes), identiques dans api/metrics.py
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180)
+
+# Compteurs de l'invocation courante: remis à zéro par flush_sync_metrics
+METRICS = {}
+METRICS_LOCK = threading.Lock()   # la CLI exécute des unités en parallèle
+METRICS_MUTED = threading.local()  # écriture de la ligne sync_metrics elle-même, non comptée
+
+def metric_count(kind, label, value=1):
+    """soap_items (par balise tabListe*), rows_fetched / rows_written / dead_letters (par table),
+    bytes_in / bytes_out / retries (par cible)"""
+    if getattr(METRICS_MUTED, 'on', False):
+        return
+    with METRICS_LOCK:
+        bucket = METRICS.setdefault(kind, {})
+        bucket[label] = bucket.get(label, 0) + value
+
+def metric_latency(target, seconds):
+    """Observation de latence (soap / postgrest), histogramme non cumulé"""
+    i = 0
+    while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+        i += 1
+    if getattr(METRICS_MUTED, 'on', False):
+        return
+    with METRICS_LOCK:
+        hist = METRICS.setdefault('latency', {}).setdefault(
+            target, {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+        hist['buckets'][i] += 1
+        hist['sum'] += seconds
+        hist['count'] += 1
+
+def metrics_reset():
+    """Remet les compteurs à zéro (début d'invocation)"""
+    with METRICS_LOCK:
+        METRICS.clear()
+
+def metrics_snapshot(kind, label):
+    """Copie d'un compteur ou histogramme de l'invocation courante"""
+    with METRICS_LOCK:
+        value = METRICS.get(kind, {}).get(label)
+        return json.loads(json.dumps(value)) if value is not None else None
+
+def flush_sync_metrics(progress, status):
+    """Écrit une ligne sync_metrics pour l'invocation puis remet les compteurs à zéro"""
+    with METRICS_LOCK:
+        if not METRICS:
+            return None
+        metrics = dict(METRICS, buckets=list(LATENCY_BUCKETS))
+        METRICS.clear()
+    progress = progress or {}
+    row = {
+        'step': progress.get('step') or progress.get('mode') or None,
+        'status': status,
+        'metrics': metrics,
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+    # Sans compter l'écriture de la ligne elle-même; les unités encore en cours
+    # (autres threads) continuent de compter pour la ligne suivante
+    METRICS_MUTED.on = True
+    try:
+        supabase_insert('sync_metrics', row, spool=False)
+    finally:
+        METRICS_MUTED.on = False
+    return row
+
+# ============================================================
+# ÉVÉNEMENTS DE SYNC (sync_events)
+# ============================================================
+
+# Clé utilisée pour les plages d'ids de chaque table alimentée par la sync
+EVENT_KEYS = {
+    'equipements': 'id_wsoucont',
+    'pannes': 'id_panne',
+    'appareils_arret': 'id_wsoucont',
+    'type_planning': 'code',
+    'arret_intervals': 'id_wsoucont',
+}
+EVENT_IGNORED = {'sync_runs', 'sync_logs', 'sync_events', 'sync_metrics'}
+
+# Lot en cours: table → {'min', 'max', 'count'}
+SYNC_BATCH = {}
+SYNC_BATCH_LOCK = threading.Lock()   # unités parallèles de la CLI, écritures du moteur asyncio
+
+def record_batch(table, data):
+    """Ajoute au lot courant les lignes écrites avec succès dans table"""
+    if table in EVENT_IGNORED:
+        return
+    metric_count('rows_written', table, len(data) if isinstance(data, list) else 1)
+    key = EVENT_KEYS.get(table)
+    with SYNC_BATCH_LOCK:
+        entry = SYNC_BATCH.setdefault(table, {'min': None, 'max': None, 'count': 0})
+        for row in data if isinstance(data, list) else [data]:
+            entry['count'] += 1
+            value = row.get(key) if key else None
+            if value is None:
+                continue
+            if entry['min'] is None or value < entry['min']:
+                entry['min'] = value
+            if entry['max'] is None or value > entry['max']:
+                entry['max'] = value
+
+def sync_batch_summary(batch=None):
+    """Résumé d'un lot, par défaut le lot courant (tables touchées et plages d'ids)"""
+    if batch is None:
+        with SYNC_BATCH_LOCK:
+            batch = {t: dict(r) for t, r in SYNC_BATCH.items()}
+    return {"tables": sorted(batch), "ranges": {t: dict(r) for t, r in batch.items()}}
+
+def sync_batch_clear():
+    with SYNC_BATCH_LOCK:
+        SYNC_BATCH.clear()
+
+def flush_sync_events(source):
+    """Écrit une ligne sync_events pour le lot courant puis le vide"""
+    with SYNC_BATCH_LOCK:
+        if not SYNC_BATCH:
+            return None
+        batch = dict(SYNC_BATCH)
+        SYNC_BATCH.clear()
+    event = dict(sync_batch_summary(batch), source=source, created_at=datetime.now().isoformat())
+    supabase_insert('sync_events', event)
+    return event
+
+# ============================================================
+# FILE D'ATTENTE DES ÉCRITURES EN ÉCHEC (spool)
+# ============================================================
+
+# Un seul ajout à la fois: unités parallèles de la CLI, boucle du moteur async
+SPOOL_LOCK = threading.Lock()
+
+def spool_path():
+    """Fichier de spool de ce processus (un membre gzip ajouté par lot)"""
+    return os.path.join(SPOOL_DIR, f"spool-{os.getpid()}.ndjson.gz")
+
+def dead_letter_path():
+    """Écritures abandonnées de ce processus: gardées pour inspection, jamais rejouées"""
+    return os.path.join(SPOOL_DIR, f"deadletter-{os.getpid()}.ndjson.gz")
+
+def spool_retryable(status):
+    """Échec passager (réseau, 5xx, 429); un autre 4xx échouera de nouveau au rejeu"""
+    return status == 0 or status == 429 or status >= 500
+
+def spool_write(entry, status=0, previous=None):
+    """Ajoute une écriture en échec au spool (upsert/insert/update, tous idempotents)
+
+    previous: entrée rejouée dont on hérite tentatives et date. 4xx définitif,
+    SPOOL_MAX_ATTEMPTS échecs ou SPOOL_MAX_AGE dépassé: lettre morte.
+    """
+    if entry['table'] in SPOOL_SKIP:
+        return False
+    previous = previous or {}
+    entry = dict(entry, status=status, attempts=previous.get('attempts', 0) + 1,
+                 created_at=previous.get('created_at') or time.time())
+    if not spool_retryable(status):
+        entry['reason'] = f"HTTP {status}"
+    elif entry['attempts'] >= SPOOL_MAX_ATTEMPTS:
+        entry['reason'] = "max attempts"
+    elif time.time() - entry['created_at'] > SPOOL_MAX_AGE:
+        entry['reason'] = "expired"
+    if entry.get('reason'):
+        metric_count('dead_letters', entry['table'])
+    line = json.dumps(entry, ensure_ascii=False, default=json_default) + '\n'
+    try:
+        with SPOOL_LOCK:
+            os.makedirs(SPOOL_DIR, exist_ok=True)
+            with gzip.open(dead_letter_path() if entry.get('reason') else spool_path(), 'at', encoding='utf-8') as f:
+                f.write(line)
+        return True
+    except OSError:
+        return False
+
+def spool_apply(entry):
+    """Rejoue une écriture du spool; un nouvel échec la remet en attente (ou en lettre morte)"""
+    op, table, data = entry['op'], entry['table'], entry['data']
+    if op == 'upsert':
+        return supabase_upsert(table, data, spool=entry)
+    if op == 'insert':
+        return supabase_insert(table, data, spool=entry)
+    if op == 'update':
+        return supabase_update(table, entry['key_col'], entry['key_val'], data, spool=entry)
+    return True  # opération inconnue: abandonnée
+
+def read_spool(path):
+    """(entrées relues, lisible): une fin tronquée ou corrompue garde les entrées qui la précèdent"""
+    entries = []
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entries.append(json.loads(line))
+    except (OSError, EOFError, ValueError):
+        return entries, False
+    return entries, True
+
+def replay_spool():
+    """Rejoue, dans l'ordre, les écritures en attente laissées par les invocations précédentes
+
+    Un fichier illisible au-delà d'un point (ajout interrompu) est rejoué jusqu'à
+    ce point puis déplacé en lettre morte (deadletter-unreadable-*), jamais supprimé.
+    """
+    stats = {"files": 0, "replayed": 0, "failed": 0, "unreadable": 0}
+    for path in sorted(glob.glob(os.path.join(SPOOL_DIR, 'spool-*.ndjson.gz')), key=os.path.getmtime):
+        claimed = path[:-len('.ndjson.gz')] + f'.replay-{uuid.uuid4().hex[:8]}'
+        try:
+            os.rename(path, claimed)  # une seule invocation rejoue un fichier donné
+        except OSError:
+            continue
+        stats["files"] += 1
+        entries, readable = read_spool(claimed)
+        for entry in entries:
+            metric_count('retries', 'postgrest')
+            if spool_apply(entry):
+                stats["replayed"] += 1
+            else:
+                stats["failed"] += 1
+        if readable:
+            os.remove(claimed)
+        else:
+            stats["unreadable"] += 1
+            os.replace(claimed, os.path.join(SPOOL_DIR, f"deadletter-unreadable-{uuid.uuid4().hex[:8]}.ndjson.gz"))
+    return stats
+
 # ============================================================
 # SUPABASE API
 # ============================================================
 
+def spool_previous(spool):
+    """spool=True (premier échec) ou l'entrée en cours de rejeu"""
+    return spool if isinstance(spool, dict) else None
+
+# Écritures synchrones de l'unité en cours (CLI), par thread; le moteur async a les siennes (scope)
+WRITE_SCOPE = threading.local()
+
+@contextmanager
+def write_scope():
+    """Compteurs des écritures synchrones du thread appelant pendant le bloc (une unité)"""
+    stats = {"writes": 0, "write_failures": 0}
+    previous = getattr(WRITE_SCOPE, 'stats', None)
+    WRITE_SCOPE.stats = stats
+    try:
+        yield stats
+    finally:
+        WRITE_SCOPE.stats = previous
+
+def count_write(ok):
+    stats = getattr(WRITE_SCOPE, 'stats', None)
+    if stats is not None:
+        stats["writes"] += 1
+        stats["write_failures"] += not ok
+
 def supabase_headers():
     """Headers Supabase"""
     return {
@@ -155,28 +1450,83 @@ def supabase_headers():
         'Prefer': 'return=minimal'
     }
 
-def supabase_insert(table, data):
+def supabase_insert(table, data, spool=True):
     """Insert dans Supabase"""
     url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}"
     headers = supabase_headers()
     headers['Prefer'] = 'resolution=merge-duplicates,return=minimal'
+    if ASYNC_ENGINE is not None and spool and not DRY_RUN:
+        return ASYNC_ENGINE.write({'op': 'insert', 'table': table, 'data': data}, url, 'POST', data, headers, (200, 201), data,
+                                  spool_previous(spool))
     status, _ = http_request(url, 'POST', data, headers, 15)
-    return status in [200, 201]
+    ok = status in [200, 201]
+    count_write(ok)
+    if ok:
+        record_batch(table, data)
+    elif spool:
+        spool_write({'op': 'insert', 'table': table, 'data': data}, status, spool_previous(spool))
+    return ok
 
-def supabase_upsert(table, data):
+def supabase_upsert(table, data, spool=True):
     """Upsert dans Supabase"""
     url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}"
     headers = supabase_headers()
     headers['Prefer'] = 'resolution=merge-duplicates,return=minimal'
+    if ASYNC_ENGINE is not None and spool and not DRY_RUN:
+        return ASYNC_ENGINE.write({'op': 'upsert', 'table': table, 'data': data}, url, 'POST', data, headers, (200, 201), data,
+                                  spool_previous(spool))
     status, _ = http_request(url, 'POST', data, headers, 15)
-    return status in [200, 201]
+    ok = status in [200, 201]
+    count_write(ok)
+    if ok:
+        record_batch(table, data)
+    elif spool:
+        spool_write({'op': 'upsert', 'table': table, 'data': data}, status, spool_previous(spool))
+    return ok
 
-def supabase_update(table, key_col, key_val, data):
+def supabase_update(table, key_col, key_val, data, spool=True):
     """Update dans Supabase"""
-    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}?{key_col}=eq.{key_val}"
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}?{key_col}=eq.{quote(str(key_val), safe='')}"
+    if ASYNC_ENGINE is not None and spool and not DRY_RUN:
+        entry = {'op': 'update', 'table': table, 'key_col': key_col, 'key_val': key_val, 'data': data}
+        return ASYNC_ENGINE.write(entry, url, 'PATCH', data, supabase_headers(), (200, 204), {key_col: key_val},
+                                  spool_previous(spool))
     status, _ = http_request(url, 'PATCH', data, supabase_headers(), 15)
+    ok = status in [200, 204]
+    count_write(ok)
+    if ok:
+        record_batch(table, {key_col: key_val})
+    elif spool:
+        spool_write({'op': 'update', 'table': table, 'key_col': key_col, 'key_val': key_val, 'data': data},
+                    status, spool_previous(spool))
+    return ok
+
+def supabase_patch(table, filter_str, data):
+    """Update groupé de toutes les lignes sous filter_str"""
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}?{filter_str}"
+    status, _ = http_request(url, 'PATCH', data, supabase_headers(), 30)
+    count_write(status in [200, 204])
     return status in [200, 204]
 
+def supabase_patch_rows(table, key_col, rows, chunk=RECONCILE_CHUNK):
+    """PATCH de lignes existantes (jamais d'insert): une requête par jeu de valeurs, ids en in.(...)
+
+    rows: [{key_col: id, colonne: valeur, ...}]. Retourne le nombre de lignes écrites.
+    """
+    groups = {}
+    for row in rows:
+        values = {k: v for k, v in row.items() if k != key_col}
+        group = groups.setdefault(json.dumps(values, sort_keys=True, default=json_default), (values, []))
+        group[1].append(row[key_col])
+    written = 0
+    for values, ids in groups.values():
+        for i in range(0, len(ids), chunk):
+            part = ids[i:i + chunk]
+            if supabase_patch(table, f"{key_col}=in.({','.join(filter_value(x) for x in part)})", values):
+                written += len(part)
+                record_batch(table, [{key_col: x} for x in part])
+    return written
+
 def supabase_delete(table, filter_str=None):
     """Delete dans Supabase"""
     url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/{table}"
@@ -185,7 +1535,11 @@ def supabase_delete(table, filter_str=None):
     else:
         url += "?id=gt.0"  # Delete all
     status, _ = http_request(url, 'DELETE', None, supabase_headers(), 30)
-    return status in [200, 204]
+    ok = status in [200, 204]
+    count_write(ok)
+    if ok:
+        record_batch(table, [])
+    return ok
 
 def supabase_get(table, select="*", filter_str=None, limit=None):
     """Get depuis Supabase"""
@@ -198,11 +1552,301 @@ def supabase_get(table, select="*", filter_str=None, limit=None):
         'apikey': SUPABASE_KEY,
         'Authorization': f'Bearer {SUPABASE_KEY}'
     }
+    if ASYNC_ENGINE is not None:
+        ASYNC_ENGINE.wait_writes(table)  # relire ses propres écritures
     status, body = http_request(url, 'GET', None, headers, 30)
     if status == 200:
-        return json.loads(body)
+        rows = json.loads(body)
+        metric_count('rows_fetched', table, len(rows))
+        return rows
     return []
 
+def supabase_stream(table, select, key, filter_str=None, page_size=1000):
+    """Parcourt une table par pages keyset sur key, sans tout charger"""
+    after = None
+    while True:
+        filters = [filter_str] if filter_str else []
+        if after is not None:
+            filters.append(f"{key}=gt.{quote(str(after), safe='')}")
+        filters.append(f"order={key}.asc")
+        page = supabase_get(table, select, '&'.join(filters), page_size)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = page[-1][key]
+
+# ============================================================
+# VERROU (sync_runs)
+# ============================================================
+
+def lease_owner():
+    """Identifiant unique de l'invocation courante"""
+    host = re.sub(r'[^A-Za-z0-9_.-]', '-', socket.gethostname())[:64]
+    return f"{host}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+def _utc_iso(dt):
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+class LeaseUnavailable(RuntimeError):
+    """sync_runs illisible (table absente, erreur PostgREST ou réseau): ni pris ni busy"""
+
+def lease_error(status, body):
+    return LeaseUnavailable(f"sync_runs unavailable (HTTP {status}): {(body or '')[:200]} "
+                            "- see supabase/migrations")
+
+def lease_acquire(owner, progress=None, name=LEASE_NAME, ttl=LEASE_TTL):
+    """Prend le verrou s'il est libre, expiré ou déjà détenu par owner
+
+    False: détenu par un autre. LeaseUnavailable si sync_runs ne répond pas
+    normalement (404 table absente, 4xx/5xx, réseau): une erreur, pas "busy".
+    """
+    if not SUPABASE_URL:
+        return True
+    now = datetime.now(timezone.utc)
+    row = {
+        'owner': owner,
+        'expires_at': _utc_iso(now + timedelta(seconds=ttl)),
+        'progress': progress or {},
+        'updated_at': _utc_iso(now)
+    }
+    headers = supabase_headers()
+    headers['Prefer'] = 'return=representation'
+    
+    # 1. Reprise d'un verrou expiré ou déjà à nous (UPDATE conditionnel, atomique)
+    url = (f"{SUPABASE_URL.rstrip('/')}/rest/v1/sync_runs?name=eq.{filter_value(name)}"
+           f"&or=(expires_at.lt.{_utc_iso(now)},owner.eq.{filter_value(owner)})")
+    status, body = http_request(url, 'PATCH', row, headers, 10)
+    if status != 200:
+        raise lease_error(status, body)
+    if json.loads(body or '[]'):
+        return True
+    
+    # 2. Première prise: INSERT ignoré si la ligne existe déjà
+    url = f"{SUPABASE_URL.rstrip('/')}/rest/v1/sync_runs"
+    headers['Prefer'] = 'resolution=ignore-duplicates,return=representation'
+    status, body = http_request(url, 'POST', dict(row, name=name), headers, 10)
+    if status not in [200, 201]:
+        raise lease_error(status, body)
+    return bool(json.loads(body or '[]'))
+
+def lease_release(owner, name=LEASE_NAME):
+    """Libère le verrou s'il est toujours détenu par owner"""
+    if not SUPABASE_URL:
+        return True
+    url = (f"{SUPABASE_URL.rstrip('/')}/rest/v1/sync_runs?name=eq.{filter_value(name)}"
+           f"&owner=eq.{filter_value(owner)}")
+    released = {'expires_at': '1970-01-01T00:00:00Z', 'updated_at': _utc_iso(datetime.now(timezone.utc))}
+    status, _ = http_request(url, 'PATCH', released, supabase_headers(), 10)
+    return status in [200, 204]
+
+def lease_holder(name=LEASE_NAME):
+    """État public du verrou (expires_at, progress): jamais owner, qui permet de le rejoindre"""
+    rows = supabase_get('sync_runs', 'name,expires_at,progress,updated_at', f"name=eq.{filter_value(name)}", 1)
+    return rows[0] if rows else None
+
+def run_with_lease(fn, progress, wait=0, owner=None, release=True, ttl=LEASE_TTL):
+    """Exécute fn() sous le verrou, en attendant au plus wait secondes
+
+    release=False: verrou rejoint (shard d'un coordinateur, cf. fanout_owner), laissé à son détenteur.
+    """
+    owner = owner or lease_owner()
+    deadline = time.monotonic() + min(max(wait, 0), LEASE_MAX_WAIT)
+    try:
+        while not lease_acquire(owner, progress, ttl=ttl):
+            if time.monotonic() >= deadline:
+                return {
+                    "status": "busy",
+                    "message": "Another sync is running",
+                    "holder": lease_holder()
+                }
+            time.sleep(LEASE_POLL)
+    except LeaseUnavailable as e:
+        return {"status": "error", "message": str(e)}
+    sync_batch_clear()
+    metrics_reset()
+    result = None
+    try:
+        load_health()
+        spool = replay_spool()
+        result = fn()
+        if spool["files"] and isinstance(result, dict):
+            result["spool_replay"] = spool
+        queue = metrics_snapshot('latency', 'soap_queue')
+        if queue and isinstance(result, dict):
+            # Attente dans le limiteur Progilift: à comparer à PROGILIFT_RATE / _BURST
+            result["progilift_queue"] = {"calls": queue['count'], "wait_s": round(queue['sum'], 3)}
+        return result
+    finally:
+        # Même en cas d'exception: les lignes déjà écrites doivent être signalées
+        event = flush_sync_events(progress)
+        if event and isinstance(result, dict):
+            result["sync_event"] = {"tables": event["tables"], "ranges": event["ranges"]}
+        save_health()
+        if release:
+            lease_release(owner)
+        flush_sync_metrics(progress, result.get("status") if isinstance(result, dict) else "exception")
+
+# ============================================================
+# PROFILAGE
+# ============================================================
+
+def profile_allowed(secret):
+    """?profile=1 n'est honoré qu'avec le secret SYNC_PROFILE_SECRET"""
+    return bool(PROFILE_SECRET) and hmac.compare_digest(secret or '', PROFILE_SECRET)
+
+def run_profiled(fn, top=PROFILE_TOP):
+    """Exécute fn() sous cProfile + tracemalloc: (résultat, rapport)"""
+    traced = tracemalloc.is_tracing()
+    if not traced:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        result = profiler.runcall(fn)
+    finally:
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if not traced:
+            tracemalloc.stop()
+    
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda kv: kv[1][3], reverse=True)
+    report = {
+        "wall_s": round(elapsed, 3),
+        # Temps cumulé des étapes de ce module: SOAP, parse, mapping, Supabase
+        "phases": {
+            name: round(ct, 3)
+            for (filename, _, name), (_, _, _, ct, _) in rows
+            if name in PROFILE_PHASES and filename == __file__
+        },
+        "cumulative": [
+            {
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": nc,
+                "tottime": round(tt, 4),
+                "cumtime": round(ct, 4)
+            }
+            for (filename, line, name), (_, nc, tt, ct, _) in rows[:top]
+        ],
+        "memory": {
+            "tracemalloc_peak_kb": peak // 1024,
+            "hotspots": [
+                {
+                    "where": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                    "size_kb": stat.size // 1024,
+                    "count": stat.count
+                }
+                for stat in snapshot.statistics('lineno')[:10]
+            ]
+        }
+    }
+    return result, report
+
+# ============================================================
+# RÉCONCILIATION DES SUPPRESSIONS (ids Progilift vs Supabase)
+# ============================================================
+
+class IdSet:
+    """Ensemble d'ids compact: bitmap sur [min, max], set si l'écart est trop grand"""
+
+    def __init__(self, ids):
+        ids = ids if isinstance(ids, array) else array('q', ids)
+        self.base = min(ids) if ids else 0
+        span = max(ids) - self.base + 1 if ids else 0
+        self.bits = None
+        self.ids = None
+        if span <= RECONCILE_BITMAP_SPAN:
+            self.bits = bytearray((span + 7) // 8)
+            for id_ in ids:
+                offset = id_ - self.base
+                self.bits[offset >> 3] |= 1 << (offset & 7)
+            self.size = int.from_bytes(self.bits, 'little').bit_count()
+        else:
+            self.ids = set(ids)
+            self.size = len(self.ids)
+
+    def __contains__(self, id_):
+        if self.ids is not None:
+            return id_ in self.ids
+        offset = id_ - self.base
+        return 0 <= offset < len(self.bits) * 8 and bool(self.bits[offset >> 3] & (1 << (offset & 7)))
+
+    def __len__(self):
+        return self.size
+
+def soap_complete(resp):
+    """Vrai si la réponse SOAP (str ou fichier) va jusqu'à la fin de l'enveloppe"""
+    if resp is None:
+        return False
+    if isinstance(resp, str):
+        tail = resp[-256:]
+    else:
+        resp.seek(max(os.fstat(resp.fileno()).st_size - 256, 0))
+        tail = resp.read().decode('utf-8', 'replace')
+        resp.seek(0)
+    return re.search(r'</(?:\w+:)?Envelope>\s*$', tail, re.IGNORECASE) is not None
+
+def reconcile(table, key, filter_str, live, mode, complete=True, force=False, group=None, written=None):
+    """Supprime les lignes de table (sous filter_str) dont la clé n'est plus dans live
+
+    Seule la clé (et group) est relue, par pages keyset. soft: deleted_at posé
+    (et retiré des lignes revenues dans Progilift), hard: DELETE. Rien n'est
+    supprimé si la réponse Progilift est incomplète ou vide, si des lignes de
+    live n'ont pas été écrites (written < len(live)), ni au-delà de
+    RECONCILE_MAX_RATIO des lignes sans force.
+    """
+    result = {"mode": mode, "progilift": len(live), "supabase": 0, "stale": 0, "deleted": 0}
+    if not complete or not len(live):
+        result["skipped"] = "réponse Progilift incomplète ou vide"
+        return result
+    if written is not None and written < len(live):
+        result["skipped"] = f"{len(live) - written} ligne(s) Progilift non écrites: réconciliation au prochain passage"
+        return result
+    select = ','.join(c for c in (key, group, 'deleted_at' if mode == 'soft' else None) if c)
+    stale = array('q')
+    restored = array('q')
+    groups = set()
+    for row in supabase_stream(table, select, key, filter_str):
+        result["supabase"] += 1
+        present = row[key] in live
+        if mode == 'soft' and row.get('deleted_at'):
+            if present:
+                restored.append(row[key])
+            continue
+        if not present:
+            stale.append(row[key])
+            if group:
+                groups.add(row.get(group))
+    result["stale"] = len(stale)
+    if len(stale) > result["supabase"] * RECONCILE_MAX_RATIO and not force:
+        result["skipped"] = (f"{len(stale)}/{result['supabase']} lignes absentes de Progilift "
+                             f"(> {RECONCILE_MAX_RATIO:.0%}): relancer avec &force=1")
+        return result
+
+    stamp = datetime.now().isoformat()
+    for ids, data in ((stale, {'deleted_at': stamp, 'updated_at': stamp}),
+                      (restored, {'deleted_at': None, 'updated_at': stamp})):
+        done = 0
+        for i in range(0, len(ids), RECONCILE_CHUNK):
+            chunk = ids[i:i + RECONCILE_CHUNK]
+            in_filter = f"{key}=in.({','.join(map(str, chunk))})"
+            if mode == 'hard':
+                ok = supabase_delete(table, in_filter)
+            else:
+                ok = supabase_patch(table, in_filter, data)
+            if ok:
+                done += len(chunk)
+                record_batch(table, [{key: id_} for id_ in chunk])
+        if ids is stale:
+            result["deleted"] = done
+        elif done:
+            result["restored"] = done
+    if group:
+        groups.discard(None)
+        result["groups"] = groups
+    return result
+
 # ============================================================
 # STEP 0: Types de planning
 # ============================================================
@@ -257,6 +1901,72 @@ def sync_type_planning():
 # STEP 1: Arrêts en cours
 # ============================================================
 
+def first_arrets(arrets):
+    """id_wsoucont → arrêt le plus ancien (un appareil peut avoir plusieurs pannes ouvertes)"""
+    current = {}
+    for a in arrets:
+        id_wsoucont = safe_int(a.get('nIDSOUCONT'))
+        if not id_wsoucont:
+            continue
+        appel = progilift_timestamp(a.get('sDateAppel'), a.get('sHeureAppel'))
+        prev = current.get(id_wsoucont)
+        if prev is None or (appel and (prev[0] is None or appel < prev[0])):
+            current[id_wsoucont] = (appel, a)
+    return {id_: a for id_, (_, a) in current.items()}
+
+def update_arret_intervals(arrets):
+    """Ouvre / ferme les intervalles de arret_intervals d'après l'instantané des arrêts
+
+    Seuls les intervalles ouverts (ended_at null) sont relus. Un appareil qui
+    revient pour la même panne rouvre son dernier intervalle au lieu d'en
+    créer un nouveau: une coupure d'un run ne fragmente pas l'historique.
+    Partagé avec api/cron.py.
+    """
+    now = _utc_iso(datetime.now(timezone.utc))
+    current = first_arrets(arrets)
+    open_ = {r['id_wsoucont']: r for r in supabase_stream('arret_intervals', 'id,id_wsoucont', 'id', 'ended_at=is.null')}
+    stats = {"opened": 0, "reopened": 0, "closed": 0}
+    
+    closing = [r for id_, r in open_.items() if id_ not in current]
+    for i in range(0, len(closing), RECONCILE_CHUNK):
+        chunk = closing[i:i + RECONCILE_CHUNK]
+        if supabase_patch('arret_intervals', f"id=in.({','.join(str(r['id']) for r in chunk)})",
+                          {'ended_at': now, 'updated_at': now}):
+            stats["closed"] += len(chunk)
+            record_batch('arret_intervals', chunk)
+    
+    opening = sorted(id_ for id_ in current if id_ not in open_)
+    for i in range(0, len(opening), RECONCILE_CHUNK):
+        chunk = opening[i:i + RECONCILE_CHUNK]
+        # Dernier intervalle fermé de chaque appareil (vue distinct on): une ligne par id au plus
+        last = {r['id_wsoucont']: r for r in supabase_get('arret_intervals_last', 'id,id_wsoucont,id_panne',
+                                                          f"id_wsoucont=in.({','.join(map(str, chunk))})")}
+        reopen, rows = [], []
+        for id_ in chunk:
+            a = current[id_]
+            id_panne = safe_int(a.get('nClepanne'))
+            prev = last.get(id_)
+            if prev and id_panne and prev.get('id_panne') == id_panne:
+                reopen.append(prev)
+            else:
+                rows.append({
+                    'id_wsoucont': id_,
+                    'id_panne': id_panne,
+                    'motif': safe_str(a.get('sMotifAppel'), 500),
+                    'started_at': progilift_timestamp(a.get('sDateAppel'), a.get('sHeureAppel')) or now,
+                    'ended_at': None,
+                    'updated_at': now
+                })
+        if reopen and supabase_patch('arret_intervals', f"id=in.({','.join(str(r['id']) for r in reopen)})",
+                                     {'ended_at': None, 'updated_at': now}):
+            stats["reopened"] += len(reopen)
+            record_batch('arret_intervals', reopen)
+        if rows and supabase_insert('arret_intervals', rows):
+            stats["opened"] += len(rows)
+    
+    stats["open"] = len(current)
+    return stats
+
 def sync_arrets():
     """Synchronise les appareils à l'arrêt"""
     wsid = get_auth()
@@ -265,6 +1975,11 @@ def sync_arrets():
     
     resp = progilift_call("get_AppareilsArret", {}, wsid, 30)
     arrets = parse_items(resp, "tabListeArrets")
+    # Une réponse en échec ne doit pas fermer tous les intervalles ouverts
+    if soap_complete(resp):
+        intervals = update_arret_intervals(arrets)
+    else:
+        intervals = {"skipped": "réponse Progilift incomplète ou vide"}
     
     supabase_delete('appareils_arret')
     inserted = 0
@@ -277,6 +1992,7 @@ def sync_arrets():
             'heure_appel': safe_str(a.get('sHeureAppel'), 20),
             'motif': safe_str(a.get('sMotifAppel'), 500),
             'demandeur': safe_str(a.get('sDemandeur'), 100),
+            'appel_at': progilift_timestamp(a.get('sDateAppel'), a.get('sHeureAppel')),
             'updated_at': datetime.now().isoformat()
         }):
             inserted += 1
@@ -286,6 +2002,7 @@ def sync_arrets():
         "step": 1,
         "arrets_found": len(arrets),
         "inserted": inserted,
+        "intervals": intervals,
         "next": "?step=2&sector=0"
     }
 
@@ -293,7 +2010,7 @@ def sync_arrets():
 # STEP 2: Équipements (Wsoucont)
 # ============================================================
 
-def sync_equipements(sector_idx):
+def sync_equipements(sector_idx, raw_mode=None, reconcile_mode=None, force=False):
     """Synchronise les équipements pour un secteur"""
     if sector_idx >= len(SECTORS):
         return {"status": "done", "message": "All sectors completed", "next": "?step=2b&sector=0"}
@@ -310,11 +2027,23 @@ def sync_equipements(sector_idx):
     
     items = parse_items(resp, "tabListeWsoucont")
     upserted = 0
+    raw_mode = raw_mode or RAW_PAYLOAD_MODE
+    sizes = [0, 0]
+    rows = 0
+    live = array('q')
+    batch = []
+    
+    def flush():
+        nonlocal upserted
+        if batch and supabase_upsert('equipements', batch):
+            upserted += len(batch)
+        batch.clear()
     
     for e in items:
         id_wsoucont = safe_int(e.get('IDWSOUCONT'))
         if not id_wsoucont:
             continue
+        live.append(id_wsoucont)
         
         data = {
             'id_wsoucont': id_wsoucont,
@@ -363,6 +2092,7 @@ def sync_equipements(sector_idx):
             'ordre2': safe_int(e.get('ORDRE2')),
             'code_acquittement': safe_str(e.get('CODE_ACQUITTEMENT'), 50),
             'date_heure_modif': safe_str(e.get('DATE_HEURE_MODIF'), 30),
+            'modif_at': progilift_timestamp(e.get('DATE_HEURE_MODIF')),
             'jan': safe_int(e.get('JAN')),
             'fev': safe_int(e.get('FEV')),
             'mar': safe_int(e.get('MAR')),
@@ -376,28 +2106,40 @@ def sync_equipements(sector_idx):
             'nov': safe_int(e.get('NOV')),
             'dec': safe_int(e.get('DEC')),
             'data_wsoucont': e,  # Dict directement, pas json.dumps()
+            'deleted_at': None,  # revue chez Progilift: plus supprimée (soft)
             'updated_at': datetime.now().isoformat()
         }
         
-        if supabase_upsert('equipements', data):
-            upserted += 1
+        apply_raw_mode(data, 'data_wsoucont', raw_mode, sizes)
+        rows += 1
+        
+        batch.append(data)
+        if len(batch) >= EQUIPEMENTS_BATCH:
+            flush()
+    flush()
     
     next_sector = sector_idx + 1
-    return {
+    result = {
         "status": "success",
         "step": 2,
         "sector": sector,
         "sector_idx": sector_idx,
         "equipements_found": len(items),
         "upserted": upserted,
+        "payload": payload_stats(raw_mode, sizes, rows),
         "next": f"?step=2&sector={next_sector}" if next_sector < len(SECTORS) else "?step=2b&sector=0"
     }
+    if reconcile_mode:
+        result["reconcile"] = reconcile('equipements', 'id_wsoucont', f"secteur=eq.{safe_int(sector)}",
+                                        IdSet(live), reconcile_mode, soap_complete(resp), force,
+                                        written=upserted)
+    return result
 
 # ============================================================
 # STEP 2b: Passages et données complémentaires (Wsoucont2)
 # ============================================================
 
-def sync_passages(sector_idx):
+def sync_passages(sector_idx, raw_mode=None):
     """Synchronise les passages (Wsoucont2) pour un secteur"""
     if sector_idx >= len(SECTORS):
         return {"status": "done", "message": "All sectors completed", "next": "?step=3&period=0"}
@@ -414,6 +2156,9 @@ def sync_passages(sector_idx):
     
     items = parse_items(resp, "tabListeWsoucont2")
     updated = 0
+    raw_mode = raw_mode or RAW_PAYLOAD_MODE
+    sizes = [0, 0]
+    rows = 0
     
     for e in items:
         id_wsoucont = safe_int(e.get('IDWSOUCONT'))
@@ -456,6 +2201,31 @@ def sync_passages(sector_idx):
             'dat13': safe_int(e.get('DAT13')),
             'dat14': safe_int(e.get('DAT14')),
             'dat15': safe_int(e.get('DAT15')),
+            'datepass1_date': progilift_date(e.get('DATEPASS1')),
+            'datepass2_date': progilift_date(e.get('DATEPASS2')),
+            'datepass3_date': progilift_date(e.get('DATEPASS3')),
+            'datepass4_date': progilift_date(e.get('DATEPASS4')),
+            'datepass5_date': progilift_date(e.get('DATEPASS5')),
+            'datepass6_date': progilift_date(e.get('DATEPASS6')),
+            'datepass7_date': progilift_date(e.get('DATEPASS7')),
+            'datepass8_date': progilift_date(e.get('DATEPASS8')),
+            'datepass9_date': progilift_date(e.get('DATEPASS9')),
+            'datepass10_date': progilift_date(e.get('DATEPASS10')),
+            'dat1_date': progilift_date(e.get('DAT1')),
+            'dat2_date': progilift_date(e.get('DAT2')),
+            'dat3_date': progilift_date(e.get('DAT3')),
+            'dat4_date': progilift_date(e.get('DAT4')),
+            'dat5_date': progilift_date(e.get('DAT5')),
+            'dat6_date': progilift_date(e.get('DAT6')),
+            'dat7_date': progilift_date(e.get('DAT7')),
+            'dat8_date': progilift_date(e.get('DAT8')),
+            'dat9_date': progilift_date(e.get('DAT9')),
+            'dat10_date': progilift_date(e.get('DAT10')),
+            'dat11_date': progilift_date(e.get('DAT11')),
+            'dat12_date': progilift_date(e.get('DAT12')),
+            'dat13_date': progilift_date(e.get('DAT13')),
+            'dat14_date': progilift_date(e.get('DAT14')),
+            'dat15_date': progilift_date(e.get('DAT15')),
             'txt1': safe_str(e.get('TXT1'), 500),
             'txt2': safe_str(e.get('TXT2'), 500),
             'txt3': safe_str(e.get('TXT3'), 500),
@@ -465,6 +2235,9 @@ def sync_passages(sector_idx):
             'updated_at': datetime.now().isoformat()
         }
         
+        apply_raw_mode(data, 'data_wsoucont2', raw_mode, sizes)
+        rows += 1
+        
         if supabase_update('equipements', 'id_wsoucont', id_wsoucont, data):
             updated += 1
     
@@ -476,6 +2249,7 @@ def sync_passages(sector_idx):
         "sector_idx": sector_idx,
         "passages_found": len(items),
         "updated": updated,
+        "payload": payload_stats(raw_mode, sizes, rows),
         "next": f"?step=2b&sector={next_sector}" if next_sector < len(SECTORS) else "?step=3&period=0"
     }
 
@@ -483,7 +2257,42 @@ def sync_passages(sector_idx):
 # STEP 3: Pannes
 # ============================================================
 
-def sync_pannes(period_idx):
+def panne_row(p):
+    """Ligne pannes à partir d'un item Wpanne (None si pas d'IDWPANNE)"""
+    id_panne = safe_int(p.get('IDWPANNE'))
+    if not id_panne:
+        return None
+    
+    return {
+        'id_panne': id_panne,
+        'id_wsoucont': safe_int(p.get('IDWSOUCONT')),
+        'ascenseur': safe_str(p.get('ASCENSEUR'), 50),
+        'adresse': safe_str(p.get('ADRES'), 200),
+        'code_postal': safe_str(p.get('NUM'), 10),
+        'date_appel': safe_str(p.get('DATEAPP'), 20),
+        'heure_appel': safe_str(p.get('HEUREAPP'), 20),
+        'date_arrivee': safe_str(p.get('DATEARR'), 20),
+        'heure_arrivee': safe_str(p.get('HEUREARR'), 20),
+        'date_depart': safe_str(p.get('DATEDEP'), 20),
+        'heure_depart': safe_str(p.get('HEUREDEP'), 20),
+        'motif': safe_str(p.get('MOTIF'), 500),
+        'cause': safe_str(p.get('CAUSE'), 500),
+        'travaux': safe_str(p.get('TRAVAUX'), 1000),
+        'depanneur': safe_str(p.get('DEPANNEUR'), 100),
+        'duree': safe_int(p.get('DUREE')),
+        'type_panne': safe_str(p.get('TYPEPANNE'), 100),
+        'etat': safe_str(p.get('ETAT'), 50),
+        'demandeur': safe_str(p.get('DEMANDEUR'), 100),
+        'personnes_bloquees': safe_str(p.get('PERSBLOQ'), 10),
+        'appel_at': progilift_timestamp(p.get('DATEAPP'), p.get('HEUREAPP')),
+        'arrivee_at': progilift_timestamp(p.get('DATEARR'), p.get('HEUREARR')),
+        'depart_at': progilift_timestamp(p.get('DATEDEP'), p.get('HEUREDEP')),
+        'data_wpanne': p,  # Dict directement, pas json.dumps()
+        'deleted_at': None,  # revue chez Progilift: plus supprimée (soft)
+        'updated_at': datetime.now().isoformat()
+    }
+
+def sync_pannes(period_idx, raw_mode=None, lowmem=None, memtrace=False, reconcile_mode=None, force=False):
     """Synchronise les pannes pour une période"""
     if period_idx >= len(PERIODS):
         return {"status": "done", "message": "All periods completed", "next": "?step=4"}
@@ -493,56 +2302,181 @@ def sync_pannes(period_idx):
     if not wsid:
         return {"status": "error", "message": "Auth failed"}
     
-    resp = progilift_call("get_Synchro_Wpanne", {
-        "dhDerniereMajFichier": since_date
-    }, wsid, 180)
+    lowmem = PANNES_LOWMEM if lowmem is None else lowmem
+    traced = tracemalloc.is_tracing()
+    if traced:
+        tracemalloc.reset_peak()
+    elif memtrace:
+        tracemalloc.start()
+    params = {"dhDerniereMajFichier": since_date}
+    spill = None
+    if lowmem:
+        # Réponse sur disque, items parsés au fil de l'eau depuis le mmap
+        spill = progilift_call_file("get_Synchro_Wpanne", params, wsid, 180)
+        complete = soap_complete(spill)
+        items = (panne_row(p) for p in iter_items_file(spill, "tabListeWpanne")) if spill else iter(())
+    else:
+        resp = progilift_call("get_Synchro_Wpanne", params, wsid, 180)
+        complete = soap_complete(resp)
+        items = [panne_row(p) for p in parse_items(resp, "tabListeWpanne")]
+        resp = None
     
-    items = parse_items(resp, "tabListeWpanne")
+    found = 0
     upserted = 0
+    touched = set()
+    months = set()
+    live = array('q')
+    raw_mode = raw_mode or RAW_PAYLOAD_MODE
+    sizes = [0, 0]
+    rows = 0
+    batch = []
     
-    for p in items:
-        id_panne = safe_int(p.get('IDWPANNE'))
-        if not id_panne:
-            continue
-        
-        data = {
-            'id_panne': id_panne,
-            'id_wsoucont': safe_int(p.get('IDWSOUCONT')),
-            'ascenseur': safe_str(p.get('ASCENSEUR'), 50),
-            'adresse': safe_str(p.get('ADRES'), 200),
-            'code_postal': safe_str(p.get('NUM'), 10),
-            'date_appel': safe_str(p.get('DATEAPP'), 20),
-            'heure_appel': safe_str(p.get('HEUREAPP'), 20),
-            'date_arrivee': safe_str(p.get('DATEARR'), 20),
-            'heure_arrivee': safe_str(p.get('HEUREARR'), 20),
-            'date_depart': safe_str(p.get('DATEDEP'), 20),
-            'heure_depart': safe_str(p.get('HEUREDEP'), 20),
-            'motif': safe_str(p.get('MOTIF'), 500),
-            'cause': safe_str(p.get('CAUSE'), 500),
-            'travaux': safe_str(p.get('TRAVAUX'), 1000),
-            'depanneur': safe_str(p.get('DEPANNEUR'), 100),
-            'duree': safe_int(p.get('DUREE')),
-            'type_panne': safe_str(p.get('TYPEPANNE'), 100),
-            'etat': safe_str(p.get('ETAT'), 50),
-            'demandeur': safe_str(p.get('DEMANDEUR'), 100),
-            'personnes_bloquees': safe_str(p.get('PERSBLOQ'), 10),
-            'data_wpanne': p,  # Dict directement, pas json.dumps()
-            'updated_at': datetime.now().isoformat()
-        }
-        
-        if supabase_upsert('pannes', data):
-            upserted += 1
+    def flush():
+        nonlocal upserted
+        if batch and supabase_upsert('pannes', batch):
+            upserted += len(batch)
+            touched.update(d['id_wsoucont'] for d in batch)
+            months.update(kpi_months(batch))
+        batch.clear()
+    
+    try:
+        for data in items:
+            found += 1
+            if not data:
+                continue
+            live.append(data['id_panne'])
+            
+            apply_raw_mode(data, 'data_wpanne', raw_mode, sizes)
+            rows += 1
+            
+            if lowmem:
+                batch.append(data)
+                if len(batch) >= PANNES_BATCH:
+                    flush()
+            elif supabase_upsert('pannes', data):
+                upserted += 1
+                touched.add(data['id_wsoucont'])
+                months.update(kpi_months([data]))
+        flush()
+    finally:
+        items = None
+        if spill:
+            spill.close()
+        memory = {"lowmem": lowmem, "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+        if tracemalloc.is_tracing():
+            memory["tracemalloc_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            if not traced:
+                tracemalloc.stop()
+    
+    reconciled = None
+    if reconcile_mode:
+        # Toute panne appelée depuis la période a été modifiée depuis: elle doit être dans la réponse.
+        # Les pannes écrites par api/cron.py n'ont que date_panne_at
+        window = quote(progilift_timestamp(since_date), safe='')
+        reconciled = reconcile('pannes', 'id_panne', f"or=(appel_at.gte.{window},date_panne_at.gte.{window})",
+                               IdSet(live), reconcile_mode, complete, force, group='id_wsoucont',
+                               written=upserted)
+        # Cumuls sans les pannes supprimées (soft comme hard)
+        touched |= reconciled.pop("groups", set())
+    
+    touched.discard(None)
+    rollups = update_equipement_rollups(touched)
     
     next_period = period_idx + 1
-    return {
+    result = {
         "status": "success",
         "step": 3,
         "period": since_date,
         "period_idx": period_idx,
-        "pannes_found": len(items),
+        "pannes_found": found,
         "upserted": upserted,
+        "payload": payload_stats(raw_mode, sizes, rows),
+        "memory": memory,
+        "rollups_updated": rollups,
+        "months": sorted(months),
         "next": f"?step=3&period={next_period}" if next_period < len(PERIODS) else "?step=4"
     }
+    if reconciled:
+        result["reconcile"] = reconciled
+    return result
+
+# ============================================================
+# CUMULS PANNES PAR ÉQUIPEMENT (colonnes de equipements)
+# ============================================================
+
+ROLLUP_SELECT = 'id_panne,id_wsoucont,date_appel,heure_appel,date_arrivee,heure_arrivee,personnes_bloquees'
+ROLLUP_CHUNK = 100
+
+def new_rollup():
+    return {'n30': 0, 'n365': 0, 'last': None, 'arrivee_sum': 0.0, 'arrivee_n': 0, 'bloquees': 0}
+
+def add_panne_rollup(acc, panne, now):
+    """Cumule une panne dans les compteurs d'un équipement"""
+    appel = parse_progilift_datetime(panne.get('date_appel'), panne.get('heure_appel'))
+    if appel:
+        age = now - appel
+        if age.days < 30:
+            acc['n30'] += 1
+        if age.days < 365:
+            acc['n365'] += 1
+        if acc['last'] is None or appel > acc['last']:
+            acc['last'] = appel
+        arrivee = parse_progilift_datetime(panne.get('date_arrivee'), panne.get('heure_arrivee'))
+        if arrivee and arrivee >= appel:
+            acc['arrivee_sum'] += (arrivee - appel).total_seconds() / 60
+            acc['arrivee_n'] += 1
+    bloq = (panne.get('personnes_bloquees') or '').strip().upper()
+    if bloq and bloq not in ('0', 'N', 'NON', 'F', 'FALSE'):
+        acc['bloquees'] += 1
+
+def rollup_row(id_wsoucont, acc):
+    return {
+        'id_wsoucont': id_wsoucont,
+        'pannes_30j': acc['n30'],
+        'pannes_365j': acc['n365'],
+        'derniere_panne': acc['last'].isoformat() if acc['last'] else None,
+        'delai_arrivee_moyen': round(acc['arrivee_sum'] / acc['arrivee_n'], 1) if acc['arrivee_n'] else None,
+        'incidents_personnes_bloquees': acc['bloquees']
+    }
+
+def write_rollups(rows):
+    """PATCH des colonnes de cumul: un upsert de lignes partielles recréerait les équipements supprimés entre-temps"""
+    return supabase_patch_rows('equipements', 'id_wsoucont', rows, ROLLUP_CHUNK)
+
+def update_equipement_rollups(ids):
+    """Recalcule les cumuls des seuls équipements touchés, par paquets"""
+    ids = sorted(ids)
+    now = datetime.now()
+    written = 0
+    for i in range(0, len(ids), ROLLUP_CHUNK):
+        chunk = ','.join(str(x) for x in ids[i:i + ROLLUP_CHUNK])
+        existing = {eq['id_wsoucont'] for eq in supabase_get('equipements', 'id_wsoucont',
+                                                             f"id_wsoucont=in.({chunk})&{NOT_DELETED}")}
+        acc = {id_: new_rollup() for id_ in existing}
+        for p in supabase_stream('pannes', ROLLUP_SELECT, 'id_panne', f"id_wsoucont=in.({chunk})&{NOT_DELETED}"):
+            if p.get('id_wsoucont') in acc:
+                add_panne_rollup(acc[p['id_wsoucont']], p, now)
+        written += write_rollups([rollup_row(id_, a) for id_, a in acc.items()])
+    return written
+
+def rebuild_equipement_rollups():
+    """Recalcul complet: un passage sur equipements puis sur toutes les pannes"""
+    start = datetime.now()
+    acc = {eq['id_wsoucont']: new_rollup() for eq in supabase_stream('equipements', 'id_wsoucont', 'id_wsoucont', NOT_DELETED)}
+    pannes = 0
+    for p in supabase_stream('pannes', ROLLUP_SELECT, 'id_panne', NOT_DELETED):
+        pannes += 1
+        if p.get('id_wsoucont') in acc:
+            add_panne_rollup(acc[p['id_wsoucont']], p, start)
+    written = write_rollups([rollup_row(id_, a) for id_, a in acc.items()])
+    return {
+        "status": "success" if written == len(acc) else "partial",
+        "mode": "rollups",
+        "equipements": len(acc),
+        "pannes": pannes,
+        "updated": written,
+        "duration": round((datetime.now() - start).total_seconds(), 1)
+    }
 
 # ============================================================
 # STEP 4: Mise à jour nb_visites_an
@@ -575,7 +2509,252 @@ def update_nb_visites():
         "type_planning_codes": len(type_map),
         "equipements_with_planning": len(equipements),
         "updated": updated,
-        "message": "nb_visites_an updated!"
+        "message": "nb_visites_an updated!",
+        "next": "?step=5"
+    }
+
+# ============================================================
+# STEP 5: Agrégats KPI
+# ============================================================
+
+KPI_SELECT = 'id_panne,id_wsoucont,date_appel,heure_appel,date_arrivee,heure_arrivee,duree'
+KPI_MOIS_SELECT = 'secteur,mois,pannes_count,duree_sum,duree_n,arrivee_sum,arrivee_n'
+
+def new_kpi():
+    return {'pannes': 0, 'duree_sum': 0, 'duree_n': 0, 'arrivee_sum': 0.0, 'arrivee_n': 0}
+
+def add_panne_kpi(acc, panne):
+    """Cumule une panne: nombre, durée d'intervention, délai appel → arrivée (minutes)"""
+    acc['pannes'] += 1
+    duree = panne.get('duree')
+    if isinstance(duree, int) and duree >= 0:
+        acc['duree_sum'] += duree
+        acc['duree_n'] += 1
+    appel = parse_progilift_datetime(panne.get('date_appel'), panne.get('heure_appel'))
+    arrivee = parse_progilift_datetime(panne.get('date_arrivee'), panne.get('heure_arrivee'))
+    if appel and arrivee and arrivee >= appel:
+        acc['arrivee_sum'] += (arrivee - appel).total_seconds() / 60
+        acc['arrivee_n'] += 1
+
+def merge_kpi(acc, other):
+    for k in acc:
+        acc[k] += other[k]
+    return acc
+
+def kpi_from_row(row):
+    """Cumuls d'une ligne kpi_mois déjà écrite"""
+    return {'pannes': row.get('pannes_count') or 0, 'duree_sum': row.get('duree_sum') or 0,
+            'duree_n': row.get('duree_n') or 0, 'arrivee_sum': row.get('arrivee_sum') or 0.0,
+            'arrivee_n': row.get('arrivee_n') or 0}
+
+def kpi_row(acc):
+    return {
+        'pannes_count': acc['pannes'],
+        'duree_moyenne': round(acc['duree_sum'] / acc['duree_n'], 1) if acc['duree_n'] else None,
+        'delai_arrivee_moyen': round(acc['arrivee_sum'] / acc['arrivee_n'], 1) if acc['arrivee_n'] else None
+    }
+
+def kpi_mois_row(acc):
+    """Ligne kpi_mois: moyennes affichées plus sommes et effectifs, pour recomposer les secteurs"""
+    return dict(kpi_row(acc), duree_sum=acc['duree_sum'], duree_n=acc['duree_n'],
+                arrivee_sum=round(acc['arrivee_sum'], 3), arrivee_n=acc['arrivee_n'])
+
+def kpi_month_filter(mois):
+    """Pannes appelées dans le mois 'AAAA-MM' (heure locale Progilift, sur appel_at)"""
+    y, m = int(mois[:4]), int(mois[5:7])
+    start = progilift_timestamp(f"{y:04d}{m:02d}01")
+    end = progilift_timestamp(f"{y + m // 12:04d}{m % 12 + 1:02d}01")
+    return f"appel_at=gte.{quote(start, safe='')}&appel_at=lt.{quote(end, safe='')}"
+
+def kpi_months(rows, date_key='date_appel'):
+    """Mois 'AAAA-MM' des pannes écrites (à recalculer par update_kpis)"""
+    months = set()
+    for r in rows:
+        appel = parse_progilift_datetime(r.get(date_key))
+        if appel:
+            months.add(appel.strftime('%Y-%m'))
+    return months
+
+def kpi_mois_existing():
+    """Toutes les lignes kpi_mois (quelques centaines), par pages"""
+    offset = 0
+    while True:
+        page = supabase_get('kpi_mois', KPI_MOIS_SELECT, f"order=secteur.asc,mois.asc&offset={offset}", 1000)
+        yield from page
+        if len(page) < 1000:
+            return
+        offset += len(page)
+
+def update_kpis(months=None):
+    """KPI par mois et par secteur
+
+    months=None: un passage sur toutes les pannes (step 5). Sinon seuls ces mois
+    'AAAA-MM' sont relus (cron: mois des pannes de la fenêtre) et les autres mois
+    sont repris de kpi_mois. Les secteurs sont toujours la somme de leurs mois:
+    une panne sans date d'appel n'est comptée nulle part. Les lignes supprimées
+    (deleted_at) ne comptent pas.
+    """
+    start = datetime.now()
+    
+    secteur_of = {}
+    equipements = {}
+    for eq in supabase_stream('equipements', 'id_wsoucont,secteur', 'id_wsoucont', NOT_DELETED):
+        secteur_of[eq['id_wsoucont']] = eq.get('secteur')
+        equipements[eq.get('secteur')] = equipements.get(eq.get('secteur'), 0) + 1
+    
+    arrets = {}
+    for a in supabase_get('appareils_arret', 'id_wsoucont'):
+        secteur = secteur_of.get(a.get('id_wsoucont'))
+        arrets[secteur] = arrets.get(secteur, 0) + 1
+    
+    par_mois = {}
+    pannes = 0
+    for filter_str in [None] if months is None else [kpi_month_filter(m) for m in sorted(months)]:
+        filter_str = f"{filter_str}&{NOT_DELETED}" if filter_str else NOT_DELETED
+        for p in supabase_stream('pannes', KPI_SELECT, 'id_panne', filter_str):
+            pannes += 1
+            appel = parse_progilift_datetime(p.get('date_appel'))
+            if appel:
+                key = (secteur_of.get(p.get('id_wsoucont')), appel.strftime('%Y-%m'))
+                add_panne_kpi(par_mois.setdefault(key, new_kpi()), p)
+    
+    # Couples (secteur, mois) recalculés mais sans panne désormais: remis à zéro
+    par_secteur = {}
+    for r in kpi_mois_existing():
+        key = (r.get('secteur'), r.get('mois'))
+        if months is None or key[1] in months:
+            par_mois.setdefault(key, new_kpi())
+        else:
+            merge_kpi(par_secteur.setdefault(key[0], new_kpi()), kpi_from_row(r))
+    for (sec, _), acc in par_mois.items():
+        merge_kpi(par_secteur.setdefault(sec, new_kpi()), acc)
+    
+    now = datetime.now().isoformat()
+    secteurs = set(equipements) | set(par_secteur) | set(arrets)
+    rows_secteurs = [dict(kpi_row(par_secteur.get(sec, new_kpi())),
+                          secteur=sec,
+                          equipements_count=equipements.get(sec, 0),
+                          arrets_count=arrets.get(sec, 0),
+                          updated_at=now)
+                     for sec in secteurs if sec is not None]
+    rows_mois = [dict(kpi_mois_row(acc), secteur=sec, mois=mois, updated_at=now)
+                 for (sec, mois), acc in par_mois.items() if sec is not None]
+    
+    ok = True
+    for table, rows in (('kpi_secteurs', rows_secteurs), ('kpi_mois', rows_mois)):
+        for i in range(0, len(rows), 500):
+            ok = supabase_upsert(table, rows[i:i + 500]) and ok
+    
+    return {
+        "status": "success" if ok else "partial",
+        "step": 5,
+        "equipements": len(secteur_of),
+        "months": "all" if months is None else sorted(months),
+        "pannes": pannes,
+        "kpi_secteurs": len(rows_secteurs),
+        "kpi_mois": len(rows_mois),
+        "duration": round((datetime.now() - start).total_seconds(), 1),
+        "message": "KPI updated!",
+        "next": "?step=6"
+    }
+
+# ============================================================
+# STEP 6: Score de risque (score_ml)
+# ============================================================
+
+SCORE_SELECT = ('id_wsoucont,score_ml,pannes_30j,pannes_365j,derniere_panne,incidents_personnes_bloquees,'
+                + ','.join(f'datepass{i}' for i in range(1, 11)) + ','
+                + ','.join(f'dat{i}' for i in range(1, 16)))
+
+# Poids fixés à la main, non appris (aucun historique étiqueté): à revoir avec les pannes réelles.
+# Le score est la sigmoïde de leur somme pondérée sur les features normalisées (cf. score_features).
+SCORE_BIAS = -5.5
+SCORE_WEIGHTS = {
+    'pannes_365j': 1.1,     # log1p(pannes sur 12 mois)
+    'pannes_30j': 0.8,      # log1p(pannes sur 30 jours)
+    'recence': 1.2,         # exp(-jours depuis la dernière panne / 90)
+    'bloquees': 0.6,        # log1p(incidents personnes bloquées)
+    'sans_visite': 0.9,     # années depuis le dernier passage (plafonné à 2)
+    'anciennete': 0.5,      # décennies depuis la plus ancienne date connue (plafonné à 4)
+}
+
+def date_int_days(value, today, cache):
+    """Jours écoulés depuis une date AAAAMMJJ (int ou str), None si invalide"""
+    if not value:
+        return None
+    days = cache.get(value)
+    if days is None and value not in cache:
+        dt = parse_progilift_datetime(str(value))
+        days = (today - dt).days if dt else None
+        cache[value] = days
+    return days
+
+def score_features(rows, today):
+    """Colonnes de features (array('d')) pour toute la flotte, dans l'ordre de rows"""
+    cache = {}
+    cols = {name: array('d') for name in SCORE_WEIGHTS}
+    for r in rows:
+        cols['pannes_365j'].append(math.log1p(r.get('pannes_365j') or 0))
+        cols['pannes_30j'].append(math.log1p(r.get('pannes_30j') or 0))
+        last = r.get('derniere_panne')
+        try:
+            last_dt = datetime.fromisoformat(last).replace(tzinfo=None) if last else None
+            recence = math.exp(-max((today - last_dt).days, 0) / 90) if last_dt else 0.0
+        except (TypeError, ValueError):
+            recence = 0.0
+        cols['recence'].append(recence)
+        cols['bloquees'].append(math.log1p(r.get('incidents_personnes_bloquees') or 0))
+        passages = [d for d in (date_int_days(r.get(f'datepass{i}'), today, cache) for i in range(1, 11)) if d is not None]
+        dates = passages + [d for d in (date_int_days(r.get(f'dat{i}'), today, cache) for i in range(1, 16)) if d is not None]
+        cols['sans_visite'].append(min(min(passages) / 365, 2.0) if passages else 2.0)
+        cols['anciennete'].append(min(max(dates) / 3650, 4.0) if dates else 0.0)
+    return cols
+
+def score_batch(cols):
+    """Score 0-100 par équipement: sigmoïde de la combinaison linéaire des colonnes
+
+    Simples boucles Python (compréhensions) sur des array('d'), colonne par colonne: pas de calcul vectorisé.
+    """
+    n = len(next(iter(cols.values()))) if cols else 0
+    z = array('d', [SCORE_BIAS]) * n
+    for name, w in SCORE_WEIGHTS.items():
+        col = cols[name]
+        z = array('d', [a + w * b for a, b in zip(z, col)])
+    return array('d', [round(100 / (1 + math.exp(-v)), 1) for v in z])
+
+def update_scores(ids=None):
+    """Calcule score_ml en un lot, pour toute la flotte ou les seuls ids; seuls les scores qui changent sont écrits"""
+    start = datetime.now()
+    if ids is None:
+        rows = list(supabase_stream('equipements', SCORE_SELECT, 'id_wsoucont', NOT_DELETED))
+    else:
+        ids = sorted(ids)
+        rows = []
+        for i in range(0, len(ids), ROLLUP_CHUNK):
+            chunk = ','.join(str(x) for x in ids[i:i + ROLLUP_CHUNK])
+            rows.extend(supabase_get('equipements', SCORE_SELECT, f"id_wsoucont=in.({chunk})&{NOT_DELETED}"))
+    fetched = datetime.now()
+    scores = score_batch(score_features(rows, start))
+    computed = datetime.now()
+    
+    # PATCH groupés par valeur (arrondie au dixième: au plus 1001 requêtes), scores inchangés omis
+    changed = [{'id_wsoucont': r['id_wsoucont'], 'score_ml': sc} for r, sc in zip(rows, scores) if r.get('score_ml') != sc]
+    written = supabase_patch_rows('equipements', 'id_wsoucont', changed)
+    
+    return {
+        "status": "success" if written == len(changed) else "partial",
+        "step": 6,
+        "scope": "fleet" if ids is None else "touched",
+        "equipements": len(rows),
+        "updated": written,
+        "unchanged": len(rows) - len(changed),
+        "at_risk": sum(1 for sc in scores if sc > 70),
+        "timings": {
+            "fetch": round((fetched - start).total_seconds(), 2),
+            "score": round((computed - fetched).total_seconds(), 2),
+            "write": round((datetime.now() - computed).total_seconds(), 2)
+        },
+        "message": "score_ml updated!"
     }
 
 # ============================================================
@@ -594,6 +2773,14 @@ def sync_cron():
     r2 = sync_pannes(0)
     results['pannes'] = r2.get('upserted', 0)
     
+    # KPI des seuls mois touchés par les pannes
+    r3 = update_kpis(set(r2.get('months', [])))
+    results['kpi'] = r3.get('status')
+    
+    # Scores de risque
+    r4 = update_scores()
+    results['scores'] = r4.get('updated', 0)
+    
     return {
         "status": "success",
         "mode": "cron",
@@ -601,6 +2788,223 @@ def sync_cron():
         "timestamp": datetime.now().isoformat()
     }
 
+# ============================================================
+# FAN-OUT DES SHARDS (auto-invocations parallèles, bilan dans sync_runs)
+# ============================================================
+
+def fanout_units(step):
+    """Shards d'un step: [(unité, query string)]"""
+    if step in ('2', '2b'):
+        return [(f"{step}:{i}", f"step={step}&sector={i}") for i in range(len(SECTORS))]
+    if step == '3':
+        return [(f"3:{i}", f"step=3&period={i}") for i in range(len(PERIODS))]
+    return [(step, f"step={step}")]
+
+def fanout_unit(step, sector, period):
+    """Nom d'unité d'une invocation de shard (cf. fanout_units)"""
+    if step in ('2', '2b'):
+        return f"{step}:{sector}"
+    return f"3:{period}" if step == '3' else step
+
+def fanout_record(run_id, unit, owner, result=None, started=None):
+    """Ligne sync_runs fanout:ID:unité: en cours (result None, expire après LEASE_TTL) ou terminée"""
+    now = datetime.now(timezone.utc)
+    progress = {"unit": unit, "status": "running", "started_at": started or _utc_iso(now)}
+    expires = now + timedelta(seconds=LEASE_TTL)
+    if result is not None:
+        status = result.get("status") if isinstance(result, dict) else "error"
+        progress.update({
+            "status": "success" if status in ("success", "done") else status or "error",
+            "finished_at": _utc_iso(now),
+            "seconds": round((now - datetime.fromisoformat(progress["started_at"].replace('Z', '+00:00'))).total_seconds(), 1),
+            "message": (result.get("message") if isinstance(result, dict) else str(result)) or None,
+            "result": {k: v for k, v in result.items()
+                       if isinstance(v, (int, float, str)) and k not in ("status", "message", "trace")}
+            if isinstance(result, dict) else {}
+        })
+        expires = datetime.fromtimestamp(0, timezone.utc)
+    supabase_upsert('sync_runs', {
+        'name': f"fanout:{run_id}:{unit}",
+        'owner': owner,
+        'expires_at': _utc_iso(expires),
+        'progress': progress,
+        'updated_at': _utc_iso(now)
+    }, spool=False)
+    return progress
+
+def fanout_finish(run_id, unit, owner, result, started):
+    """Fin d'un shard: résultat noté, verrou libéré si le coordinateur est reparti et plus rien ne tourne"""
+    fanout_record(run_id, unit, owner, result, started)
+    plan = supabase_get('sync_runs', 'progress', f"name=eq.fanout:{run_id}", 1)
+    if plan and plan[0]['progress'].get('returned_at') and fanout_idle(run_id):
+        lease_release(owner)
+
+def fanout_idle(run_id):
+    """Plus aucun shard en cours (terminés, en échec ou jamais lancés)"""
+    status = fanout_status(run_id)
+    return status.get("counts", {}).get("running", 0) == 0
+
+def fanout_rows(run_id):
+    """(plan, {unité: ligne}) d'un fan-out"""
+    plan = supabase_get('sync_runs', 'name,owner,progress,updated_at', f"name=eq.fanout:{run_id}", 1)
+    units = {r['progress'].get('unit'): r for r in supabase_stream(
+        'sync_runs', 'name,expires_at,progress', 'name', f"name=like.fanout:{run_id}:*") if r.get('progress')}
+    return (plan[0] if plan else None), units
+
+def fanout_live(row, now):
+    """Shard lancé et encore dans son délai (invocation en cours)"""
+    if not row or row['progress'].get('status') != 'running':
+        return False
+    return datetime.fromisoformat(row['expires_at'].replace('Z', '+00:00')) > now
+
+def fanout_token(run_id, owner):
+    """Jeton d'un shard: HMAC(SYNC_FANOUT_SECRET, run + owner du coordinateur)"""
+    return hmac.new(FANOUT_SECRET.encode(), f"{run_id}:{owner}".encode(), hashlib.sha256).hexdigest()
+
+def fanout_owner(run_id, token):
+    """Owner du coordinateur pour un shard dont le jeton est valide (PermissionError sinon)
+
+    L'owner ne sort jamais du serveur: il est relu dans la ligne du plan.
+    """
+    if not FANOUT_SECRET:
+        raise PermissionError("fan-out requires SYNC_FANOUT_SECRET")
+    plan = supabase_get('sync_runs', 'owner', f"name=eq.fanout:{run_id}", 1)
+    if not plan or not hmac.compare_digest(token or '', fanout_token(run_id, plan[0]['owner'])):
+        raise PermissionError("invalid fan-out shard token")
+    return plan[0]['owner']
+
+def fanout_dispatch(base_url, query, run_id, owner):
+    """Auto-invocation d'un shard (bloquante jusqu'à sa réponse)"""
+    url = f"{base_url}?{query}&fanout={run_id}&shard={fanout_token(run_id, owner)}"
+    status, body = http_request(url, 'GET', None, {'Accept': 'application/json'}, FANOUT_SHARD_TIMEOUT)
+    try:
+        result = json.loads(body) if status == 200 else None
+    except ValueError:
+        result = None
+    return result if isinstance(result, dict) else {"status": "error", "message": f"HTTP {status}: {body[:200]}"}
+
+def fanout_status(run_id):
+    """Bilan d'un fan-out: compteurs par état, échecs, shard le plus lent"""
+    plan, rows = fanout_rows(run_id)
+    if not plan:
+        return {"status": "error", "message": f"unknown fan-out run: {run_id}"}
+    now = datetime.now(timezone.utc)
+    units = plan['progress'].get('units', [])
+    counts = {"pending": 0, "running": 0, "success": 0, "failed": 0}
+    failures = []
+    slowest = None
+    for unit in units:
+        row = rows.get(unit)
+        state = row['progress'] if row else None
+        if state is None:
+            counts["pending"] += 1
+        elif state.get('status') == 'running':
+            if fanout_live(row, now):
+                counts["running"] += 1
+            else:
+                counts["failed"] += 1
+                failures.append({"unit": unit, "status": "lost", "message": "no result before expiry"})
+        elif state.get('status') == 'success':
+            counts["success"] += 1
+            if slowest is None or state.get('seconds', 0) > slowest['seconds']:
+                slowest = {"unit": unit, "seconds": state.get('seconds', 0)}
+        else:
+            counts["failed"] += 1
+            failures.append({"unit": unit, "status": state.get('status'), "message": state.get('message')})
+    started = plan['progress'].get('started_at')
+    if counts["success"] == len(units):
+        status = "success"
+    elif counts["running"] or counts["pending"]:
+        status = "running"
+    else:
+        status = "partial"
+    return {
+        "status": status,
+        "run": run_id,
+        "steps": plan['progress'].get('steps'),
+        "total": len(units),
+        "counts": counts,
+        "progress": round(counts["success"] / len(units), 3) if units else 1.0,
+        "failures": failures,
+        "slowest": slowest,
+        "elapsed": round((now - datetime.fromisoformat(started.replace('Z', '+00:00'))).total_seconds(), 1) if started else None,
+        "next": None if status == "success" else f"?mode=fanout&run={run_id}"
+    }
+
+def sync_fanout(base_url, steps=None, run_id=None, concurrency=None):
+    """Coordinateur: shards de chaque step lancés en parallèle (au plus concurrency), vague par vague
+
+    Le verrou 'sync' est pris au nom du run et rejoint par chaque shard
+    (&shard=, jeton signé, cf. fanout_owner). Les shards notent leur résultat dans sync_runs; relancer avec
+    &run=ID reprend les shards manquants ou en échec.
+    """
+    if not FANOUT_SECRET:
+        raise PermissionError("fan-out requires SYNC_FANOUT_SECRET")
+    started = time.monotonic()
+    concurrency = min(max(concurrency or FANOUT_CONCURRENCY, 1), FANOUT_MAX_CONCURRENCY)
+    plan = fanout_rows(run_id)[0] if run_id else None
+    if run_id and not plan:
+        return {"status": "error", "message": f"unknown fan-out run: {run_id}"}
+    if plan:
+        owner, steps = plan['owner'], plan['progress']['steps']
+        if plan['progress'].get('returned_at'):
+            # Coordinateur de nouveau actif: les shards ne libèrent plus le verrou
+            plan['progress'].pop('returned_at')
+            supabase_patch('sync_runs', f"name=eq.fanout:{run_id}", {'progress': plan['progress']})
+    else:
+        run_id, owner, steps = uuid.uuid4().hex[:12], lease_owner(), list(steps or FANOUT_STEPS)
+    progress = {"mode": "fanout", "run": run_id, "steps": steps, "started_at": datetime.now().isoformat()}
+    if not lease_acquire(owner, progress):
+        return {"status": "busy", "message": "Another sync is running", "holder": lease_holder()}
+    if not plan:
+        supabase_upsert('sync_runs', {
+            'name': f"fanout:{run_id}",
+            'owner': owner,
+            'expires_at': '1970-01-01T00:00:00Z',
+            'progress': {"steps": steps, "units": [u for s in steps for u, _ in fanout_units(s)],
+                         "started_at": _utc_iso(datetime.now(timezone.utc))},
+            'updated_at': _utc_iso(datetime.now(timezone.utc))
+        }, spool=False)
+
+    dispatched = 0
+    for step in steps:
+        rows = fanout_rows(run_id)[1]
+        now = datetime.now(timezone.utc)
+        todo = [(unit, query) for unit, query in fanout_units(step)
+                if (rows.get(unit) or {}).get('progress', {}).get('status') != 'success' and not fanout_live(rows.get(unit), now)]
+
+        def shard(unit, query):
+            if time.monotonic() - started > FANOUT_DISPATCH_BUDGET:
+                return None  # plus le temps de lancer: repris au prochain appel
+            return fanout_dispatch(base_url, query, run_id, owner)
+
+        pool = ThreadPoolExecutor(max_workers=concurrency)
+        futures = [pool.submit(shard, unit, query) for unit, query in todo]
+        futures_wait(futures, timeout=max(FANOUT_DEADLINE - (time.monotonic() - started), 0))
+        pool.shutdown(wait=False, cancel_futures=True)
+        dispatched += sum(1 for f in futures if f.done() and not f.cancelled() and f.result() is not None)
+        lease_acquire(owner, dict(progress, step=step))  # renouvelé pour la vague suivante
+
+        # La vague suivante dépend de celle-ci (2b met à jour les lignes créées par 2)
+        rows = fanout_rows(run_id)[1]
+        if any((rows.get(u) or {}).get('progress', {}).get('status') != 'success' for u, _ in fanout_units(step)):
+            break
+
+    status = fanout_status(run_id)
+    if status["counts"]["running"]:
+        # Shards encore en vol: le dernier à finir libère le verrou (cf. fanout_finish).
+        # Revérifié après le marquage: un shard fini entre-temps n'a pas vu returned_at.
+        plan = fanout_rows(run_id)[0]
+        supabase_patch('sync_runs', f"name=eq.fanout:{run_id}",
+                       {'progress': dict(plan['progress'], returned_at=_utc_iso(datetime.now(timezone.utc)))})
+        if fanout_idle(run_id):
+            lease_release(owner)
+    else:
+        lease_release(owner)  # terminé, en échec ou en attente: relancer avec &run=ID reprend la suite
+    status.update(mode="fanout", dispatched=dispatched, concurrency=concurrency,
+                  duration=round(time.monotonic() - started, 1))
+    return status
+
 # ============================================================
 # HANDLER HTTP (Vercel)
 # ============================================================
@@ -616,10 +3020,13 @@ class handler(BaseHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Profile-Secret')
         self.end_headers()
     
     def _respond(self):
+        global SOAP_REPLAY, FANOUT_SHARD
+        shard = None
+        FANOUT_SHARD = False
         try:
             parsed = urlparse(self.path)
             params = parse_qs(parsed.query)
@@ -628,21 +3035,95 @@ class handler(BaseHTTPRequestHandler):
             sector = int(params.get('sector', ['0'])[0])
             period = int(params.get('period', ['0'])[0])
             mode = params.get('mode', [''])[0]
+            wait = int(params.get('wait', ['0'])[0])
+            raw_mode = params.get('raw', [''])[0] or None
+            lowmem = {'1': True, '0': False}.get(params.get('lowmem', [''])[0])
+            memtrace = params.get('memtrace', [''])[0] == '1'
+            profile = params.get('profile', [''])[0] == '1'
+            engine = params.get('engine', [''])[0]
+            if engine not in ('', 'sync', 'async'):
+                raise ValueError("engine must be sync or async")
+            SOAP_REPLAY = params.get('replay', [''])[0] == '1'
+            fanout_run = params.get('fanout', [''])[0] or params.get('run', [''])[0]
+            if fanout_run and not re.match(r'^[0-9a-f]{1,32}$', fanout_run):
+                raise ValueError("invalid fan-out run id")
+            owner = None
+            if params.get('fanout'):
+                owner = fanout_owner(fanout_run, params.get('shard', [''])[0])
+                FANOUT_SHARD = True
+            reconcile_mode = params.get('reconcile', [''])[0] or None
+            force = params.get('force', [''])[0] == '1'
+            if reconcile_mode and reconcile_mode not in RECONCILE_MODES:
+                raise ValueError(f"reconcile must be one of {', '.join(RECONCILE_MODES)}")
+            progress = {
+                "mode": mode or None,
+                "step": step,
+                "sector": sector,
+                "period": period,
+                "started_at": datetime.now().isoformat()
+            }
             
-            if mode == 'cron':
-                result = sync_cron()
+            def run(fn, progress, wait):
+                # Shard d'un fan-out: verrou du coordinateur rejoint, laissé à son détenteur
+                return run_with_lease(fn, progress, wait, owner, release=owner is None)
+            
+            if profile:
+                if not profile_allowed(self.headers.get('X-Profile-Secret')):
+                    raise PermissionError("profile=1 requires a valid X-Profile-Secret header")
+                
+                run_plain = run
+                
+                def run(fn, progress, wait):
+                    def profiled():
+                        result, report = run_profiled(fn)
+                        if isinstance(result, dict):
+                            result["profile"] = report
+                        return result
+                    return run_plain(profiled, progress, wait)
+            
+            if engine == 'async':
+                run_blocking = run
+                
+                def run(fn, progress, wait):
+                    return run_blocking(lambda: run_async_engine(fn), progress, wait)
+            
+            if params.get('fanout') and step:
+                unit = fanout_unit(step, sector, period)
+                shard = (fanout_run, unit, owner, fanout_record(fanout_run, unit, owner)["started_at"])
+            
+            if mode == 'fanout':
+                steps = [s for s in params.get('steps', [''])[0].split(',') if s] or list(FANOUT_STEPS)
+                unknown = [s for s in steps if s not in ('0', '1', '2', '2b', '3', '4', '5', '6')]
+                if unknown:
+                    raise ValueError(f"unknown steps: {', '.join(unknown)}")
+                concurrency = int(params.get('concurrency', ['0'])[0]) or None
+                base_url = FANOUT_URL or (f"{self.headers.get('X-Forwarded-Proto', 'https')}://"
+                                          f"{self.headers.get('X-Forwarded-Host') or self.headers.get('Host')}/api/sync")
+                result = sync_fanout(base_url, steps, fanout_run or None, concurrency)
+            elif mode == 'status':
+                if not fanout_run:
+                    raise ValueError("status requires &run=ID")
+                result = fanout_status(fanout_run)
+            elif mode == 'cron':
+                result = run(sync_cron, progress, wait)
+            elif mode == 'rollups':
+                result = run(rebuild_equipement_rollups, progress, wait)
             elif step == '0':
-                result = sync_type_planning()
+                result = run(sync_type_planning, progress, wait)
             elif step == '1':
-                result = sync_arrets()
+                result = run(sync_arrets, progress, wait)
             elif step == '2':
-                result = sync_equipements(sector)
+                result = run(lambda: sync_equipements(sector, raw_mode, reconcile_mode, force), progress, wait)
             elif step == '2b':
-                result = sync_passages(sector)
+                result = run(lambda: sync_passages(sector, raw_mode), progress, wait)
             elif step == '3':
-                result = sync_pannes(period)
+                result = run(lambda: sync_pannes(period, raw_mode, lowmem, memtrace, reconcile_mode, force), progress, wait)
             elif step == '4':
-                result = update_nb_visites()
+                result = run(update_nb_visites, progress, wait)
+            elif step == '5':
+                result = run(update_kpis, progress, wait)
+            elif step == '6':
+                result = run(update_scores, progress, wait)
             else:
                 result = {
                     "status": "ready",
@@ -658,10 +3139,21 @@ class handler(BaseHTTPRequestHandler):
                         "step2b": "?step=2b&sector=0..21 → Passages (Wsoucont2)",
                         "step3": "?step=3&period=0..6 → Pannes",
                         "step4": "?step=4 → Mise à jour nb_visites_an",
-                        "cron": "?mode=cron → Sync rapide"
+                        "step5": "?step=5 → Agrégats KPI (kpi_secteurs, kpi_mois)",
+                        "step6": "?step=6 → Score de risque (score_ml)",
+                        "cron": "?mode=cron → Sync rapide",
+                        "rollups": "?mode=rollups → Recalcul complet des cumuls pannes",
+                        "replay": "&replay=1 → Rejeu depuis le cache SOAP (SOAP_CACHE_DIR)",
+                        "engine": "&engine=async → E/S HTTP sur asyncio, écritures Supabase en vol",
+                        "fanout": "?mode=fanout&steps=2,2b,3&concurrency=8 → Shards en parallèle (auto-invocations)",
+                        "status": "?mode=status&run=ID → Avancement d'un fan-out",
+                        "reconcile": "&reconcile=soft|hard → (steps 2, 3) Suppression des lignes absentes de Progilift",
+                        "profile": "&profile=1 → Rapport cProfile/tracemalloc (en-tête X-Profile-Secret)"
                     },
-                    "full_sync_order": "0 → 1 → 2 (x22) → 2b (x22) → 3 (x7) → 4"
+                    "full_sync_order": "0 → 1 → 2 (x22) → 2b (x22) → 3 (x7) → 4 → 5 → 6"
                 }
+            if SOAP_REPLAY and isinstance(result, dict):
+                result["replay"] = True
         
         except Exception as e:
             result = {
@@ -670,6 +3162,12 @@ class handler(BaseHTTPRequestHandler):
                 "trace": traceback.format_exc()[:500]
             }
         
+        if shard:
+            try:
+                fanout_finish(*shard[:3], result, shard[3])
+            except Exception:
+                pass  # le coordinateur a déjà la réponse; fanout_status signalera le shard perdu
+        
         body = json.dumps(result, ensure_ascii=False).encode('utf-8')
         self.send_response(200)
         self.send_header('Content-Type', 'application/json; charset=utf-8')
@@ -0,0 +1,149 @@
+"""
+Cron horaire complet (api/cron.py) sur les doublures locales
+============================================================
+  python benchmarks/bench_cron.py
+  python benchmarks/bench_cron.py --equipements 50000 --pannes 100000 --window 500 --pgrst-latency 0.005
+
+run_cron_sync() de bout en bout: arrêts et intervalles, pannes de la fenêtre,
+cumuls, KPI, scores. Deux passages: le premier à SCORE_FULL_HOUR rescore toute
+la flotte, le second (régime horaire) seulement les équipements touchés par la
+fenêtre. Le cron tourne dans un
+processus fils (mêmes variables d'environnement que sur Vercel): son pic RSS
+est celui du cron seul, pas celui des doublures. Budget visé: maxDuration
+120 s, 512 Mo (vercel.json).
+
+La durée inclut le temps passé dans la doublure PostgREST (filtrage et tri en
+Python, plus la latence simulée), reporté à part: c'est un majorant.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests import standins  # noqa: E402
+
+core = standins.load_core()
+
+CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+from tests import standins
+cron = standins.load_api('cron')
+started = time.monotonic()
+result = cron.run_cron_sync()
+print(json.dumps({{'elapsed': time.monotonic() - started,
+                  'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'result': result}}, default=str))
+"""
+
+def seed(pgrst, args, now):
+    """Flotte, historique de pannes et dernier cron réussi (fenêtre d'une heure)"""
+    rnd = random.Random(1)
+    first = 1000
+    pgrst.tables['equipements'] = {
+        first + i: dict({'id_wsoucont': first + i, 'secteur': str(rnd.choice([1, 2, 3, 5, 71, 72])),
+                         'pannes_30j': 0, 'pannes_365j': rnd.randint(0, 6), 'derniere_panne': None,
+                         'incidents_personnes_bloquees': rnd.choice([0, 0, 0, 1])},
+                        **{f'datepass{k}': 20240000 + rnd.randint(101, 1228) for k in range(1, 11)},
+                        **{f'dat{k}': 20000000 + rnd.randint(0, 25) * 10000 + rnd.randint(101, 1228) for k in range(1, 16)})
+        for i in range(args.equipements)}
+    pannes = {}
+    for i in range(args.pannes):
+        day = now - timedelta(days=rnd.randint(0, 3 * 365), minutes=rnd.randint(0, 1440))
+        arrivee = day + timedelta(minutes=rnd.randint(10, 180))
+        pannes[100000 + i] = {
+            'id_panne': 100000 + i, 'id_wsoucont': first + rnd.randrange(args.equipements),
+            'date_appel': day.strftime('%Y%m%d'), 'heure_appel': day.strftime('%H%M%S'),
+            'appel_at': core.progilift_timestamp(day.strftime('%Y%m%d'), day.strftime('%H%M%S')),
+            'date_arrivee': arrivee.strftime('%Y%m%d'), 'heure_arrivee': arrivee.strftime('%H%M%S'),
+            'duree': rnd.randint(10, 240), 'personnes_bloquees': rnd.choice(['0', '0', '0', '1'])}
+    pgrst.tables['pannes'] = pannes
+    pgrst.tables['sync_logs'] = {1: {'id': 1, 'status': 'cron', 'sync_date': (now - timedelta(hours=1)).isoformat()}}
+    return first
+
+def soap_payloads(soap, args, first, now):
+    rnd = random.Random(2)
+    arrets = [{'nIDSOUCONT': first + rnd.randrange(args.equipements), 'nClepanne': 900000 + i,
+               'sDateAppel': now.strftime('%Y%m%d'), 'sHeureAppel': '081500', 'sMotifAppel': 'Arrêt',
+               'sDemandeur': 'Gardien'} for i in range(args.arrets)]
+    soap.payloads['get_AppareilsArret'] = standins.soap_response('tabListeArrets', arrets)
+    # Fenêtre d'une heure: pannes appelées aujourd'hui
+    window = standins.wpanne_items(args.window, n_equip=args.equipements, first=100000 + args.pannes)
+    for p in window:
+        p['DATEAPP'] = p['DATEARR'] = p['DATE'] = now.strftime('%Y%m%d')
+    soap.payloads['get_Synchro_Wpanne'] = standins.soap_response('tabListeWpanne', window)
+
+def timed(pgrst):
+    """Temps cumulé passé dans la doublure PostgREST (requêtes du cron, séquentielles)"""
+    spent = [0.0]
+    handle = pgrst._handle
+
+    def wrapper(req, method):
+        started = time.monotonic()
+        try:
+            return handle(req, method)
+        finally:
+            spent[0] += time.monotonic() - started
+    pgrst._handle = wrapper
+    return spent
+
+def run_child(pgrst, soap, spent, full_scores):
+    """Un passage du cron dans un processus fils: (sortie JSON, temps doublure, requêtes PostgREST)"""
+    spent[0] = 0.0
+    pgrst.log.clear()
+    soap.calls.clear()
+    env = dict(os.environ, SUPABASE_URL=pgrst.url, SUPABASE_KEY='bench', PROGILIFT_WS_URL=soap.url,
+               SYNC_SPOOL_DIR=tempfile.mkdtemp(prefix='bench-spool-'),
+               SCORE_FULL_HOUR=str(datetime.now().hour if full_scores else -1))
+    proc = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT)], env=env, cwd=ROOT,
+                          capture_output=True, text=True)
+    if proc.returncode:
+        sys.exit(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), spent[0], list(pgrst.log), len(soap.calls)
+
+def report(title, out, spent, log, soap_calls):
+    stats = out['result'].get('stats', {})
+    print(f"-- {title}")
+    print(f"statut      {out['result'].get('status')}  {'; '.join(stats.get('errors', []))}")
+    print(f"durée       {out['elapsed']:.1f} s (dont doublure PostgREST {spent:.1f} s), budget 120 s")
+    print(f"pic RSS     {out['maxrss_mb']:.0f} Mo, budget 512 Mo")
+    print(f"requêtes    {len(log)} PostgREST ({sum(1 for e in log if e[0] == 'GET')} GET), {soap_calls} SOAP")
+    for key in ('intervals', 'rollups_updated', 'kpi', 'scores'):
+        if key in stats:
+            print(f"{key:<11} {json.dumps(stats[key])}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--equipements', type=int, default=50000, help="flotte (10x la flotte actuelle)")
+    parser.add_argument('--pannes', type=int, default=100000, help="historique de pannes en base")
+    parser.add_argument('--window', type=int, default=500, help="pannes renvoyées par get_Synchro_Wpanne")
+    parser.add_argument('--arrets', type=int, default=200)
+    parser.add_argument('--pgrst-latency', type=float, default=0.005)
+    args = parser.parse_args(argv)
+
+    now = datetime.now()
+    pgrst = standins.Postgrest(latency=args.pgrst_latency)
+    soap = standins.Soap()
+    try:
+        first = seed(pgrst, args, now)
+        soap_payloads(soap, args, first, now)
+        spent = timed(pgrst)
+        print(f"{args.equipements} équipements, {args.pannes} pannes en base, {args.window} dans la fenêtre, "
+              f"{args.arrets} arrêts, PostgREST {args.pgrst_latency * 1000:.0f} ms")
+        report("passage quotidien (toute la flotte)", *run_child(pgrst, soap, spent, True))
+        report("passage horaire (équipements touchés)", *run_child(pgrst, soap, spent, False))
+    finally:
+        soap.stop()
+        pgrst.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Moteur threads vs moteur asyncio sur les doublures locales
+==========================================================
+  python benchmarks/bench_engine.py
+  python benchmarks/bench_engine.py --sectors 6 --items 300 --pgrst-latency 0.015 --soap-delay 0.05
+
+Steps 2 et 2b de la CLI (sync.main) sur --sectors secteurs de --items équipements,
+contre PostgREST (keep-alive, latence par requête) et Progilift SOAP (délai par
+appel) en mémoire. Chaque configuration repart de tables vides.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sync  # noqa: E402  (charge api/sync.py sous progilift_sync)
+from tests import standins  # noqa: E402
+
+CONFIGS = [('threads', 1), ('threads', 4), ('async', 1), ('async', 4)]
+
+def run(engine, concurrency, args, pgrst, soap):
+    pgrst.tables.clear()
+    pgrst.log.clear()
+    soap.calls.clear()
+    standins.configure_core(sync.core, pgrst, soap)
+    started = time.monotonic()
+    with redirect_stdout(io.StringIO()):
+        code = sync.main(['--steps', '2,2b', '--sectors', f"0-{args.sectors - 1}", '--checkpoint', '',
+                          '--engine', engine, '--concurrency', str(concurrency)])
+    elapsed = time.monotonic() - started
+    requests = len(pgrst.requests('POST', 'equipements')) + len(pgrst.requests('PATCH', 'equipements'))
+    return code, elapsed, requests, soap_overlap(soap)
+
+def soap_overlap(soap):
+    """Appels SOAP simultanés au plus (intervalles [début, début + délai])"""
+    starts = sorted(t for t, method, _ in soap.calls if method != 'IdentificationTechnicien')
+    peak = 0
+    for i, t in enumerate(starts):
+        peak = max(peak, sum(1 for u in starts[:i + 1] if u > t - soap.delay))
+    return peak
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sectors', type=int, default=6)
+    parser.add_argument('--items', type=int, default=300, help="équipements par secteur")
+    parser.add_argument('--pgrst-latency', type=float, default=0.015)
+    parser.add_argument('--soap-delay', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    pgrst = standins.Postgrest(latency=args.pgrst_latency)
+    soap = standins.Soap(delay=args.soap_delay)
+    soap.payloads['get_Synchro_Wsoucont'] = standins.soap_response(
+        'tabListeWsoucont', standins.wsoucont_items(args.items))
+    soap.payloads['get_Synchro_Wsoucont2'] = standins.soap_response(
+        'tabListeWsoucont2', standins.wsoucont2_items(args.items))
+    try:
+        # Chaque équipement est écrit deux fois par secteur: step 2 (upsert) puis 2b (passages)
+        rows = args.sectors * args.items * 2
+        print(f"{rows} lignes, PostgREST {args.pgrst_latency * 1000:.0f} ms, SOAP {args.soap_delay * 1000:.0f} ms")
+        print(f"{'engine':<8} {'conc.':>5} {'durée':>8} {'lignes/s':>9} {'requêtes':>9} {'SOAP simult.':>12}")
+        for engine, concurrency in CONFIGS:
+            code, elapsed, requests, overlap = run(engine, concurrency, args, pgrst, soap)
+            status = '' if code == 0 else f"  (code {code})"
+            print(f"{engine:<8} {concurrency:>5} {elapsed:>7.1f}s {rows / elapsed:>9.0f}"
+                  f" {requests:>9} {overlap:>12}{status}")
+    finally:
+        soap.stop()
+        pgrst.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Items SOAP: dict par item vs Item (__slots__, schéma partagé)
+=============================================================
+  python benchmarks/bench_items.py
+  python benchmarks/bench_items.py --items 20000
+
+parse_items() sur des réponses synthétiques Wsoucont, Wsoucont2 et Wpanne
+(tests/standins.py), comparé au parse d'origine qui construisait un dict par
+item. Mémoire mesurée par tracemalloc: pic pendant le parse et mémoire encore
+retenue par la liste d'items (hors corps XML). Le JSON des deux versions doit
+être identique.
+"""
+
+import argparse
+import gc
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests import standins  # noqa: E402
+
+core = standins.load_core()
+
+PAYLOADS = [('Wsoucont', 'tabListeWsoucont', standins.wsoucont_items),
+            ('Wsoucont2', 'tabListeWsoucont2', standins.wsoucont2_items),
+            ('Wpanne', 'tabListeWpanne', standins.wpanne_items)]
+
+def parse_items_dict(xml, tag):
+    """Parse d'origine: un dict par item"""
+    items = []
+    for m in re.finditer(f'<{tag}>(.*?)</{tag}>', xml, re.DOTALL | re.IGNORECASE):
+        item = {}
+        for f in re.finditer(r'<([A-Za-z0-9_]+)>([^<]*)</\1>', m.group(1)):
+            value = f.group(2).strip()
+            item[f.group(1)] = value if value else None
+        if item:
+            items.append(item)
+    return items
+
+def measure(parse, xml, tag):
+    """(items, durée, pic Mo, retenu Mo)"""
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    items = parse(xml, tag)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return items, elapsed, (peak - base) / 2**20, (current - base) / 2**20
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=10000, help="items par réponse")
+    args = parser.parse_args(argv)
+
+    print(f"{args.items} items par réponse, tracemalloc")
+    print(f"{'réponse':<10} {'XML':>7} {'parse':<5} {'durée':>7} {'pic':>9} {'retenu':>9}")
+    for name, tag, make in PAYLOADS:
+        xml = standins.soap_response(tag, make(args.items))
+        results = {}
+        for label, parse in (('dict', parse_items_dict), ('Item', core.parse_items)):
+            items, elapsed, peak, kept = measure(parse, xml, tag)
+            results[label] = json.dumps(items, default=core.json_default)
+            del items
+            print(f"{name:<10} {len(xml) / 2**20:>5.1f}Mo {label:<5} {elapsed:>6.2f}s {peak:>7.1f}Mo {kept:>7.1f}Mo")
+        if results['dict'] != results['Item']:
+            print(f"{name}: JSON différent entre dict et Item")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
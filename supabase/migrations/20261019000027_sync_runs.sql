@@ -0,0 +1,14 @@
+-- Verrou distribué des syncs (api/sync.py, api/cron.py, sync.py) et états partagés
+-- ('progilift', 'progilift-rate', fan-out 'fanout:<run>[:<unité>]').
+-- Une ligne par nom; le verrou est pris par UPDATE conditionnel sur expires_at / owner.
+
+create table if not exists public.sync_runs (
+    name        text primary key,
+    owner       text not null,
+    expires_at  timestamptz not null default 'epoch',
+    progress    jsonb not null default '{}'::jsonb,
+    updated_at  timestamptz not null default now()
+);
+
+-- Accès réservé à la clé service (aucune policy pour anon / authenticated)
+alter table public.sync_runs enable row level security;
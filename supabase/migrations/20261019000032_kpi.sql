@@ -0,0 +1,32 @@
+-- Agrégats KPI écrits par update_kpis (api/sync.py ?step=5, api/cron.py), lus par index.html.
+-- kpi_mois garde sommes et effectifs: le cron ne relit que les mois de sa fenêtre de
+-- pannes et recompose kpi_secteurs comme la somme des mois de chaque secteur.
+
+create table if not exists public.kpi_secteurs (
+    secteur              text primary key,
+    equipements_count    integer not null default 0,
+    arrets_count         integer not null default 0,
+    pannes_count         integer not null default 0,
+    duree_moyenne        numeric,
+    delai_arrivee_moyen  numeric,
+    updated_at           timestamptz not null default now()
+);
+
+create table if not exists public.kpi_mois (
+    secteur              text not null,
+    mois                 text not null,          -- 'AAAA-MM', heure locale Progilift
+    pannes_count         integer not null default 0,
+    duree_moyenne        numeric,
+    delai_arrivee_moyen  numeric,
+    updated_at           timestamptz not null default now(),
+    primary key (secteur, mois)
+);
+
+alter table public.kpi_mois
+    add column if not exists duree_sum    bigint not null default 0,
+    add column if not exists duree_n      integer not null default 0,
+    add column if not exists arrivee_sum  double precision not null default 0,
+    add column if not exists arrivee_n    integer not null default 0;
+
+-- Lignes écrites avant ces colonnes: sommes à zéro jusqu'au prochain ?step=5
+-- (recalcul complet), à lancer une fois après cette migration.
@@ -0,0 +1,28 @@
+-- Une ligne par lot écrit par la sync (flush_sync_events de api/sync.py, api/cron.py):
+-- tables touchées et plages d'ids. index.html s'abonne aux INSERT (Realtime) et
+-- tire un seul delta /api/bootstrap par événement.
+
+create table if not exists public.sync_events (
+    id          bigserial primary key,
+    tables      text[] not null default '{}',
+    ranges      jsonb not null default '{}'::jsonb,   -- table → {min, max, count}
+    source      jsonb,                                -- step / mode de l'invocation
+    created_at  timestamptz not null default now()
+);
+
+create index if not exists sync_events_created_at on public.sync_events (created_at);
+
+-- Écrit par la clé service, lu par les utilisateurs connectés (Realtime applique la policy)
+alter table public.sync_events enable row level security;
+
+drop policy if exists sync_events_read on public.sync_events;
+create policy sync_events_read on public.sync_events
+    for select to authenticated using (true);
+
+do $$
+begin
+    alter publication supabase_realtime add table public.sync_events;
+exception when duplicate_object then
+    null;
+end;
+$$;
@@ -0,0 +1,135 @@
+-- Colonnes typées des dates Progilift, écrites à l'ingestion (progilift_timestamp /
+-- progilift_date de api/sync.py, fuseau PROGILIFT_TZ). Les colonnes texte / entier
+-- d'origine restent: lecteurs existants et rebuild_raw inchangés.
+
+alter table public.pannes
+    add column if not exists appel_at       timestamptz,
+    add column if not exists arrivee_at     timestamptz,
+    add column if not exists depart_at      timestamptz,
+    add column if not exists date_panne_at  timestamptz;   -- pannes écrites par api/cron.py
+
+alter table public.appareils_arret
+    add column if not exists appel_at  timestamptz;
+
+alter table public.equipements
+    add column if not exists modif_at         timestamptz,
+    add column if not exists datepass1_date   date,
+    add column if not exists datepass2_date   date,
+    add column if not exists datepass3_date   date,
+    add column if not exists datepass4_date   date,
+    add column if not exists datepass5_date   date,
+    add column if not exists datepass6_date   date,
+    add column if not exists datepass7_date   date,
+    add column if not exists datepass8_date   date,
+    add column if not exists datepass9_date   date,
+    add column if not exists datepass10_date  date,
+    add column if not exists dat1_date        date,
+    add column if not exists dat2_date        date,
+    add column if not exists dat3_date        date,
+    add column if not exists dat4_date        date,
+    add column if not exists dat5_date        date,
+    add column if not exists dat6_date        date,
+    add column if not exists dat7_date        date,
+    add column if not exists dat8_date        date,
+    add column if not exists dat9_date        date,
+    add column if not exists dat10_date       date,
+    add column if not exists dat11_date       date,
+    add column if not exists dat12_date       date,
+    add column if not exists dat13_date       date,
+    add column if not exists dat14_date       date,
+    add column if not exists dat15_date       date;
+
+-- Fenêtres par date d'appel: KPI du cron (mois touchés), réconciliation des pannes
+create index if not exists pannes_appel_at on public.pannes (appel_at);
+
+-- ------------------------------------------------------------
+-- Rattrapage des lignes écrites avant ces colonnes
+-- ------------------------------------------------------------
+
+-- Même lecture que parse_progilift_datetime: AAAAMMJJ, AAAA-MM-JJ[THH:MM:SS], JJ/MM/AAAA,
+-- AAAAMMJJHHMMSS[mmm]; heure HHMM, HHMMSS[CC], HH:MM[:SS] ou HMM. null si invalide.
+create or replace function public.progilift_ts(d text, h text default null, tz text default 'Europe/Paris')
+returns timestamptz
+language plpgsql immutable as $$
+declare
+    p text[];
+    t text;
+begin
+    d := btrim(coalesce(d, ''));
+    if d = '' then
+        return null;
+    end if;
+    if position('/' in d) > 0 then
+        p := string_to_array(split_part(d, ' ', 1), '/');
+        if array_length(p, 1) <> 3 then
+            return null;
+        end if;
+        d := lpad(p[3], 4, '0') || lpad(p[2], 2, '0') || lpad(p[1], 2, '0');
+    else
+        d := translate(d, '-T: ', '');
+        if length(d) > 8 and h is null then
+            h := substr(d, 9, 6);
+        end if;
+    end if;
+    d := left(d, 8);
+    if d !~ '^\d{8}$' or d = '00000000' then
+        return null;
+    end if;
+    t := btrim(replace(coalesce(h, ''), ':', ''));
+    if length(t) in (3, 5) then
+        t := '0' || t;
+    end if;
+    t := rpad(left(t, 6), 6, '0');
+    if t !~ '^\d{6}$' then
+        t := '000000';
+    end if;
+    return make_timestamp(substr(d, 1, 4)::int, substr(d, 5, 2)::int, substr(d, 7, 2)::int,
+                          substr(t, 1, 2)::int, substr(t, 3, 2)::int, substr(t, 5, 2)::int) at time zone tz;
+exception when others then
+    return null;
+end;
+$$;
+
+update public.pannes
+   set appel_at   = coalesce(appel_at, public.progilift_ts(date_appel, heure_appel)),
+       arrivee_at = coalesce(arrivee_at, public.progilift_ts(date_arrivee, heure_arrivee)),
+       depart_at  = coalesce(depart_at, public.progilift_ts(date_depart, heure_depart))
+ where appel_at is null and date_appel is not null;
+
+update public.pannes
+   set date_panne_at = public.progilift_ts(date_panne)
+ where date_panne_at is null and date_panne is not null;
+
+update public.appareils_arret
+   set appel_at = public.progilift_ts(date_appel, heure_appel)
+ where appel_at is null and date_appel is not null;
+
+-- Dates seules: jour local Progilift
+update public.equipements
+   set modif_at        = coalesce(modif_at, public.progilift_ts(date_heure_modif)),
+       datepass1_date  = coalesce(datepass1_date,  (public.progilift_ts(datepass1::text)  at time zone 'Europe/Paris')::date),
+       datepass2_date  = coalesce(datepass2_date,  (public.progilift_ts(datepass2::text)  at time zone 'Europe/Paris')::date),
+       datepass3_date  = coalesce(datepass3_date,  (public.progilift_ts(datepass3::text)  at time zone 'Europe/Paris')::date),
+       datepass4_date  = coalesce(datepass4_date,  (public.progilift_ts(datepass4::text)  at time zone 'Europe/Paris')::date),
+       datepass5_date  = coalesce(datepass5_date,  (public.progilift_ts(datepass5::text)  at time zone 'Europe/Paris')::date),
+       datepass6_date  = coalesce(datepass6_date,  (public.progilift_ts(datepass6::text)  at time zone 'Europe/Paris')::date),
+       datepass7_date  = coalesce(datepass7_date,  (public.progilift_ts(datepass7::text)  at time zone 'Europe/Paris')::date),
+       datepass8_date  = coalesce(datepass8_date,  (public.progilift_ts(datepass8::text)  at time zone 'Europe/Paris')::date),
+       datepass9_date  = coalesce(datepass9_date,  (public.progilift_ts(datepass9::text)  at time zone 'Europe/Paris')::date),
+       datepass10_date = coalesce(datepass10_date, (public.progilift_ts(datepass10::text) at time zone 'Europe/Paris')::date),
+       dat1_date       = coalesce(dat1_date,       (public.progilift_ts(dat1::text)       at time zone 'Europe/Paris')::date),
+       dat2_date       = coalesce(dat2_date,       (public.progilift_ts(dat2::text)       at time zone 'Europe/Paris')::date),
+       dat3_date       = coalesce(dat3_date,       (public.progilift_ts(dat3::text)       at time zone 'Europe/Paris')::date),
+       dat4_date       = coalesce(dat4_date,       (public.progilift_ts(dat4::text)       at time zone 'Europe/Paris')::date),
+       dat5_date       = coalesce(dat5_date,       (public.progilift_ts(dat5::text)       at time zone 'Europe/Paris')::date),
+       dat6_date       = coalesce(dat6_date,       (public.progilift_ts(dat6::text)       at time zone 'Europe/Paris')::date),
+       dat7_date       = coalesce(dat7_date,       (public.progilift_ts(dat7::text)       at time zone 'Europe/Paris')::date),
+       dat8_date       = coalesce(dat8_date,       (public.progilift_ts(dat8::text)       at time zone 'Europe/Paris')::date),
+       dat9_date       = coalesce(dat9_date,       (public.progilift_ts(dat9::text)       at time zone 'Europe/Paris')::date),
+       dat10_date      = coalesce(dat10_date,      (public.progilift_ts(dat10::text)      at time zone 'Europe/Paris')::date),
+       dat11_date      = coalesce(dat11_date,      (public.progilift_ts(dat11::text)      at time zone 'Europe/Paris')::date),
+       dat12_date      = coalesce(dat12_date,      (public.progilift_ts(dat12::text)      at time zone 'Europe/Paris')::date),
+       dat13_date      = coalesce(dat13_date,      (public.progilift_ts(dat13::text)      at time zone 'Europe/Paris')::date),
+       dat14_date      = coalesce(dat14_date,      (public.progilift_ts(dat14::text)      at time zone 'Europe/Paris')::date),
+       dat15_date      = coalesce(dat15_date,      (public.progilift_ts(dat15::text)      at time zone 'Europe/Paris')::date)
+ where modif_at is null;
@@ -0,0 +1,17 @@
+-- Compteurs d'une invocation de la sync (flush_sync_metrics de api/sync.py, sync.py):
+-- items SOAP, lignes lues / écrites, octets, reprises, histogrammes de latence.
+-- Agrégés par /api/metrics (api/metrics.py), qui relit par id croissant et ne
+-- remonte pas au-delà de METRICS_LOOKBACK_DAYS (created_at).
+
+create table if not exists public.sync_metrics (
+    id          bigserial primary key,
+    step        text,
+    status      text,
+    metrics     jsonb not null default '{}'::jsonb,
+    created_at  timestamptz not null default now()
+);
+
+create index if not exists sync_metrics_created_at on public.sync_metrics (created_at);
+
+-- Accès réservé à la clé service (aucune policy pour anon / authenticated)
+alter table public.sync_metrics enable row level security;
@@ -0,0 +1,13 @@
+-- Suppressions douces de la réconciliation (reconcile de api/sync.py, &reconcile=soft /
+-- sync.py --reconcile soft): deleted_at posé sur les lignes absentes de Progilift,
+-- retiré si elles reviennent. Bootstrap, export, recherche, KPI, cumuls et scores
+-- ne lisent que deleted_at is null; le delta /api/bootstrap liste les clés supprimées.
+
+alter table public.equipements
+    add column if not exists deleted_at  timestamptz;
+
+alter table public.pannes
+    add column if not exists deleted_at  timestamptz;
+
+-- Fenêtre de réconciliation des pannes: or=(appel_at.gte.X,date_panne_at.gte.X)
+create index if not exists pannes_date_panne_at on public.pannes (date_panne_at);
@@ -0,0 +1,36 @@
+-- Historique des arrêts (update_arret_intervals, api/sync.py step 1 et api/cron.py).
+-- Un intervalle par arrêt d'un appareil: ouvert (ended_at null) tant qu'il figure dans
+-- get_AppareilsArret, rouvert s'il revient pour la même panne.
+
+create table if not exists public.arret_intervals (
+    id           bigserial primary key,
+    id_wsoucont  bigint not null,
+    id_panne     bigint,
+    motif        text,
+    started_at   timestamptz not null,
+    ended_at     timestamptz,
+    updated_at   timestamptz not null default now()
+);
+
+-- Disponibilité sur une période: chevauchement de [started_at, coalesce(ended_at, now())]
+create index if not exists arret_intervals_wsoucont_started
+    on public.arret_intervals (id_wsoucont, started_at);
+
+-- Seuls les intervalles ouverts sont relus à chaque run
+create index if not exists arret_intervals_open
+    on public.arret_intervals (id_wsoucont) where ended_at is null;
+
+-- Dernier intervalle fermé par appareil (réouverture): une ligne par id_wsoucont,
+-- servie par l'index ci-dessous quelle que soit la longueur de l'historique
+create index if not exists arret_intervals_last_closed
+    on public.arret_intervals (id_wsoucont, ended_at desc) where ended_at is not null;
+
+create or replace view public.arret_intervals_last as
+    select distinct on (id_wsoucont) id, id_wsoucont, id_panne, ended_at
+      from public.arret_intervals
+     where ended_at is not null
+     order by id_wsoucont, ended_at desc;
+
+-- Écrit et lu par la clé service seulement (aucune policy pour anon / authenticated)
+alter table public.arret_intervals enable row level security;
+alter view public.arret_intervals_last set (security_invoker = true);
@@ -0,0 +1,397 @@
+"""
+Doublures locales pour les tests: PostgREST en mémoire, Progilift SOAP, réponses synthétiques
+===========================================================================================
+Aucune dépendance hors stdlib. Les serveurs écoutent sur 127.0.0.1 (port libre)
+et s'arrêtent avec stop(); les modules api/*.py sont chargés comme le fait sync.py.
+"""
+
+import base64
+import fnmatch
+import importlib.util
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_api(name, module_name=None):
+    """Charge api/<name>.py (api/ n'est pas un package), enregistré dans sys.modules"""
+    module_name = module_name or f"progilift_{name.replace('/', '_')}"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, 'api', f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def load_core():
+    """api/sync.py sous le nom utilisé par la CLI et par api/cron.py"""
+    return load_api('sync', 'progilift_sync')
+
+def configure_core(core, pgrst, soap=None, spool_dir=None):
+    """Branche api/sync.py sur les doublures, état de l'invocation remis à zéro"""
+    core.SUPABASE_URL = pgrst.url
+    core.SUPABASE_KEY = 'test'
+    if soap is not None:
+        core.WS_URL = soap.url
+    core.SPOOL_DIR = spool_dir or os.path.join(pgrst.spool_root, 'spool')
+    core.PROGILIFT_BUCKET = core.TokenBucket(1000, 1000)
+    core.PROGILIFT_HEALTH.update(latency={}, failures=0, open_until=0, trial_until=0)
+    core.health_new_clear()
+    core.FANOUT_SHARD = False
+    core.SYNC_BATCH.clear()
+    core.METRICS.clear()
+    core.DRY_RUN = False
+    core.SOAP_REPLAY = False
+
+def user_jwt(role='authenticated', sub='u1'):
+    """JWT au format Supabase (signature factice: la doublure PostgREST ne la vérifie pas)"""
+    part = lambda d: base64.urlsafe_b64encode(json.dumps(d).encode()).decode().rstrip('=')
+    return f"{part({'alg': 'HS256'})}.{part({'role': role, 'sub': sub})}.c2lnbmF0dXJl"
+
+def configure_auth(pgrst):
+    """api/bootstrap.py (check_user, partagé par export et recherche) sur la doublure PostgREST"""
+    auth = load_api('bootstrap')
+    auth.SUPABASE_URL = pgrst.url
+    auth.SUPABASE_KEY = 'server'
+    return auth
+
+class Server:
+    """ThreadingHTTPServer dans un thread: url, stop()"""
+
+    def __init__(self, handler_class):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join(5)
+
+# ============================================================
+# POSTGREST
+# ============================================================
+
+PKEYS = {'sync_runs': 'name', 'equipements': 'id_wsoucont', 'pannes': 'id_panne', 'type_planning': 'code',
+         'kpi_secteurs': 'secteur', 'kpi_mois': ('secteur', 'mois')}
+
+def _last_closed_intervals(tables):
+    """Vue arret_intervals_last: dernier intervalle fermé de chaque appareil"""
+    last = {}
+    for r in tables.get('arret_intervals', {}).values():
+        prev = last.get(r.get('id_wsoucont'))
+        if r.get('ended_at') is not None and (prev is None or r['ended_at'] > prev['ended_at']):
+            last[r.get('id_wsoucont')] = r
+    return {r['id']: r for r in last.values()}
+
+# Vues en lecture seule, calculées à chaque GET depuis les tables
+VIEWS = {'arret_intervals_last': _last_closed_intervals}
+
+def _key_of(row, key):
+    """Valeur de clé primaire d'une ligne (tuple pour une clé composite)"""
+    return tuple(row.get(k) for k in key) if isinstance(key, tuple) else row.get(key)
+
+def _compare(op, value, arg):
+    if op == 'is':
+        return {'null': value is None, 'true': value is True, 'false': value is False}.get(arg, False)
+    if value is None:
+        return False
+    if isinstance(value, bool):
+        arg = arg == 'true'
+    elif isinstance(value, (int, float)):
+        try:
+            arg = type(value)(arg)
+        except ValueError:
+            return False
+    else:
+        value, arg = str(value), str(arg)
+    return {'eq': value == arg, 'neq': value != arg, 'lt': value < arg, 'lte': value <= arg,
+            'gt': value > arg, 'gte': value >= arg}.get(op, False)
+
+def _split_args(text):
+    """'a.eq.1,and(b.is.null,c.gt.2)' → ['a.eq.1', 'and(b.is.null,c.gt.2)']"""
+    parts, depth, cur = [], 0, ''
+    for ch in text:
+        if ch == ',' and depth == 0:
+            parts.append(cur)
+            cur = ''
+            continue
+        depth += (ch == '(') - (ch == ')')
+        cur += ch
+    if cur:
+        parts.append(cur)
+    return parts
+
+def _condition(col, expr):
+    """Prédicat d'un filtre PostgREST col=op.valeur (not., in, like, is, or/and imbriqués)"""
+    if col in ('or', 'and'):
+        subs = [_nested(p) for p in _split_args(expr[1:-1])]
+        return (lambda r: any(s(r) for s in subs)) if col == 'or' else (lambda r: all(s(r) for s in subs))
+    negate = expr.startswith('not.')
+    if negate:
+        expr = expr[4:]
+    op, _, arg = expr.partition('.')
+    if op == 'in':
+        values = [v.strip('"') for v in _split_args(arg[1:-1])]
+        test = lambda r: r.get(col) is not None and str(r.get(col)) in values
+    elif op in ('like', 'ilike'):
+        pattern = arg.replace('%', '*')
+        test = lambda r: r.get(col) is not None and fnmatch.fnmatchcase(
+            str(r.get(col)).lower() if op == 'ilike' else str(r.get(col)), pattern.lower() if op == 'ilike' else pattern)
+    else:
+        test = lambda r: _compare(op, r.get(col), arg)
+    return (lambda r: not test(r)) if negate else test
+
+def _nested(part):
+    """Élément d'un or=(...): col.op.valeur ou and(...) / or(...)"""
+    m = re.match(r'^(and|or)(\(.*\))$', part)
+    if m:
+        return _condition(m.group(1), m.group(2))
+    col, _, expr = part.partition('.')
+    return _condition(col, expr)
+
+def _by_key(store, key, query):
+    """Lignes candidates: accès direct si la requête filtre la clé primaire par eq / in, sinon toutes"""
+    for col, expr in query:
+        if col != key:
+            continue
+        if expr.startswith('in.('):
+            values = [v.strip('"') for v in _split_args(expr[4:-1])]
+        elif expr.startswith('eq.'):
+            values = [expr[3:]]
+        else:
+            continue
+        rows = []
+        for v in values:
+            for candidate in (v, int(v) if v.lstrip('-').isdigit() else None):
+                if candidate in store:
+                    rows.append(store[candidate])
+                    break
+        return rows
+    return list(store.values())
+
+class Postgrest:
+    """PostgREST en mémoire: tables {nom: {clé: ligne}}, journal des requêtes, pannes injectables
+
+    fail: [(méthode, table, status)] consommés dans l'ordre par les requêtes qui correspondent.
+    known: si renseigné, les autres tables répondent 404 (table absente du schéma).
+    rejected: jetons Bearer refusés (401, JWT invalide ou expiré); bearers: (table, jeton) par requête.
+    """
+
+    def __init__(self, known=None, latency=0.0):
+        self.tables = {}
+        self.log = []
+        self.bearers = []
+        self.rejected = set()
+        self.fail = []
+        self.known = known
+        self.latency = latency
+        self.lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                standin._handle(self, 'GET')
+
+            def do_POST(self):
+                standin._handle(self, 'POST')
+
+            def do_PATCH(self):
+                standin._handle(self, 'PATCH')
+
+            def do_DELETE(self):
+                standin._handle(self, 'DELETE')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = Server(Handler)
+        self.url = self.server.url
+        self.spool_root = tempfile.mkdtemp(prefix='pgrst-')
+
+    def stop(self):
+        self.server.stop()
+
+    def rows(self, table):
+        return list(self.tables.get(table, {}).values())
+
+    def requests(self, method=None, table=None):
+        return [e for e in self.log if (method is None or e[0] == method) and (table is None or e[1] == table)]
+
+    def _send(self, req, status, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        req.send_response(status)
+        req.send_header('Content-Type', 'application/json')
+        req.send_header('Content-Length', str(len(body)))
+        req.end_headers()
+        req.wfile.write(body)
+
+    def _handle(self, req, method):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(req.path)
+        table = url.path.rsplit('/', 1)[-1]
+        query = parse_qsl(url.query, keep_blank_values=True)
+        length = int(req.headers.get('Content-Length') or 0)
+        data = json.loads(req.rfile.read(length)) if length else None
+        prefer = req.headers.get('Prefer', '')
+        self.log.append((method, table, url.query, data))
+        bearer = (req.headers.get('Authorization') or '').removeprefix('Bearer ')
+        self.bearers.append((table, bearer))
+        if bearer in self.rejected:
+            return self._send(req, 401, {'code': 'PGRST301', 'message': 'JWT expired'})
+        with self.lock:
+            for i, (m, t, status) in enumerate(self.fail):
+                if m in (method, '*') and t in (table, '*'):
+                    del self.fail[i]
+                    return self._send(req, status, {'message': 'injected failure'})
+        if self.known is not None and table not in self.known:
+            return self._send(req, 404, {'code': 'PGRST205', 'message': f"Could not find the table 'public.{table}'"})
+        params = dict(query)
+        filters = [_condition(k, v) for k, v in query
+                   if k not in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns')]
+        with self.lock:
+            store = VIEWS[table](self.tables) if table in VIEWS else self.tables.setdefault(table, {})
+            matching = [r for r in _by_key(store, PKEYS.get(table, 'id'), query) if all(f(r) for f in filters)]
+            if method == 'GET':
+                for part in reversed(params.get('order', '').split(',')):
+                    if part:
+                        col, *mods = part.split('.')
+                        present = [r for r in matching if r.get(col) is not None]
+                        missing = [r for r in matching if r.get(col) is None]
+                        present.sort(key=lambda r: r[col], reverse='desc' in mods)
+                        matching = present + missing
+                matching = matching[int(params.get('offset', 0)):]
+                if 'limit' in params:
+                    matching = matching[:int(params['limit'])]
+                select = params.get('select', '*')
+                if select != '*':
+                    cols = select.split(',')
+                    matching = [{c: r.get(c) for c in cols} for r in matching]
+                return self._send(req, 200, [dict(r) for r in matching])
+            if method == 'PATCH':
+                for r in matching:
+                    r.update(data)
+                out = [dict(r) for r in matching]
+                return self._send(req, 200, out) if 'return=representation' in prefer else self._send(req, 204)
+            if method == 'DELETE':
+                key = PKEYS.get(table, 'id')
+                for r in matching:
+                    store.pop(_key_of(r, key), None)
+                return self._send(req, 204)
+            key = params.get('on_conflict') or PKEYS.get(table, 'id')
+            if isinstance(key, str) and ',' in key:
+                key = tuple(key.split(','))
+            out = []
+            for row in data if isinstance(data, list) else [data]:
+                value = _key_of(row, key)
+                if value is None:
+                    value = len(store) + 1
+                    while value in store:
+                        value += 1
+                    row = dict(row, **{key: value})
+                if value in store:
+                    if 'ignore-duplicates' in prefer:
+                        continue
+                    if 'merge-duplicates' not in prefer:
+                        return self._send(req, 409, {'code': '23505', 'message': 'duplicate key'})
+                    store[value].update(row)
+                else:
+                    store[value] = dict(row)
+                out.append(dict(store[value]))
+        return self._send(req, 201, out) if 'return=representation' in prefer else self._send(req, 201)
+
+# ============================================================
+# PROGILIFT SOAP
+# ============================================================
+
+class Soap:
+    """Progilift SOAP: payloads {méthode: xml}, délai, échecs (status) injectables, journal des appels"""
+
+    def __init__(self, delay=0.0):
+        self.payloads = {}
+        self.calls = []
+        self.delay = delay
+        self.fail = []
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+                method = self.headers.get('SOAPAction', '').strip('"').rsplit('/', 1)[-1]
+                standin.calls.append((time.monotonic(), method, body))
+                time.sleep(standin.delay)
+                status = standin.fail.pop(0) if standin.fail else 200
+                if method == 'IdentificationTechnicien':
+                    text = '<soap:Envelope><ws:WSID>ABCDEF</ws:WSID></soap:Envelope>'
+                else:
+                    text = standin.payloads.get(method, soap_response('x', []))
+                payload = text.encode('utf-8') if status == 200 else b'<soap:Fault/>'
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = Server(Handler)
+        self.url = f"{self.server.url}/ws"
+
+    def stop(self):
+        self.server.stop()
+
+def soap_response(tag, items):
+    """Enveloppe SOAP contenant un <tag> par item (dict)"""
+    parts = ['<?xml version="1.0" encoding="UTF-8"?><soap:Envelope><soap:Body><ws:resp>']
+    for item in items:
+        parts.append(f'<{tag}>' + ''.join(f'<{k}>{v}</{k}>' for k, v in item.items()) + f'</{tag}>')
+    parts.append('</ws:resp></soap:Body></soap:Envelope>')
+    return ''.join(parts)
+
+def wsoucont_items(n, seed=1, first=1000):
+    rnd = random.Random(seed)
+    items = []
+    for i in range(n):
+        item = {'IDWSOUCONT': first + i, 'IDWCONTRAT': 50 + i % 7, 'SECTEUR': rnd.choice([1, 2, 3, 71]),
+                'ASCENSEUR': f'ASC{i:05d}', 'INDICE': 0, 'DES2': f'{i} rue des Fleurs',
+                'DES3': f'{63000 + i % 100} CLERMONT-FERRAND', 'GENRE': 1, 'TYPE': 'ELEC',
+                'TYPEPLANNING': rnd.choice(['M12', 'M6', 'M4']), 'DATE_HEURE_MODIF': '20240512143005123'}
+        item.update({f'DIV{k}': f'div{k}-{i % 13}' for k in range(1, 16)})
+        items.append(item)
+    return items
+
+def wsoucont2_items(n, seed=1, first=1000):
+    rnd = random.Random(seed)
+    items = []
+    for i in range(n):
+        item = {'IDWSOUCONT': first + i}
+        item.update({f'DATEPASS{k}': 20240000 + rnd.randint(101, 1228) for k in range(1, 11)})
+        item.update({f'DAT{k}': 20200000 + rnd.randint(101, 1228) for k in range(1, 16)})
+        items.append(item)
+    return items
+
+def wpanne_items(n, n_equip=100, seed=1, first=500000, years=(2024, 2025, 2026)):
+    rnd = random.Random(seed)
+    items = []
+    for i in range(n):
+        y, m, d, h = rnd.choice(years), rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 21)
+        items.append({'IDWPANNE': first + i, 'P0CLEUNIK': first + i, 'IDWSOUCONT': 1000 + rnd.randrange(n_equip),
+                      'ASCENSEUR': f'ASC{i % n_equip:05d}', 'DATEAPP': f'{y}{m:02d}{d:02d}', 'HEUREAPP': f'{h:02d}1500',
+                      'DATEARR': f'{y}{m:02d}{d:02d}', 'HEUREARR': f'{h + 1:02d}0500', 'MOTIF': 'Appareil bloqué',
+                      'DUREE': rnd.randint(10, 240), 'PERSBLOQ': rnd.choice([0, 0, 0, 1]),
+                      'DATE': f'{y}{m:02d}{d:02d}', 'PANNES': 'Panne porte'})
+    return items
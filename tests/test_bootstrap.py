@@ -0,0 +1,98 @@
+"""/api/bootstrap: JWT obligatoire, tables personnelles sous le JWT, réponse en flux, deltas"""
+
+import gzip
+import http.client
+import json
+import unittest
+from urllib.parse import urlsplit
+
+from tests import standins
+
+bootstrap = standins.load_api('bootstrap')
+
+USER = standins.user_jwt()
+
+class BootstrapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        self.api = standins.Server(bootstrap.handler)
+        standins.configure_auth(self.pgrst)
+        bootstrap.NO_UPDATED_AT.clear()
+        self.page_size = bootstrap.PAGE_SIZE
+        bootstrap.PAGE_SIZE = 7
+        self.pgrst.tables['users'] = {'u1': {'id': 'u1', 'first_name': 'Ana', 'email': 'ana@example.fr', 'role': 'admin'}}
+        self.pgrst.tables['equipements'] = {
+            i: {'id_wsoucont': i, 'nom': f'E{50 - i:02d}', 'secteur': '1', 'updated_at': f'2026-10-01T00:00:{i:02d}+00:00'}
+            for i in range(1, 41)}
+        self.pgrst.tables['categories'] = {1: {'id': 1, 'name': 'Portes'}}
+
+    def tearDown(self):
+        bootstrap.PAGE_SIZE = self.page_size
+        self.api.stop()
+        self.pgrst.stop()
+
+    def get(self, query='', token=USER, gzipped=False):
+        parts = urlsplit(self.api.url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        if gzipped:
+            headers['Accept-Encoding'] = 'gzip'
+        conn.request('GET', f"/api/bootstrap{query}", headers=headers)
+        resp = conn.getresponse()
+        try:
+            body = resp.read()
+            if resp.getheader('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            return resp.status, resp.getheader('Transfer-Encoding'), json.loads(body)
+        finally:
+            conn.close()
+
+    def test_user_token_required(self):
+        for token in (None, standins.user_jwt('anon'), 'not-a-jwt'):
+            self.assertEqual(self.get(token=token)[0], 401)
+        self.pgrst.rejected.add(USER)
+        self.assertEqual(self.get()[0], 401)
+
+    def test_user_tables_read_with_user_token(self):
+        status, encoding, result = self.get('?tables=users,equipements', gzipped=True)
+        self.assertEqual((status, encoding), (200, 'chunked'))
+        users = result['tables']['users']['rows']
+        self.assertEqual(([u['id'] for u in users], 'email' in users[0]), (['u1'], False))
+        self.assertEqual({b for t, b in self.pgrst.bearers if t == 'users'}, {USER})
+        self.assertEqual({b for t, b in self.pgrst.bearers if t == 'equipements'}, {'server'})
+
+    def test_streamed_rows_and_order(self):
+        status, _, result = self.get('?tables=equipements')
+        table = result['tables']['equipements']
+        self.assertEqual((table['count'], table['order'], table['mode']), (40, 'nom', 'full'))
+        # Lignes dans l'ordre de la clé, le tri du dashboard est appliqué par le client
+        self.assertEqual([r['id_wsoucont'] for r in table['rows']], list(range(1, 41)))
+        # Plus grand updated_at lu moins la marge de recouvrement
+        self.assertEqual(result['since'], '2026-09-30T23:50:40+00:00')
+
+    def test_table_without_updated_at_is_skipped_in_deltas(self):
+        self.pgrst.fail += [('GET', 'categories', 400), ('GET', 'categories', 400)]
+        _, _, result = self.get('?tables=categories&since=2026-10-01T00:00:00Z')
+        self.assertEqual((result['tables']['categories']['mode'], result['tables']['categories']['rows']), ('skipped', []))
+        before = len(self.pgrst.requests('GET', 'categories'))
+        self.get('?tables=categories&since=2026-10-01T00:00:00Z')
+        self.assertEqual(len(self.pgrst.requests('GET', 'categories')), before)
+        _, _, full = self.get('?tables=categories')
+        self.assertEqual(full['tables']['categories']['rows'], [{'id': 1, 'name': 'Portes'}])
+
+    def test_late_commit_is_served_by_next_delta(self):
+        _, _, first = self.get('?tables=equipements')
+        # Estampillée avant le dernier updated_at lu, validée après la lecture
+        self.pgrst.tables['equipements'][41] = {'id_wsoucont': 41, 'nom': 'E09', 'secteur': '1',
+                                                'updated_at': '2026-10-01T00:00:30+00:00'}
+        _, _, delta = self.get(f"?tables=equipements&since={first['since'].replace('+', '%2B')}")
+        self.assertIn(41, [r['id_wsoucont'] for r in delta['tables']['equipements']['rows']])
+        # La marge ne fait jamais reculer le curseur
+        self.assertEqual(delta['since'], first['since'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.get('?since=2026-13-45T00:00:00Z')[0], 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Fenêtre des pannes du cron (get_pannes_since): dernier cron réussi moins la marge, 30 jours à défaut"""
+
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from tests import standins
+
+cron = standins.load_api('cron')
+core = cron.core
+
+FMT = "%Y-%m-%dT%H:%M:%S"
+
+class PannesSinceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        self.now = datetime(2026, 10, 19, 14, 30, 0)
+        self.fallback = ((self.now - timedelta(days=cron.CRON_FALLBACK_DAYS)).strftime("%Y-%m-%dT00:00:00"), "fallback")
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def logs(self, *rows):
+        self.pgrst.tables['sync_logs'] = {i: dict(row, id=i) for i, row in enumerate(rows, 1)}
+
+    def test_last_cron_minus_overlap(self):
+        last = self.now - timedelta(hours=2)
+        self.logs({'status': 'cron', 'sync_date': last.isoformat()},
+                  {'status': 'cron', 'sync_date': (last - timedelta(hours=1)).isoformat()},
+                  # Crons partiels et syncs complètes ne déplacent pas la fenêtre
+                  {'status': 'cron_partial', 'sync_date': (self.now - timedelta(minutes=5)).isoformat()},
+                  {'status': 'success', 'sync_date': (self.now - timedelta(minutes=1)).isoformat()})
+        since = last - timedelta(minutes=cron.CRON_OVERLAP_MINUTES)
+        self.assertEqual(cron.get_pannes_since(self.now), (since.strftime(FMT), "last_sync"))
+
+    def test_timezone_aware_sync_date(self):
+        last = self.now - timedelta(minutes=50)
+        stamp = last.astimezone().astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+        self.logs({'status': 'cron', 'sync_date': stamp})
+        since = last - timedelta(minutes=cron.CRON_OVERLAP_MINUTES)
+        self.assertEqual(cron.get_pannes_since(self.now), (since.strftime(FMT), "last_sync"))
+
+    def test_no_cron_yet(self):
+        self.logs({'status': 'cron_partial', 'sync_date': (self.now - timedelta(hours=1)).isoformat()})
+        self.assertEqual(cron.get_pannes_since(self.now), self.fallback)
+        self.pgrst.tables.pop('sync_logs')
+        self.assertEqual(cron.get_pannes_since(self.now), self.fallback)
+
+    def test_last_cron_older_than_fallback(self):
+        self.logs({'status': 'cron', 'sync_date': (self.now - timedelta(days=31)).isoformat()})
+        self.assertEqual(cron.get_pannes_since(self.now), self.fallback)
+
+    def test_future_timestamp(self):
+        self.logs({'status': 'cron', 'sync_date': (self.now + timedelta(hours=3)).isoformat()})
+        self.assertEqual(cron.get_pannes_since(self.now), self.fallback)
+
+    def test_missing_or_invalid_timestamp(self):
+        for value in (None, '', 'pas une date'):
+            self.logs({'status': 'cron', 'sync_date': value})
+            self.assertEqual(cron.get_pannes_since(self.now), self.fallback, value)
+
+    def test_sync_logs_unreadable(self):
+        self.logs({'status': 'cron', 'sync_date': (self.now - timedelta(hours=1)).isoformat()})
+        self.pgrst.fail.append(('GET', 'sync_logs', 503))
+        self.assertEqual(cron.get_pannes_since(self.now), self.fallback)
+
+if __name__ == '__main__':
+    unittest.main()
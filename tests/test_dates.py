@@ -0,0 +1,91 @@
+"""Dates Progilift: formats d'heure, saisies ISO et JJ/MM/AAAA, horodatage dans le fuseau Progilift (DST)"""
+
+import unittest
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from tests import standins
+
+core = standins.load_core()
+
+def clear_caches():
+    for f in (core.parse_progilift_datetime, core.progilift_timestamp, core.progilift_date):
+        f.cache_clear()
+
+class ParseDatetimeTest(unittest.TestCase):
+
+    def parse(self, date, heure=None):
+        return core.parse_progilift_datetime(date, heure)
+
+    def test_hour_formats(self):
+        expected = datetime(2026, 3, 5, 8, 15)
+        for heure in ('0815', '081500', '08150042', '08:15', '08:15:00', '815'):
+            self.assertEqual(self.parse('20260305', heure), expected, heure)
+        self.assertEqual(self.parse('20260305', '81530'), datetime(2026, 3, 5, 8, 15, 30))
+        self.assertEqual(self.parse('20260305', '143005'), datetime(2026, 3, 5, 14, 30, 5))
+
+    def test_date_only_and_invalid_hour(self):
+        self.assertEqual(self.parse('20260305'), datetime(2026, 3, 5))
+        self.assertEqual(self.parse(20260305), datetime(2026, 3, 5))
+        self.assertEqual(self.parse('20260305', 'midi'), datetime(2026, 3, 5))
+        self.assertIsNone(self.parse('20260305', '2575'))
+
+    def test_iso_input(self):
+        self.assertEqual(self.parse('2026-03-05'), datetime(2026, 3, 5))
+        self.assertEqual(self.parse('2026-03-05T08:15:30'), datetime(2026, 3, 5, 8, 15, 30))
+        self.assertEqual(self.parse('2026-03-05 08:15'), datetime(2026, 3, 5, 8, 15))
+        # DATE_HEURE_MODIF: AAAAMMJJHHMMSSmmm
+        self.assertEqual(self.parse('20260305081530123'), datetime(2026, 3, 5, 8, 15, 30))
+        # Une heure explicite l'emporte sur celle de la date
+        self.assertEqual(self.parse('2026-03-05T08:15:30', '0930'), datetime(2026, 3, 5, 9, 30))
+
+    def test_french_input(self):
+        self.assertEqual(self.parse('05/03/2026'), datetime(2026, 3, 5))
+        self.assertEqual(self.parse('5/3/2026'), datetime(2026, 3, 5))
+        self.assertEqual(self.parse('05/03/2026 08:15'), datetime(2026, 3, 5, 8, 15))
+        self.assertEqual(self.parse('05/03/2026 08:15:30'), datetime(2026, 3, 5, 8, 15, 30))
+        self.assertEqual(self.parse('05/03/2026 08:15', '1000'), datetime(2026, 3, 5, 10, 0))
+
+    def test_invalid_dates(self):
+        for date in (None, '', '00000000', '20261332', '2026', '05/03', 'abcdefgh'):
+            self.assertIsNone(self.parse(date), date)
+
+class TimestampTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tz = core.progilift_tz
+        core.progilift_tz = ZoneInfo('Europe/Paris')
+        clear_caches()
+
+    def tearDown(self):
+        core.progilift_tz = self.tz
+        clear_caches()
+
+    def test_offsets(self):
+        self.assertEqual(core.progilift_timestamp('20260115', '0815'), '2026-01-15T08:15:00+01:00')
+        self.assertEqual(core.progilift_timestamp('20260715', '0815'), '2026-07-15T08:15:00+02:00')
+        self.assertEqual(core.progilift_timestamp('15/07/2026 08:15'), '2026-07-15T08:15:00+02:00')
+        self.assertIsNone(core.progilift_timestamp('', '0815'))
+
+    def test_dst_fall_back(self):
+        # 25/10/2026: 02:00-03:00 existe deux fois, la première occurrence (heure d'été) est retenue
+        self.assertEqual(core.progilift_timestamp('20261025', '0130'), '2026-10-25T01:30:00+02:00')
+        self.assertEqual(core.progilift_timestamp('20261025', '0230'), '2026-10-25T02:30:00+02:00')
+        self.assertEqual(core.progilift_timestamp('20261025', '0330'), '2026-10-25T03:30:00+01:00')
+
+    def test_dst_spring_forward(self):
+        # 29/03/2026: 02:30 n'existe pas, horodatée avec le décalage d'avant le changement
+        self.assertEqual(core.progilift_timestamp('20260329', '0230'), '2026-03-29T02:30:00+01:00')
+
+    def test_without_timezone(self):
+        core.progilift_tz = None
+        clear_caches()
+        self.assertEqual(core.progilift_timestamp('20260115', '0815'), '2026-01-15T08:15:00')
+
+    def test_progilift_date(self):
+        self.assertEqual(core.progilift_date('20260305'), '2026-03-05')
+        self.assertEqual(core.progilift_date('05/03/2026 08:15'), '2026-03-05')
+        self.assertIsNone(core.progilift_date('0'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Moteurs threads / asyncio: écritures en échec → partial et non reprises, verrou perdu, appels SOAP simultanés (CLI contre les doublures)"""
+
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+
+import sync
+from tests import standins
+
+core = standins.load_core()
+
+class EngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        self.soap = standins.Soap(delay=0.05)
+        self.soap.payloads['get_Synchro_Wsoucont'] = standins.soap_response(
+            'tabListeWsoucont', standins.wsoucont_items(20))
+        standins.configure_core(core, self.pgrst, self.soap)
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        self.lease_ttl = core.LEASE_TTL
+        self.batches = core.PANNES_BATCH, core.EQUIPEMENTS_BATCH
+
+    def tearDown(self):
+        core.LEASE_TTL = self.lease_ttl
+        core.PANNES_BATCH, core.EQUIPEMENTS_BATCH = self.batches
+        self.soap.stop()
+        self.pgrst.stop()
+
+    def cli(self, *argv):
+        with redirect_stdout(io.StringIO()):
+            return sync.main(['--checkpoint', self.checkpoint, *argv])
+
+    def test_failed_write_makes_step_partial(self):
+        self.pgrst.fail.append(('POST', 'equipements', 503))
+        result = core.run_async_engine(lambda: core.sync_equipements(0))
+        self.assertEqual(result["engine"]["write_failures"], 1)
+        self.assertEqual(result["status"], "partial")
+
+    def test_cli_does_not_checkpoint_failed_writes(self):
+        self.pgrst.fail.append(('POST', 'equipements', 503))
+        code = self.cli('--steps', '2', '--sectors', '0-2', '--engine', 'async', '--concurrency', '1')
+        self.assertEqual(code, 1)
+        with open(self.checkpoint, encoding='utf-8') as f:
+            done = json.load(f)['done']
+        self.assertEqual(len(done), 2, "l'unité dont l'écriture a échoué ne doit pas être marquée faite")
+
+    def done(self):
+        with open(self.checkpoint, encoding='utf-8') as f:
+            return json.load(f)['done']
+
+    def test_threads_engine_does_not_checkpoint_failed_writes(self):
+        self.pgrst.fail.append(('POST', 'equipements', 503))
+        code = self.cli('--steps', '2', '--sectors', '0-2', '--engine', 'threads', '--concurrency', '1')
+        self.assertEqual(code, 1)
+        self.assertEqual(len(self.done()), 2, "l'unité dont l'écriture a échoué ne doit pas être marquée faite")
+
+    def test_batch_size_applies_to_equipements(self):
+        code = self.cli('--steps', '2', '--sectors', '0', '--batch-size', '7')
+        self.assertEqual(code, 0)
+        self.assertEqual([len(r[3]) for r in self.pgrst.requests('POST', 'equipements')], [7, 7, 6])
+        self.assertEqual(len(self.pgrst.rows('equipements')), 20)
+
+    def test_lost_lease_stops_the_run(self):
+        core.LEASE_TTL = 0.3
+        self.soap.delay = 0.2
+
+        def steal():
+            deadline = time.monotonic() + 10
+            while 'sync' not in self.pgrst.tables.get('sync_runs', {}) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.25)
+            self.pgrst.tables['sync_runs']['sync'].update(owner='other', expires_at='2999-01-01T00:00:00Z')
+        threading.Thread(target=steal, daemon=True).start()
+        code = self.cli('--steps', '2', '--sectors', '0-7', '--engine', 'threads', '--concurrency', '1')
+        self.assertEqual(code, 2)
+        self.assertLess(len(self.done()), 8)
+        self.assertEqual(self.pgrst.tables['sync_runs']['sync']['owner'], 'other')
+
+    def test_soap_calls_overlap(self):
+        self.soap.delay = 0.3
+        code = self.cli('--steps', '2', '--sectors', '0-3', '--engine', 'async')
+        self.assertEqual(code, 0)
+        starts = sorted(t for t, method, _ in self.soap.calls if method == 'get_Synchro_Wsoucont')
+        self.assertEqual(len(starts), 4)
+        self.assertLess(starts[-1] - starts[0], self.soap.delay * 2, "appels SOAP sérialisés")
+
+if __name__ == '__main__':
+    unittest.main()
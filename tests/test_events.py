@@ -0,0 +1,41 @@
+"""Lot sync_events: écritures concurrentes, une ligne par flush"""
+
+import threading
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+class SyncEventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_concurrent_batches_are_counted(self):
+        def writer(first):
+            for i in range(200):
+                core.record_batch('pannes', [{'id_panne': first + i}, {'id_panne': first + i + 100000}])
+
+        threads = [threading.Thread(target=writer, args=(k * 1000,)) for k in range(8)]
+        flushed = []
+        flusher = threading.Thread(target=lambda: [flushed.append(core.flush_sync_events({"step": "3"}))
+                                                   for _ in range(20)])
+        for t in threads + [flusher]:
+            t.start()
+        for t in threads + [flusher]:
+            t.join()
+        flushed.append(core.flush_sync_events({"step": "3"}))
+        events = [e for e in flushed if e]
+        self.assertEqual(sum(e["ranges"]["pannes"]["count"] for e in events), 8 * 200 * 2)
+        self.assertEqual(min(e["ranges"]["pannes"]["min"] for e in events), 0)
+        self.assertEqual(max(e["ranges"]["pannes"]["max"] for e in events), 7199 + 100000)
+        self.assertEqual(len(self.pgrst.rows('sync_events')), len(events))
+        self.assertEqual(core.sync_batch_summary(), {"tables": [], "ranges": {}})
+
+if __name__ == '__main__':
+    unittest.main()
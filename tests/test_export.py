@@ -0,0 +1,99 @@
+"""Export en flux: une erreur en cours de flux doit laisser un transfert incomplet"""
+
+import gzip
+import http.client
+import json
+import unittest
+from urllib.parse import urlsplit
+
+from tests import standins
+
+export = standins.load_api('export')
+
+USER = standins.user_jwt()
+
+class ExportStreamTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pgrst = standins.Postgrest()
+        cls.api = standins.Server(export.handler)
+        export.SUPABASE_URL = cls.pgrst.url
+        export.SUPABASE_KEY = 'test'
+        standins.configure_auth(cls.pgrst)
+        cls.page_size = export.PAGE_SIZE
+        export.PAGE_SIZE = 10
+
+    @classmethod
+    def tearDownClass(cls):
+        export.PAGE_SIZE = cls.page_size
+        cls.api.stop()
+        cls.pgrst.stop()
+
+    def setUp(self):
+        self.pgrst.tables['pannes'] = {i: {'id_panne': i, 'motif': f'panne {i}'} for i in range(1, 36)}
+        self.pgrst.fail.clear()
+
+    def get(self, query, token=USER):
+        """(status, corps, complet): complet = chunk terminal reçu"""
+        parts = urlsplit(self.api.url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+        conn.request('GET', f"/api/export?{query}", headers={'Authorization': f'Bearer {token}'} if token else {})
+        resp = conn.getresponse()
+        try:
+            return resp.status, resp.read(), True
+        except http.client.IncompleteRead as e:
+            return resp.status, e.partial, False
+        finally:
+            conn.close()
+
+    def test_complete_export(self):
+        status, body, complete = self.get('table=pannes&format=ndjson&gzip=1')
+        self.assertEqual(status, 200)
+        self.assertTrue(complete)
+        rows = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        self.assertEqual([r['id_panne'] for r in rows], list(range(1, 36)))
+
+    def test_user_token_required(self):
+        self.pgrst.log.clear()
+        for token in (None, standins.user_jwt('anon')):
+            status, body, _ = self.get('table=pannes', token)
+            self.assertEqual(status, 401)
+        self.assertEqual(self.pgrst.requests('GET', 'pannes'), [])
+
+    def test_postgrest_params_are_not_filters(self):
+        for query in ('table=pannes&limit=eq.1', 'table=pannes&order=eq.id_panne', 'table=pannes&select=eq.x'):
+            self.assertEqual(self.get(query)[0], 400, query)
+
+    def get_failing(self, query, status=503):
+        """GET dont la 2e page PostgREST répond `status` (la 1re est déjà envoyée au client)"""
+        original = export.fetch_page
+        calls = []
+
+        def fetch_page(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                self.pgrst.fail.append(('GET', 'pannes', status))
+            return original(*args)
+
+        export.fetch_page = fetch_page
+        try:
+            return self.get(query)
+        finally:
+            export.fetch_page = original
+
+    def test_failure_mid_page_gzip(self):
+        status, body, complete = self.get_failing('table=pannes&format=csv')
+        self.assertEqual(status, 200)
+        self.assertFalse(complete, "export tronqué présenté comme complet")
+
+    def test_failure_mid_page_ndjson(self):
+        status, body, complete = self.get_failing('table=pannes&format=ndjson&gzip=0')
+        self.assertEqual(status, 200)
+        self.assertFalse(complete)
+        lines = body.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 11)  # 1re page + ligne d'erreur
+        self.assertEqual(json.loads(lines[-1])['status'], 'error')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""Fan-out: jeton des shards, verrou du coordinateur (api/sync.py contre les doublures)"""
+
+import json
+import time
+import unittest
+import urllib.request
+
+from tests import standins
+
+core = standins.load_core()
+
+class ShardTokenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        self.secret = core.FANOUT_SECRET
+        core.FANOUT_SECRET = 'fanout-test'
+        self.api = standins.Server(core.handler)
+        self.owner = core.lease_owner()
+        self.assertTrue(core.lease_acquire(self.owner, {"mode": "fanout"}))
+        self.pgrst.tables['sync_runs']['fanout:abc123'] = {
+            'name': 'fanout:abc123', 'owner': self.owner, 'expires_at': '1970-01-01T00:00:00Z',
+            'progress': {"steps": ["4"], "units": ["4"]}, 'updated_at': '2026-01-01T00:00:00Z'}
+
+    def tearDown(self):
+        core.FANOUT_SECRET = self.secret
+        self.api.stop()
+        self.pgrst.stop()
+
+    def get(self, query):
+        with urllib.request.urlopen(f"{self.api.url}/api/sync?{query}", timeout=30) as resp:
+            return json.loads(resp.read())
+
+    def test_holder_hides_owner(self):
+        holder = self.get('step=4')['holder']
+        self.assertEqual(holder['progress'], {"mode": "fanout"})
+        self.assertNotIn('owner', holder)
+        self.assertNotIn(self.owner, json.dumps(holder))
+
+    def test_forged_token_is_refused(self):
+        result = self.get('step=4&fanout=abc123&shard=' + '0' * 64)
+        self.assertEqual(result['status'], 'error')
+        self.assertIn('token', result['message'])
+        # ni verrou rejoint ni ligne de shard
+        self.assertNotIn('fanout:abc123:4', self.pgrst.tables['sync_runs'])
+        self.assertEqual(self.pgrst.tables['sync_runs']['sync']['owner'], self.owner)
+
+    def test_owner_param_is_ignored(self):
+        result = self.get(f'step=4&fanout=abc123&owner={self.owner}')
+        self.assertEqual(result['status'], 'error')
+
+    def test_signed_token_joins_lease(self):
+        self.assertEqual(core.fanout_owner('abc123', core.fanout_token('abc123', self.owner)), self.owner)
+        with self.assertRaises(PermissionError):
+            core.fanout_owner('abc123', core.fanout_token('abc123', 'someone-else'))
+        with self.assertRaises(PermissionError):
+            core.fanout_owner('fff000', core.fanout_token('abc123', self.owner))
+
+    def test_no_secret_no_fanout(self):
+        core.FANOUT_SECRET = ''
+        with self.assertRaises(PermissionError):
+            core.fanout_owner('abc123', core.fanout_token('abc123', self.owner))
+        self.assertEqual(self.get('mode=fanout&steps=4')['status'], 'error')
+
+    def test_filter_injection_cannot_steal_lease(self):
+        stolen = 'x,expires_at.gt.1970-01-01T00:00:00Z'
+        with self.assertRaises(ValueError):
+            core.lease_acquire(stolen, {})
+        with self.assertRaises(ValueError):
+            core.lease_release(stolen)
+        self.assertEqual(self.pgrst.tables['sync_runs']['sync']['owner'], self.owner)
+        self.assertFalse(core.lease_acquire(core.lease_owner(), {}))
+
+class FanoutRunTest(unittest.TestCase):
+    """Coordinateur + shards auto-invoqués sur un serveur local"""
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        self.soap = standins.Soap(delay=0.05)
+        self.soap.payloads['get_Synchro_Wsoucont'] = standins.soap_response(
+            'tabListeWsoucont', standins.wsoucont_items(5))
+        standins.configure_core(core, self.pgrst, self.soap)
+        self.saved = {k: getattr(core, k) for k in ('FANOUT_SECRET', 'SECTORS', 'FANOUT_DEADLINE')}
+        core.FANOUT_SECRET = 'fanout-test'
+        core.SECTORS = core.SECTORS[:3]
+        self.api = standins.Server(core.handler)
+        self.base_url = f"{self.api.url}/api/sync"
+
+    def tearDown(self):
+        for k, v in self.saved.items():
+            setattr(core, k, v)
+        self.api.stop()
+        self.soap.stop()
+        self.pgrst.stop()
+
+    def lease(self):
+        return self.pgrst.tables['sync_runs']['sync']
+
+    def test_run_success_releases_lease(self):
+        result = core.sync_fanout(self.base_url, ['2'])
+        self.assertEqual(result['status'], 'success', result)
+        self.assertEqual(result['counts']['success'], 3)
+        self.assertTrue(self.lease()['expires_at'].startswith('1970'))
+        # Shards sous le seau partagé même sans PROGILIFT_SHARED_LIMIT
+        self.assertFalse(core.PROGILIFT_SHARED_LIMIT)
+        self.assertIn(core.RATE_ROW, self.pgrst.tables['sync_runs'])
+
+    def test_late_shards_release_lease(self):
+        self.soap.delay = 0.6
+        core.FANOUT_DEADLINE = 0.2
+        result = core.sync_fanout(self.base_url, ['2'])
+        self.assertEqual(result['status'], 'running', result)
+        self.assertFalse(self.lease()['expires_at'].startswith('1970'))
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline and not self.lease()['expires_at'].startswith('1970'):
+            time.sleep(0.1)
+        self.assertTrue(self.lease()['expires_at'].startswith('1970'), "verrou jamais libéré")
+        self.assertEqual(core.fanout_status(result['run'])['status'], 'success')
+
+    def test_shard_keeps_lease_while_coordinator_active(self):
+        owner = core.lease_owner()
+        self.assertTrue(core.lease_acquire(owner, {}))
+        self.pgrst.tables['sync_runs']['fanout:abc123'] = {
+            'name': 'fanout:abc123', 'owner': owner, 'expires_at': '1970-01-01T00:00:00Z',
+            'progress': {"steps": ["4"], "units": ["4"]}, 'updated_at': '2026-01-01T00:00:00Z'}
+        started = core.fanout_record('abc123', '4', owner)['started_at']
+        core.fanout_finish('abc123', '4', owner, {"status": "success"}, started)
+        self.assertFalse(self.lease()['expires_at'].startswith('1970'))
+
+class HealthMergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_save_merges_with_other_shards(self):
+        core.load_health()
+        core.record_call('get_Synchro_Wsoucont', 1.5, True)
+        core.record_call('get_Synchro_Wpanne', 9.0, False)
+        # Un autre shard a publié entre-temps
+        self.pgrst.tables['sync_runs'][core.HEALTH_ROW] = {
+            'name': core.HEALTH_ROW, 'owner': 'v1', 'expires_at': '1970-01-01T00:00:00Z',
+            'progress': {'latency': {'get_Synchro_Wsoucont': [0.5], 'get_AppareilsArret': [0.2]},
+                         'failures': 1, 'open_until': 0}}
+        self.assertTrue(core.save_health())
+        state = self.pgrst.tables['sync_runs'][core.HEALTH_ROW]['progress']
+        self.assertEqual(state['latency']['get_Synchro_Wsoucont'], [0.5, 1.5])
+        self.assertEqual(state['latency']['get_AppareilsArret'], [0.2])
+        self.assertEqual(state['failures'], 1)  # remis à zéro par le succès local, puis 1 échec
+        self.assertNotEqual(self.pgrst.tables['sync_runs'][core.HEALTH_ROW]['owner'], 'v1')
+
+    def test_failures_add_up(self):
+        core.load_health()
+        core.record_call('get_Synchro_Wpanne', 9.0, False)
+        self.pgrst.tables['sync_runs'][core.HEALTH_ROW] = {
+            'name': core.HEALTH_ROW, 'owner': 'v1', 'expires_at': '1970-01-01T00:00:00Z',
+            'progress': {'latency': {}, 'failures': 2, 'open_until': 0}}
+        self.assertTrue(core.save_health())
+        self.assertEqual(self.pgrst.tables['sync_runs'][core.HEALTH_ROW]['progress']['failures'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
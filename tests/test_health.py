@@ -0,0 +1,77 @@
+"""Résilience Progilift: latences par clé, demi-ouvert à un seul essai, couverture"""
+
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+class HealthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        self.soap = standins.Soap(delay=0.3)
+        standins.configure_core(core, self.pgrst, self.soap)
+        self.hedge_delay = core.HEDGE_DEFAULT_DELAY
+        core.HEDGE_DEFAULT_DELAY = 0.05
+
+    def tearDown(self):
+        core.HEDGE_DEFAULT_DELAY = self.hedge_delay
+        self.soap.stop()
+        self.pgrst.stop()
+
+    def test_latency_keys(self):
+        self.assertEqual(core.latency_key('get_Synchro_Wsoucont', {"sListeSecteursTechnicien": "71"}),
+                         'get_Synchro_Wsoucont:71')
+        self.assertEqual(core.latency_key('get_Synchro_Wpanne', {"dhDerniereMajFichier": core.PERIODS[0]}),
+                         f'get_Synchro_Wpanne:{core.PERIODS[0]}')
+        self.assertIsNone(core.latency_key('get_Synchro_Wpanne', {"dhDerniereMajFichier": "2026-10-19T08:00:00"}))
+        self.assertEqual(core.latency_key('get_AppareilsArret', {}), 'get_AppareilsArret')
+
+    def test_small_sector_does_not_cap_large_one(self):
+        for _ in range(10):
+            core.record_call('get_Synchro_Wsoucont:1', 0.2, True)
+        self.assertEqual(core.adaptive_timeout('get_Synchro_Wsoucont:1', 120), core.TIMEOUT_FLOOR)
+        self.assertEqual(core.adaptive_timeout('get_Synchro_Wsoucont:71', 120), 120)
+        self.assertEqual(core.adaptive_timeout(None, 180), 180)
+
+    def open_circuit(self):
+        for _ in range(core.CIRCUIT_FAILURES):
+            core.record_call('get_AppareilsArret', 1.0, False)
+        self.assertRaises(core.CircuitOpen, core.circuit_check, 'get_AppareilsArret', 30)
+        core.save_health()
+        # Fenêtre écoulée, localement et dans la ligne partagée
+        core.PROGILIFT_HEALTH['open_until'] = 1
+        self.pgrst.tables['sync_runs'][core.HEALTH_ROW]['progress']['open_until'] = 1
+
+    def test_half_open_lets_one_trial_through(self):
+        self.open_circuit()
+        self.assertTrue(core.circuit_check('get_AppareilsArret', 30))
+        with self.assertRaises(core.CircuitOpen):
+            core.circuit_check('get_Synchro_Wsoucont', 30)
+        core.record_call('get_AppareilsArret', 0.5, True, trial=True)
+        self.assertFalse(core.circuit_check('get_Synchro_Wsoucont', 30))
+
+    def test_trial_claimed_across_instances(self):
+        self.open_circuit()
+        self.assertTrue(core.circuit_check('get_AppareilsArret', 30))
+        # Autre instance: même état partagé, pas de réservation locale
+        core.PROGILIFT_HEALTH['trial_until'] = 0
+        with self.assertRaises(core.CircuitOpen):
+            core.circuit_check('get_AppareilsArret', 30)
+
+    def test_failed_trial_reopens(self):
+        self.open_circuit()
+        self.assertTrue(core.circuit_check('get_AppareilsArret', 30))
+        core.record_call('get_AppareilsArret', 30, False, trial=True)
+        with self.assertRaisesRegex(core.CircuitOpen, 'open for'):
+            core.circuit_check('get_AppareilsArret', 30)
+
+    def test_auth_is_not_hedged(self):
+        self.assertEqual(core.get_auth(), 'ABCDEF')
+        self.assertEqual([c[1] for c in self.soap.calls], ['IdentificationTechnicien'])
+        core.progilift_call('get_AppareilsArret', {}, 'ABCDEF', 30)
+        self.assertEqual([c[1] for c in self.soap.calls].count('get_AppareilsArret'), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Historique arret_intervals: ouverture, fermeture, réouverture sur le dernier intervalle fermé"""
+
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+def arret(id_wsoucont, id_panne):
+    return {'nIDSOUCONT': id_wsoucont, 'nClepanne': id_panne, 'sDateAppel': '20261019',
+            'sHeureAppel': '081500', 'sMotifAppel': 'Arrêt'}
+
+class IntervalsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        # Long historique fermé pour l'appareil 1, le plus récent sur la panne 77
+        self.pgrst.tables['arret_intervals'] = {
+            i: {'id': i, 'id_wsoucont': 1, 'id_panne': 100 + i, 'started_at': f'2025-01-{i:02d}T08:00:00Z',
+                'ended_at': f'2025-01-{i:02d}T12:00:00Z'} for i in range(1, 28)}
+        self.pgrst.tables['arret_intervals'][28] = {'id': 28, 'id_wsoucont': 1, 'id_panne': 77,
+                                                    'started_at': '2026-10-18T08:00:00Z',
+                                                    'ended_at': '2026-10-18T12:00:00Z'}
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def open_rows(self):
+        return {r['id_wsoucont']: r for r in self.pgrst.rows('arret_intervals') if r.get('ended_at') is None}
+
+    def test_same_panne_reopens_last_closed_interval(self):
+        stats = core.update_arret_intervals([arret(1, 77), arret(2, 5)])
+        self.assertEqual((stats["reopened"], stats["opened"]), (1, 1))
+        self.assertEqual(self.open_rows()[1]['id'], 28)
+        # Une ligne par appareil au plus, quelle que soit la longueur de l'historique
+        lookups = [q for _, table, q, _ in self.pgrst.log if table == 'arret_intervals_last']
+        self.assertEqual(len(lookups), 1)
+        self.assertNotIn('order=', lookups[0])
+
+    def test_other_panne_opens_new_interval_then_closes(self):
+        stats = core.update_arret_intervals([arret(1, 78)])
+        self.assertEqual((stats["reopened"], stats["opened"]), (0, 1))
+        self.assertNotEqual(self.open_rows()[1]['id'], 28)
+        stats = core.update_arret_intervals([])
+        self.assertEqual(stats["closed"], 1)
+        self.assertEqual(self.open_rows(), {})
+        self.assertEqual(core.sync_batch_summary()["ranges"]["arret_intervals"]["min"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
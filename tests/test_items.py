@@ -0,0 +1,45 @@
+"""Items SOAP compacts: champ absent ≠ balise vide, lecture comme un dict, sérialisation JSON"""
+
+import json
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+class ItemTest(unittest.TestCase):
+
+    def setUp(self):
+        # Champs absents différents d'un item à l'autre, balises vides comprises
+        items = []
+        for i in range(40):
+            item = {'IDWPANNE': 1000 + i, 'IDWSOUCONT': 7}
+            if i % 2:
+                item['DIV1'] = f'div {i}'
+            if i % 3:
+                item['MOTIF'] = ''
+            if i % 5 == 0:
+                item['DATEAPP'] = '20250102'
+            items.append(item)
+        self.source = items
+        self.items = core.parse_items(standins.soap_response('tabListeWpanne', items), 'tabListeWpanne')
+
+    def test_missing_and_empty_fields(self):
+        self.assertEqual(len(self.items), 40)
+        for src, item in zip(self.source, self.items):
+            self.assertEqual('DIV1' in item, 'DIV1' in src)
+            self.assertEqual(item.get('DIV1', 'absent'), src.get('DIV1', 'absent'))
+            if 'MOTIF' in src:
+                self.assertIsNone(item['MOTIF'])
+            else:
+                self.assertRaises(KeyError, item.__getitem__, 'MOTIF')
+
+    def test_schema_shared_by_items(self):
+        self.assertEqual(len({id(item.schema) for item in self.items}), 1)
+
+    def test_json_matches_dict(self):
+        for item in self.items:
+            self.assertEqual(json.loads(json.dumps(item, default=core.json_default)), item.to_dict())
+
+if __name__ == '__main__':
+    unittest.main()
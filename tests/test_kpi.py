@@ -0,0 +1,58 @@
+"""KPI: recalcul limité aux mois de la fenêtre, identique au recalcul complet"""
+
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+def kpi_tables(pgrst):
+    strip = lambda rows: sorted(({k: v for k, v in r.items() if k != 'updated_at'} for r in rows),
+                                key=lambda r: (r['secteur'], r.get('mois', '')))
+    return strip(pgrst.rows('kpi_secteurs')), strip(pgrst.rows('kpi_mois'))
+
+class KpiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        self.pgrst.tables['equipements'] = {1000 + i: {'id_wsoucont': 1000 + i, 'secteur': str(1 + i % 3)}
+                                            for i in range(30)}
+        self.pgrst.tables['appareils_arret'] = {1: {'id': 1, 'id_wsoucont': 1004}}
+        self.pgrst.tables['pannes'] = {}
+        self.add_pannes(standins.wpanne_items(300, n_equip=30, years=(2025, 2026)))
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def add_pannes(self, items):
+        rows = [core.panne_row(p) for p in items]
+        for r in rows:
+            self.pgrst.tables['pannes'][r['id_panne']] = r
+        return rows
+
+    def test_window_months_match_full_recompute(self):
+        self.assertEqual(core.update_kpis()["status"], "success")
+        # Nouvelles pannes sur deux mois, une panne existante change d'équipement (donc de secteur)
+        window = self.add_pannes(standins.wpanne_items(20, n_equip=30, seed=7, first=900000, years=(2026,)))
+        moved = next(r for r in self.pgrst.rows('pannes') if r['id_panne'] < 900000)
+        moved['id_wsoucont'] = 1000 + (moved['id_wsoucont'] - 1000 + 1) % 30
+        months = core.kpi_months(window + [moved])
+        result = core.update_kpis(months)
+        self.assertLess(result["pannes"], 300)
+        incremental = kpi_tables(self.pgrst)
+        core.update_kpis()
+        self.assertEqual(incremental, kpi_tables(self.pgrst))
+
+    def test_month_without_pannes_is_reset(self):
+        core.update_kpis()
+        mois = '2025-03'
+        for id_panne in [r['id_panne'] for r in self.pgrst.rows('pannes') if r['date_appel'].startswith('202503')]:
+            del self.pgrst.tables['pannes'][id_panne]
+        core.update_kpis({mois})
+        self.assertEqual({r['pannes_count'] for r in self.pgrst.rows('kpi_mois') if r['mois'] == mois}, {0})
+        secteurs = sum(r['pannes_count'] for r in self.pgrst.rows('kpi_secteurs'))
+        self.assertEqual(secteurs, len(self.pgrst.rows('pannes')))
+
+if __name__ == '__main__':
+    unittest.main()
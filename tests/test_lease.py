@@ -0,0 +1,80 @@
+"""Verrou sync_runs contre la doublure PostgREST (api/sync.py et api/cron.py)"""
+
+import json
+import unittest
+import urllib.request
+
+from tests import standins
+
+core = standins.load_core()
+cron = standins.load_api('cron')
+
+class LeaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_acquire_busy_release(self):
+        self.assertTrue(core.lease_acquire('a', {"step": "2"}))
+        self.assertFalse(core.lease_acquire('b', {"step": "3"}))
+        self.assertTrue(core.lease_acquire('a', {"step": "2b"}))  # renouvellement
+        self.assertEqual(self.pgrst.tables['sync_runs']['sync']['progress'], {"step": "2b"})
+        self.assertTrue(core.lease_release('a'))
+        self.assertTrue(core.lease_acquire('b', {}))
+
+    def test_expired_lease_is_taken_over(self):
+        self.assertTrue(core.lease_acquire('a', {}))
+        self.pgrst.tables['sync_runs']['sync']['expires_at'] = '2000-01-01T00:00:00Z'
+        self.assertTrue(core.lease_acquire('b', {}))
+        self.assertEqual(self.pgrst.tables['sync_runs']['sync']['owner'], 'b')
+
+    def test_release_only_by_owner(self):
+        self.assertTrue(core.lease_acquire('a', {}))
+        core.lease_release('b')
+        self.assertFalse(core.lease_acquire('b', {}))
+
+    def test_run_with_lease_busy_then_released(self):
+        self.assertTrue(core.lease_acquire('other', {}))
+        self.assertEqual(core.run_with_lease(lambda: {"status": "success"}, {"step": "1"})["status"], "busy")
+        core.lease_release('other')
+        result = core.run_with_lease(lambda: {"status": "success"}, {"step": "1"})
+        self.assertEqual(result["status"], "success")
+        self.assertTrue(self.pgrst.tables['sync_runs']['sync']['expires_at'].startswith('1970'))
+
+class MissingTableTest(unittest.TestCase):
+    """sync_runs absente (migration non appliquée): erreur explicite, jamais busy"""
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest(known=set())
+        standins.configure_core(core, self.pgrst)
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_acquire_raises(self):
+        with self.assertRaises(core.LeaseUnavailable):
+            core.lease_acquire('a', {})
+
+    def test_run_with_lease_is_error(self):
+        ran = []
+        result = core.run_with_lease(lambda: ran.append(1), {"step": "1"}, wait=5)
+        self.assertEqual(result["status"], "error")
+        self.assertIn("sync_runs", result["message"])
+        self.assertEqual(ran, [])
+
+    def test_cron_is_error(self):
+        api = standins.Server(cron.handler)
+        try:
+            with urllib.request.urlopen(f"{api.url}/api/cron", timeout=30) as resp:
+                result = json.loads(resp.read())
+        finally:
+            api.stop()
+        self.assertEqual(result["status"], "error")
+        self.assertIn("sync_runs", result["message"])
+
+if __name__ == '__main__':
+    unittest.main()
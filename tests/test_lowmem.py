@@ -0,0 +1,80 @@
+"""Step 3 en mémoire bornée (lowmem): iter_items_file et lignes écrites identiques au parse en mémoire"""
+
+import json
+import tempfile
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+def strip(rows):
+    return json.dumps(sorted(({k: v for k, v in r.items() if k != 'updated_at'} for r in rows),
+                             key=lambda r: r['id_panne']), default=core.json_default, sort_keys=True)
+
+class IterItemsFileTest(unittest.TestCase):
+
+    def setUp(self):
+        items = standins.wpanne_items(25, n_equip=6)
+        for i, item in enumerate(items):
+            if i % 2:
+                item['CAUSE'] = ''
+            if i % 3:
+                del item['DUREE']
+            item['TRAVAUX'] = f'Remplacement câble n°{i} — contrôle'
+        self.xml = standins.soap_response('tabListeWpanne', items)
+
+    def iter_file(self, body):
+        with tempfile.TemporaryFile() as f:
+            f.write(body.encode('utf-8'))
+            f.flush()
+            f.seek(0)
+            return list(core.iter_items_file(f, 'tabListeWpanne'))
+
+    def test_same_items_as_parse_items(self):
+        streamed = self.iter_file(self.xml)
+        parsed = core.parse_items(self.xml, 'tabListeWpanne')
+        self.assertEqual(len(streamed), 25)
+        self.assertEqual([i.to_dict() for i in streamed], [i.to_dict() for i in parsed])
+        for a, b in zip(streamed, parsed):
+            self.assertEqual('DUREE' in a, 'DUREE' in b)
+
+    def test_empty_and_itemless_files(self):
+        self.assertEqual(self.iter_file(''), [])
+        self.assertEqual(self.iter_file(standins.soap_response('tabListeWpanne', [])), [])
+
+class SyncPannesLowmemTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        self.soap = standins.Soap()
+        self.soap.payloads['get_Synchro_Wpanne'] = standins.soap_response(
+            'tabListeWpanne', standins.wpanne_items(30, n_equip=8, years=(2026,)))
+        standins.configure_core(core, self.pgrst, self.soap)
+        self.pgrst.tables['equipements'] = {1000 + i: {'id_wsoucont': 1000 + i, 'secteur': '1'} for i in range(8)}
+        self.batch = core.PANNES_BATCH
+
+    def tearDown(self):
+        core.PANNES_BATCH = self.batch
+        self.soap.stop()
+        self.pgrst.stop()
+
+    def run_step(self, lowmem, raw_mode='full'):
+        self.pgrst.tables.pop('pannes', None)
+        self.pgrst.log.clear()
+        result = core.sync_pannes(0, raw_mode=raw_mode, lowmem=lowmem)
+        return result, self.pgrst.rows('pannes'), {k: dict(v) for k, v in self.pgrst.tables['equipements'].items()}
+
+    def test_rows_match_in_memory_path(self):
+        core.PANNES_BATCH = 7
+        for raw_mode in ('full', 'compact'):
+            memory, rows, equipements = self.run_step(False, raw_mode)
+            lowmem, lowmem_rows, lowmem_equipements = self.run_step(True, raw_mode)
+            self.assertEqual(strip(lowmem_rows), strip(rows), raw_mode)
+            self.assertEqual(lowmem_equipements, equipements)
+            for key in ('status', 'pannes_found', 'upserted', 'payload', 'rollups_updated'):
+                self.assertEqual(lowmem[key], memory[key], key)
+            self.assertEqual(len(self.pgrst.requests('POST', 'pannes')), 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Compteurs sync_metrics (api/sync.py) et agrégation /api/metrics (api/metrics.py)"""
+
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from tests import standins
+
+core = standins.load_core()
+metrics = standins.load_api('metrics')
+
+class FlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_soap_items_and_table_reads_are_separate(self):
+        xml = standins.soap_response('tabListeWsoucont', standins.wsoucont_items(3))
+        self.assertEqual(len(core.parse_items(xml, 'tabListeWsoucont')), 3)
+        self.pgrst.tables['equipements'] = {1: {'id_wsoucont': 1}}
+        core.supabase_get('equipements', 'id_wsoucont')
+        row = core.flush_sync_metrics({"step": "2"}, "success")
+        self.assertEqual(row['metrics']['soap_items'], {'tabListeWsoucont': 3})
+        self.assertEqual(row['metrics']['rows_fetched'], {'equipements': 1})
+
+    def test_flush_does_not_count_its_own_write(self):
+        core.metric_count('rows_written', 'equipements', 5)
+        core.flush_sync_metrics({"step": "2"}, "success")
+        self.assertEqual(len(self.pgrst.rows('sync_metrics')), 1)
+        self.assertEqual(core.METRICS, {})
+
+class TotalsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        metrics.SUPABASE_URL = self.pgrst.url
+        metrics.SUPABASE_KEY = 'test'
+        now = datetime.now(timezone.utc)
+        old = (now - timedelta(days=metrics.LOOKBACK_DAYS + 1)).isoformat()
+        recent = now.isoformat()
+        self.pgrst.tables['sync_metrics'] = {
+            1: {'id': 1, 'step': '2', 'status': 'success', 'created_at': old,
+                'metrics': {'rows_written': {'equipements': 100}}},
+            2: {'id': 2, 'step': '2', 'status': 'success', 'created_at': recent,
+                'metrics': {'rows_written': {'equipements': 7}, 'rows_fetched': {'tabListeWsoucont': 7}}},
+        }
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_first_read_is_bounded_then_incremental(self):
+        totals = metrics.Totals()
+        self.assertEqual(totals.refresh(), 1)
+        self.assertIn('created_at=gte.', self.pgrst.requests('GET', 'sync_metrics')[0][2])
+        self.assertEqual(totals.counts[('rows_written', 'equipements')], 7)
+        # Anciennes lignes: balises SOAP sous rows_fetched, relues comme soap_items
+        self.assertEqual(totals.counts[('soap_items', 'tabListeWsoucont')], 7)
+        self.assertNotIn(('rows_fetched', 'tabListeWsoucont'), totals.counts)
+        self.pgrst.tables['sync_metrics'][3] = {'id': 3, 'step': '2', 'status': 'success',
+                                                'created_at': datetime.now(timezone.utc).isoformat(),
+                                                'metrics': {'rows_written': {'equipements': 1}}}
+        self.assertEqual(totals.refresh(), 1)
+        self.assertIn('id=gt.2', self.pgrst.requests('GET', 'sync_metrics')[-1][2])
+        self.assertEqual(totals.counts[('rows_written', 'equipements')], 8)
+        text = metrics.render(totals, None, 0, 0)
+        self.assertIn('progilift_sync_soap_items_total{tag="tabListeWsoucont"} 7', text)
+
+if __name__ == '__main__':
+    unittest.main()
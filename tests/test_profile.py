@@ -0,0 +1,75 @@
+"""?profile=1: honoré seulement avec le bon X-Profile-Secret, aucun profilage sans lui"""
+
+import json
+import unittest
+import urllib.request
+
+from tests import standins
+
+core = standins.load_core()
+
+SECRET = 's3cret-profil'
+
+class ProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        self.pgrst.tables['equipements'] = {i: {'id_wsoucont': i, 'pannes_365j': i % 3} for i in range(1, 11)}
+        self.api = standins.Server(core.handler)
+        self.saved = core.PROFILE_SECRET, core.run_profiled
+        core.PROFILE_SECRET = SECRET
+        self.profiled = []
+
+        def run_profiled(fn, *args, **kwargs):
+            self.profiled.append(fn)
+            return self.saved[1](fn, *args, **kwargs)
+        core.run_profiled = run_profiled
+
+    def tearDown(self):
+        core.PROFILE_SECRET, core.run_profiled = self.saved
+        self.api.stop()
+        self.pgrst.stop()
+
+    def get(self, query, secret=None):
+        headers = {'X-Profile-Secret': secret} if secret is not None else {}
+        req = urllib.request.Request(f"{self.api.url}/api/sync?{query}", headers=headers)
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return json.loads(resp.read())
+
+    def scores_written(self):
+        return len(self.pgrst.requests('PATCH', 'equipements'))
+
+    def test_valid_secret(self):
+        result = self.get('step=6&profile=1', SECRET)
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(len(self.profiled), 1)
+        report = result["profile"]
+        self.assertIn("supabase_stream", report["phases"])
+        self.assertTrue(report["cumulative"] and report["memory"]["tracemalloc_peak_kb"] >= 0)
+
+    def test_missing_or_wrong_secret(self):
+        for secret in (None, '', 'mauvais', SECRET + 'x'):
+            result = self.get('step=6&profile=1', secret)
+            self.assertEqual(result["status"], "error", secret)
+            self.assertIn("X-Profile-Secret", result["message"])
+            self.assertNotIn("profile", result)
+        # Refusé avant d'exécuter le step
+        self.assertEqual((self.profiled, self.scores_written()), ([], 0))
+
+    def test_disabled_without_configured_secret(self):
+        core.PROFILE_SECRET = ''
+        for secret in ('', SECRET):
+            self.assertEqual(self.get('step=6&profile=1', secret)["status"], "error")
+        self.assertEqual(self.profiled, [])
+
+    def test_no_profiling_without_parameter(self):
+        # L'en-tête seul (même valide) ne déclenche rien: le step s'exécute tel quel
+        for secret in (None, SECRET):
+            result = self.get('step=6', secret)
+            self.assertEqual(result["status"], "success")
+            self.assertNotIn("profile", result)
+        self.assertEqual(self.profiled, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Limiteur Progilift: seau local (TokenBucket) et seau partagé (shared_take, ligne RATE_ROW de sync_runs)"""
+
+import threading
+import time
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+class Clock:
+    """Horloge simulée: sleep() avance le temps au lieu d'attendre"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    time = perf_counter = monotonic
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        core.time = self.clock
+
+    def tearDown(self):
+        core.time = time
+
+    def test_burst_then_rate(self):
+        bucket = core.TokenBucket(2, 4)
+        waits = [bucket.take() for _ in range(20)]
+        self.assertEqual(waits[:4], [0] * 4)
+        self.assertEqual(waits[4:], [0.5] * 16)
+        # 16 jetons au-delà de la rafale, à 2 par seconde
+        self.assertAlmostEqual(self.clock.now - 1000.0, 8.0)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = core.TokenBucket(2, 4)
+        for _ in range(6):
+            bucket.take()
+        self.clock.now += 100
+        self.assertEqual([bucket.take() for _ in range(5)], [0, 0, 0, 0, 0.5])
+
+    def test_partial_refill(self):
+        bucket = core.TokenBucket(2, 1)
+        bucket.take()
+        self.clock.now += 0.25
+        self.assertAlmostEqual(bucket.take(), 0.25)
+
+class TokenBucketThreadsTest(unittest.TestCase):
+
+    def test_reservations_are_serialized(self):
+        bucket = core.TokenBucket(50, 1)
+        started = time.monotonic()
+        threads = [threading.Thread(target=bucket.take) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Un jeton immédiat puis 9 à 50/s, quel que soit l'ordre des threads
+        self.assertGreaterEqual(time.monotonic() - started, 9 / 50 - 0.01)
+        self.assertAlmostEqual(bucket.tokens, -9, delta=1)
+
+class SharedTakeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        self.saved = core.PROGILIFT_RATE, core.PROGILIFT_BURST
+        core.PROGILIFT_RATE, core.PROGILIFT_BURST = 2.0, 4
+        self.clock = Clock()
+        core.time = self.clock
+        core.PROGILIFT_BUCKET = core.TokenBucket(2.0, 4)
+
+    def tearDown(self):
+        core.time = time
+        core.PROGILIFT_RATE, core.PROGILIFT_BURST = self.saved
+        self.pgrst.stop()
+
+    def test_burst_then_rate_in_sync_runs(self):
+        waits = [core.shared_take() for _ in range(8)]
+        self.assertEqual(waits[:4], [0] * 4)
+        self.assertEqual(waits[4:], [0.5] * 4)
+        state = self.pgrst.tables['sync_runs'][core.RATE_ROW]['progress']
+        self.assertEqual((state['tokens'], state['at']), (-1, self.clock.now - 0.5))
+        # Le seau local n'a pas servi
+        self.assertEqual(core.PROGILIFT_BUCKET.tokens, 4)
+
+    def test_state_shared_between_instances(self):
+        for _ in range(4):
+            core.shared_take()
+        # Une autre instance (autre seau local) voit la rafale déjà consommée
+        core.PROGILIFT_BUCKET = core.TokenBucket(2.0, 4)
+        self.assertEqual(core.shared_take(), 0.5)
+
+    def test_idle_refill_is_capped(self):
+        for _ in range(6):
+            core.shared_take()
+        self.clock.now += 60
+        self.assertEqual([core.shared_take() for _ in range(5)], [0, 0, 0, 0, 0.5])
+
+    def test_falls_back_to_local_bucket(self):
+        self.pgrst.fail += [('POST', 'sync_runs', 503)] * 8
+        self.assertEqual(core.shared_take(), 0)
+        self.assertEqual(core.PROGILIFT_BUCKET.tokens, 3)
+        self.assertNotIn(core.RATE_ROW, self.pgrst.tables.get('sync_runs', {}))
+
+if __name__ == '__main__':
+    unittest.main()
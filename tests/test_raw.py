@@ -0,0 +1,68 @@
+"""Payload brut (data_wsoucont, data_wpanne, data du cron): item → ligne → rebuild_raw redonne l'item"""
+
+import json
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+cron = standins.load_api('cron')
+
+def stored(row):
+    """Ligne telle que relue depuis PostgREST"""
+    return json.loads(json.dumps(row, default=core.json_default))
+
+class RawPayloadTest(unittest.TestCase):
+
+    def setUp(self):
+        items = standins.wpanne_items(30, n_equip=5)
+        for i, item in enumerate(items):
+            if i % 2:
+                item['CAUSE'] = ''              # balise vide → None
+            if i % 3:
+                del item['MOTIF']              # champ absent
+            if i % 5 == 0:
+                item['DUREE'] = f'0{item["DUREE"]}'  # non retrouvable depuis la colonne int
+            item['INTER'] = '0815'
+        self.xml = standins.soap_response('tabListeWpanne', items)
+        self.items = core.parse_items(self.xml, 'tabListeWpanne')
+
+    def round_trip(self, row_of, raw_key, raw_mode):
+        for item in self.items:
+            row = row_of(item)
+            core.apply_raw_mode(row, raw_key, raw_mode, [0, 0])
+            self.assertEqual(core.rebuild_raw(stored(row), raw_key), item.to_dict())
+
+    def test_panne_row_compact(self):
+        self.round_trip(core.panne_row, 'data_wpanne', 'compact')
+
+    def test_panne_row_full(self):
+        self.round_trip(core.panne_row, 'data_wpanne', 'full')
+
+    def test_cron_row(self):
+        self.assertIs(cron.core, core)
+        pgrst = standins.Postgrest()
+        soap = standins.Soap()
+        raw_mode = core.RAW_PAYLOAD_MODE
+        try:
+            soap.payloads['get_Synchro_Wpanne'] = self.xml
+            standins.configure_core(core, pgrst, soap)
+            for mode in ('full', 'compact'):
+                core.RAW_PAYLOAD_MODE = mode
+                cron.run_cron_sync()
+                rows = {r['id_panne']: r for r in pgrst.rows('pannes')}
+                for item in self.items:
+                    row = rows[int(item['P0CLEUNIK'])]
+                    self.assertIsInstance(row['data'], dict)
+                    self.assertEqual(core.rebuild_raw(row, 'data'), item.to_dict())
+        finally:
+            core.RAW_PAYLOAD_MODE = raw_mode
+            soap.stop()
+            pgrst.stop()
+
+    def test_double_encoded_rows(self):
+        item = self.items[0].to_dict()
+        self.assertEqual(core.rebuild_raw({'data': json.dumps(item)}, 'data'), item)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Réconciliation des suppressions (soft): fenêtre des pannes, écritures en échec, lecteurs sans les supprimées"""
+
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+bootstrap = standins.load_api('bootstrap')
+export = standins.load_api('export')
+
+class ReconcilePannesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        self.soap = standins.Soap()
+        self.soap.payloads['get_Synchro_Wpanne'] = standins.soap_response(
+            'tabListeWpanne', standins.wpanne_items(20, n_equip=5, years=(2026,)))
+        standins.configure_core(core, self.pgrst, self.soap)
+        self.pgrst.tables['equipements'] = {1000 + i: {'id_wsoucont': 1000 + i, 'secteur': '1'} for i in range(5)}
+        self.pgrst.tables['pannes'] = {
+            1: {'id_panne': 1, 'id_wsoucont': 1000, 'appel_at': core.progilift_timestamp('20260102', '081500')},
+            # Écrite par api/cron.py: date_panne_at seulement
+            2: {'id_panne': 2, 'id_wsoucont': 1001, 'date_panne_at': core.progilift_timestamp('20260103')},
+            3: {'id_panne': 3, 'id_wsoucont': 1002, 'appel_at': core.progilift_timestamp('20240102', '081500')},
+        }
+
+    def tearDown(self):
+        self.soap.stop()
+        self.pgrst.stop()
+
+    def test_window_covers_cron_rows(self):
+        result = core.sync_pannes(0, reconcile_mode='soft', force=True)
+        self.assertEqual(result["reconcile"]["deleted"], 2)
+        pannes = self.pgrst.tables['pannes']
+        self.assertTrue(pannes[1]['deleted_at'] and pannes[2]['deleted_at'])
+        self.assertIsNone(pannes[3].get('deleted_at'))
+
+    def test_failed_upsert_skips_reconcile(self):
+        self.pgrst.fail.append(('POST', 'pannes', 503))
+        result = core.sync_pannes(0, reconcile_mode='soft', force=True)
+        self.assertIn("skipped", result["reconcile"])
+        self.assertFalse(any(p.get('deleted_at') for p in self.pgrst.rows('pannes')))
+
+    def test_plain_sync_restores_deleted_rows(self):
+        stamp = '2026-10-02T00:00:00+00:00'
+        self.pgrst.tables['pannes'][500000] = {'id_panne': 500000, 'deleted_at': stamp}
+        self.pgrst.tables['equipements'][1000]['deleted_at'] = stamp
+        self.soap.payloads['get_Synchro_Wsoucont'] = standins.soap_response(
+            'tabListeWsoucont', standins.wsoucont_items(5))
+        core.sync_pannes(0, force=True)
+        core.sync_equipements(0, force=True)
+        self.assertIsNone(self.pgrst.tables['pannes'][500000]['deleted_at'])
+        self.assertIsNone(self.pgrst.tables['equipements'][1000]['deleted_at'])
+
+class ReadersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        for module in (bootstrap, export):
+            module.SUPABASE_URL = self.pgrst.url
+            module.SUPABASE_KEY = 'test'
+        self.pgrst.tables['equipements'] = {
+            1: {'id_wsoucont': 1, 'nom': 'A', 'secteur': '1', 'updated_at': '2026-10-01T00:00:00+00:00'},
+            2: {'id_wsoucont': 2, 'nom': 'B', 'secteur': '1', 'updated_at': '2026-10-02T00:00:00+00:00',
+                'deleted_at': '2026-10-02T00:00:00+00:00'},
+        }
+        self.pgrst.tables['pannes'] = {
+            10: {'id_panne': 10, 'id_wsoucont': 1, 'date_appel': '20260105', 'heure_appel': '081500'},
+            11: {'id_panne': 11, 'id_wsoucont': 1, 'date_appel': '20260105', 'heure_appel': '091500',
+                 'deleted_at': '2026-10-02T00:00:00+00:00'},
+        }
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_bootstrap_full_and_delta(self):
+        full = bootstrap.get_bootstrap(names=['equipements'])['tables']['equipements']
+        self.assertEqual([r['id_wsoucont'] for r in full['rows']], [1])
+        self.assertNotIn('deleted', full)
+        delta = bootstrap.get_bootstrap('2026-10-01T12:00:00+00:00', ['equipements'])
+        table = delta['tables']['equipements']
+        self.assertEqual((table['rows'], table['deleted']), ([], [2]))
+        self.assertEqual(delta['since'], '2026-10-01T23:50:00+00:00')
+
+    def test_export_kpi_and_scores_skip_deleted(self):
+        self.assertEqual([r['id_panne'] for r in export.iter_rows('pannes', [], export.parse_request('table=pannes')[4])],
+                         [10])
+        self.assertEqual(core.update_kpis()["pannes"], 1)
+        self.assertEqual(core.update_scores()["updated"], 1)
+        self.assertNotIn('score_ml', self.pgrst.tables['equipements'][2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Colonnes calculées de equipements (cumuls pannes, score_ml): PATCH des lignes existantes, jamais d'insert"""
+
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+class RollupsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        self.pgrst.tables['equipements'] = {i: {'id_wsoucont': i, 'secteur': '1', 'ascenseur': f'ASC{i}'}
+                                            for i in (1, 2, 3)}
+        self.pgrst.tables['pannes'] = {
+            10: {'id_panne': 10, 'id_wsoucont': 1, 'date_appel': '20240105', 'heure_appel': '081500',
+                 'date_arrivee': '20240105', 'heure_arrivee': '091500', 'personnes_bloquees': '1'},
+            11: {'id_panne': 11, 'id_wsoucont': 4, 'date_appel': '20240105', 'heure_appel': '081500'},
+        }
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_rollups_patch_existing_rows_only(self):
+        self.assertEqual(core.update_equipement_rollups({1, 2, 3, 4}), 3)
+        self.assertEqual(self.pgrst.requests('POST', 'equipements'), [])
+        self.assertEqual(sorted(self.pgrst.tables['equipements']), [1, 2, 3])
+        eq1 = self.pgrst.tables['equipements'][1]
+        self.assertEqual((eq1['ascenseur'], eq1['pannes_365j'] >= 0, eq1['delai_arrivee_moyen'],
+                          eq1['incidents_personnes_bloquees']), ('ASC1', True, 60.0, 1))
+        # 2 et 3 sans panne: mêmes valeurs, une seule requête
+        self.assertEqual(len(self.pgrst.requests('PATCH', 'equipements')), 2)
+        self.assertEqual(core.sync_batch_summary()["ranges"]["equipements"], {'min': 1, 'max': 3, 'count': 3})
+
+    def test_failed_patch_is_not_counted(self):
+        self.pgrst.fail.append(('PATCH', 'equipements', 503))
+        self.assertEqual(core.update_equipement_rollups({1, 2, 3}), 2)
+
+class ScoresTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+        self.pgrst.tables['equipements'] = {i: {'id_wsoucont': i, 'secteur': '1', 'pannes_365j': i % 4,
+                                                'datepass1': 20240301} for i in range(1, 51)}
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def test_only_changed_scores_are_written(self):
+        first = core.update_scores()
+        self.assertEqual((first["status"], first["updated"]), ("success", 50))
+        self.assertEqual(self.pgrst.requests('POST', 'equipements'), [])
+        # Quatre profils de features, donc quatre valeurs de score: une requête chacune
+        self.assertEqual(len(self.pgrst.requests('PATCH', 'equipements')), 4)
+        self.assertTrue(all(0 < r['score_ml'] < 100 for r in self.pgrst.rows('equipements')))
+        again = core.update_scores()
+        self.assertEqual((again["updated"], again["unchanged"]), (0, 50))
+        self.pgrst.tables['equipements'][7]['pannes_365j'] = 40
+        self.assertEqual(core.update_scores()["updated"], 1)
+
+    def test_touched_only_reads_those_rows(self):
+        core.update_scores()
+        self.pgrst.log.clear()
+        for i in (7, 8):
+            self.pgrst.tables['equipements'][i]['pannes_365j'] = 40
+        result = core.update_scores({7, 8, 99})
+        self.assertEqual((result["scope"], result["equipements"], result["updated"]), ("touched", 2, 2))
+        gets = self.pgrst.requests('GET', 'equipements')
+        self.assertEqual(len(gets), 1)
+        self.assertIn('id_wsoucont=in.(7,8,99)', gets[0][2])
+        self.assertEqual(core.update_scores(set())["equipements"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""/api/equipements/search: JWT obligatoire, paramètres invalides en 400, lignes supprimées hors index"""
+
+import http.client
+import json
+import unittest
+from urllib.parse import urlsplit
+
+from tests import standins
+
+search = standins.load_api('equipements/search')
+
+USER = standins.user_jwt()
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        self.api = standins.Server(search.handler)
+        standins.configure_auth(self.pgrst)
+        search.SUPABASE_URL = self.pgrst.url
+        search.SUPABASE_KEY = 'server'
+        search.INDEX = None
+        self.pgrst.tables['equipements'] = {
+            1: {'id_wsoucont': 1, 'secteur': '3', 'adresse': '12 rue de la Paix', 'updated_at': '2026-10-01T00:00:00+00:00'},
+            2: {'id_wsoucont': 2, 'secteur': '3', 'adresse': '4 rue de la Paix', 'updated_at': '2026-10-01T00:00:00+00:00',
+                'deleted_at': '2026-10-01T00:00:00+00:00'},
+        }
+
+    def tearDown(self):
+        search.INDEX = None
+        self.api.stop()
+        self.pgrst.stop()
+
+    def get(self, query, token=USER):
+        parts = urlsplit(self.api.url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+        conn.request('GET', f"/api/equipements/search?{query}",
+                     headers={'Authorization': f'Bearer {token}'} if token else {})
+        resp = conn.getresponse()
+        try:
+            return resp.status, json.loads(resp.read())
+        finally:
+            conn.close()
+
+    def test_user_token_required(self):
+        for token in (None, standins.user_jwt('anon')):
+            self.assertEqual(self.get('q=paix', token)[0], 401)
+        self.assertEqual(self.pgrst.requests('GET', 'equipements'), [])
+
+    def test_invalid_pagination_is_400(self):
+        for query in ('page=abc', 'page_size=-3', 'page=1e9'):
+            status, result = self.get(query)
+            self.assertEqual((status, result['status']), (400, 'error'), query)
+
+    def test_search_skips_deleted_rows(self):
+        status, result = self.get('q=paix&secteur=3')
+        self.assertEqual(status, 200)
+        self.assertEqual([r['id_wsoucont'] for r in result['results']], [1])
+
+if __name__ == '__main__':
+    unittest.main()
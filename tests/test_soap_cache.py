@@ -0,0 +1,83 @@
+"""Cache SOAP (SOAP_CACHE_DIR) et rejeu (&replay=1): clés de cache, aucun appel Progilift en rejeu"""
+
+import gzip
+import os
+import tempfile
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+class SoapCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        self.soap = standins.Soap()
+        self.soap.payloads['get_Synchro_Wsoucont'] = standins.soap_response(
+            'tabListeWsoucont', standins.wsoucont_items(12))
+        self.soap.payloads['get_Synchro_Wpanne'] = standins.soap_response(
+            'tabListeWpanne', standins.wpanne_items(15, n_equip=12))
+        standins.configure_core(core, self.pgrst, self.soap)
+        self.saved = core.SOAP_CACHE_DIR, core.SOAP_REPLAY
+        core.SOAP_CACHE_DIR = tempfile.mkdtemp(prefix='soap-cache-')
+
+    def tearDown(self):
+        core.SOAP_CACHE_DIR, core.SOAP_REPLAY = self.saved
+        self.soap.stop()
+        self.pgrst.stop()
+
+    def cached(self):
+        return sorted(os.listdir(core.SOAP_CACHE_DIR))
+
+    def test_cache_keys(self):
+        self.assertEqual(core.soap_cache_key('get_Synchro_Wpanne', {'a': 1, 'b': 2}),
+                         core.soap_cache_key('get_Synchro_Wpanne', {'b': 2, 'a': 1}))
+        self.assertNotEqual(core.soap_cache_key('get_Synchro_Wpanne', {'a': 1}),
+                            core.soap_cache_key('get_Synchro_Wpanne', {'a': 2}))
+        self.assertNotEqual(core.soap_cache_key('get_Synchro_Wpanne', {}),
+                            core.soap_cache_key('get_AppareilsArret', {}))
+        core.sync_equipements(0)
+        core.sync_equipements(1)
+        names = self.cached()
+        # Un fichier par secteur, jamais l'authentification (WSID propre à la session)
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(n.startswith('get_Synchro_Wsoucont-') and n.endswith('.xml.gz') for n in names))
+        for idx, sector in ((0, core.SECTORS[0]), (1, core.SECTORS[1])):
+            key = core.soap_cache_key('get_Synchro_Wsoucont', {"dhDerniereMajFichier": "2000-01-01T00:00:00",
+                                                               "sListeSecteursTechnicien": sector})
+            self.assertEqual(sum(n.startswith(key + '-') for n in names), 1, sector)
+
+    def test_replay_makes_no_soap_calls(self):
+        core.sync_equipements(0)
+        core.sync_pannes(0, lowmem=True)
+        written = {k: dict(v) for k, v in self.pgrst.tables['equipements'].items()}
+        self.soap.calls.clear()
+        self.pgrst.tables.clear()
+        core.SOAP_REPLAY = True
+        self.assertEqual(core.sync_equipements(0)["upserted"], 12)
+        self.assertEqual(core.sync_pannes(0, lowmem=True)["upserted"], 15)
+        self.assertEqual(self.soap.calls, [])
+        strip = lambda rows: {k: {c: v for c, v in r.items() if c != 'updated_at'} for k, r in rows.items()}
+        self.assertEqual(strip(self.pgrst.tables['equipements']), strip(written))
+
+    def test_replay_miss_raises(self):
+        core.SOAP_REPLAY = True
+        with self.assertRaises(RuntimeError):
+            core.sync_equipements(0)
+        with self.assertRaises(RuntimeError):
+            core.sync_pannes(0, lowmem=True)
+        self.assertEqual(self.soap.calls, [])
+        self.assertNotIn('equipements', self.pgrst.tables)
+
+    def test_latest_cached_response_wins(self):
+        params = {'dhDerniereMajFichier': '2000-01-01T00:00:00'}
+        key = core.soap_cache_key('get_AppareilsArret', params)
+        for day, body in (('20261001', 'ancienne'), ('20261018', 'récente')):
+            with gzip.open(os.path.join(core.SOAP_CACHE_DIR, f"{key}-{day}.xml.gz"), 'wt', encoding='utf-8') as f:
+                f.write(body)
+        self.assertEqual(core.soap_cache_get('get_AppareilsArret', params), 'récente')
+        self.assertIsNone(core.soap_cache_get('get_AppareilsArret', {}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Spool des écritures en échec: rejeu des échecs passagers, lettre morte pour le reste"""
+
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+import unittest
+
+from tests import standins
+
+core = standins.load_core()
+
+def entries(pattern):
+    out = []
+    for path in glob.glob(os.path.join(core.SPOOL_DIR, pattern)):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            out += [json.loads(line) for line in f if line.strip()]
+    return out
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pgrst = standins.Postgrest()
+        standins.configure_core(core, self.pgrst)
+
+    def tearDown(self):
+        self.pgrst.stop()
+
+    def upsert_failing(self, status, table='pannes'):
+        self.pgrst.fail.append(('POST', table, status))
+        return core.supabase_upsert(table, [{'id_panne': 1, 'motif': 'x'}])
+
+    def test_transient_is_replayed(self):
+        for status in (503, 429):
+            self.assertFalse(self.upsert_failing(status))
+        self.assertEqual(len(entries('spool-*.ndjson.gz')), 2)
+        stats = core.replay_spool()
+        self.assertEqual(stats["replayed"], 2)
+        self.assertEqual(self.pgrst.rows('pannes'), [{'id_panne': 1, 'motif': 'x'}])
+        self.assertEqual(entries('spool-*.ndjson.gz'), [])
+
+    def test_client_error_is_dead_lettered(self):
+        self.assertFalse(self.upsert_failing(400))
+        self.assertEqual(entries('spool-*.ndjson.gz'), [])
+        dead = entries('deadletter-*.ndjson.gz')
+        self.assertEqual([(d['status'], d['reason']) for d in dead], [(400, 'HTTP 400')])
+        self.assertEqual(core.replay_spool()["files"], 0)
+        self.assertEqual(self.pgrst.requests('POST', 'pannes')[1:], [])
+        self.assertEqual(core.METRICS['dead_letters'], {'pannes': 1})
+
+    def test_attempts_are_capped(self):
+        self.assertFalse(self.upsert_failing(503))
+        for attempt in range(2, core.SPOOL_MAX_ATTEMPTS + 1):
+            self.pgrst.fail.append(('POST', 'pannes', 503))
+            stats = core.replay_spool()
+            self.assertEqual(stats["failed"], 1)
+            spooled = entries('spool-*.ndjson.gz')
+            if attempt < core.SPOOL_MAX_ATTEMPTS:
+                self.assertEqual([e['attempts'] for e in spooled], [attempt])
+        self.assertEqual(entries('spool-*.ndjson.gz'), [])
+        self.assertEqual([d['reason'] for d in entries('deadletter-*.ndjson.gz')], ['max attempts'])
+
+    def test_old_entries_expire(self):
+        entry = {'op': 'upsert', 'table': 'pannes', 'data': [{'id_panne': 2}],
+                 'attempts': 1, 'created_at': time.time() - core.SPOOL_MAX_AGE - 1}
+        self.assertTrue(core.spool_write(entry, 503, entry))
+        self.assertEqual([d['reason'] for d in entries('deadletter-*.ndjson.gz')], ['expired'])
+
+    def test_invocation_logs_are_not_spooled(self):
+        for table in ('sync_events', 'sync_metrics'):
+            self.pgrst.fail.append(('POST', table, 503))
+            self.assertFalse(core.supabase_insert(table, {'id': 1}))
+        self.assertEqual(glob.glob(os.path.join(core.SPOOL_DIR, '*.ndjson.gz')), [])
+
+    def test_truncated_file_keeps_decoded_entries(self):
+        for i in range(3):
+            self.pgrst.fail.append(('POST', 'pannes', 503))
+            self.assertFalse(core.supabase_upsert('pannes', [{'id_panne': 10 + i}]))
+        path = core.spool_path()
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(b'{"op": "upsert", "table": "pannes", "data": [{"id_panne": 99}]}\n')[:-12])
+        stats = core.replay_spool()
+        self.assertEqual((stats["replayed"], stats["unreadable"]), (3, 1))
+        self.assertEqual(sorted(self.pgrst.tables['pannes']), [10, 11, 12])
+        # Fichier gardé pour inspection, jamais rejoué
+        kept = glob.glob(os.path.join(core.SPOOL_DIR, 'deadletter-unreadable-*.ndjson.gz'))
+        self.assertEqual(len(kept), 1)
+        self.assertEqual(core.replay_spool()["files"], 0)
+
+    def test_concurrent_appends_stay_readable(self):
+        def spool(n):
+            for i in range(50):
+                core.spool_write({'op': 'upsert', 'table': 'pannes', 'data': [{'id_panne': n * 100 + i}]}, 503)
+        threads = [threading.Thread(target=spool, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        spooled, readable = core.read_spool(core.spool_path())
+        self.assertTrue(readable)
+        self.assertEqual(len(spooled), 400)
+
+if __name__ == '__main__':
+    unittest.main()